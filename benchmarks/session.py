@@ -0,0 +1,138 @@
+"""
+Prefill benchmark of the analysis sessions: asks several questions about the
+same trace with the question placed before the trace, as the prompts used to
+be built, and at the end of the stable prefix of an analysis session, and
+reports the prompt tokens the server had to prefill for each question.
+
+By default the questions are sent to a local stand-in of the Ollama chat API
+that keeps the last prompt of the loaded model as its prompt cache, like
+Ollama does, and spends a fixed time on each token it has to prefill. With
+--host the questions are sent to a real Ollama server instead.
+
+Usage:
+    python3 benchmarks/session.py [--host http://localhost:11434] [--rows N] [--tokens-per-second N]
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain.prompts import ChatPromptTemplate
+from netexplainer.llm import LLM_QWEN_2_5_7B
+from netexplainer.render import estimate_tokens
+
+QUESTIONS = [
+    "What is the total number of packets in the trace?",
+    "How long in seconds does the communication last?",
+    "Which protocol appears most often?",
+    "How many different IP addresses take part in the communication?",
+    "What is the average length of the packets?",
+]
+
+LEGACY_TEMPLATE = """You are a network analyst that answer questions about network traces.
+        Use the following network trace to answer the questions.
+        DON'T GIVE FUNCTIONS OR CODE, ONLY THE ANSWER.
+        Question: "{question}"
+        Trace:
+        {traces}"""
+
+
+def stand_in(tokens_per_second: float) -> ThreadingHTTPServer:
+    """
+    Start a stand-in of the Ollama chat API with a prompt cache of the last prompt of each model
+    """
+    cache = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            prompt = "".join(f"{message['role']}\n{message['content']}\n" for message in request["messages"])
+            settings = (request.get("keep_alive"), json.dumps(request.get("options") or {}, sort_keys=True))
+            with lock:
+                # Changing the settings of the model reloads it and drops its prompt cache
+                cached_settings, cached_prompt = cache.get(request["model"], (None, ""))
+                common = os.path.commonprefix([cached_prompt, prompt]) if cached_settings == settings else ""
+                cache[request["model"]] = (settings, prompt)
+                prefill = estimate_tokens(prompt[len(common):])
+                duration = prefill / tokens_per_second
+                time.sleep(duration)
+
+            body = json.dumps({
+                "model": request["model"],
+                "created_at": "2026-01-01T00:00:00Z",
+                "message": {"role": "assistant", "content": "42"},
+                "done": True,
+                "done_reason": "stop",
+                "total_duration": int(duration * 1e9),
+                "prompt_eval_count": prefill,
+                "prompt_eval_duration": int(duration * 1e9),
+                "eval_count": 1,
+                "eval_duration": 1,
+            }).encode() + b"\n"
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthetic_trace(path: str, rows: int) -> None:
+    with open(path, "w") as f:
+        f.write("No.|Time|Source|Destination|Protocol|Length\n")
+        for i in range(rows):
+            f.write(f"{i + 1} | {i * 0.001:.6f} | 10.0.{i % 256}.1 | 10.0.0.2 | {('TCP', 'UDP', 'ICMP')[i % 3]} | {60 + i % 1400}\n")
+
+
+def run(llm, build) -> tuple:
+    prefilled, seconds = 0, 0.0
+    for question in QUESTIONS:
+        response = llm.invoke(build(question))
+        prefilled += response.response_metadata["prompt_eval_count"]
+        seconds += response.response_metadata["prompt_eval_duration"] / 1e9
+    return prefilled, seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", help="Ollama server to benchmark, a local stand-in if not given")
+    parser.add_argument("--rows", type=int, default=1500)
+    parser.add_argument("--tokens-per-second", type=float, default=10000, help="Prefill speed of the stand-in in tokens per second")
+    args = parser.parse_args()
+
+    server = None
+    if args.host is None:
+        server = stand_in(args.tokens_per_second)
+        args.host = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["OLLAMA_HOST"] = args.host
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        trace = os.path.join(tmpdir, "trace.txt")
+        synthetic_trace(trace, args.rows)
+        llm = LLM_QWEN_2_5_7B(trace, cache=False)
+        legacy = ChatPromptTemplate.from_template(LEGACY_TEMPLATE)
+        print(f"Server: {args.host}, trace of {estimate_tokens(llm.file[0].page_content)} tokens, {len(QUESTIONS)} questions")
+
+        results = {
+            "question first": run(llm, lambda question: legacy.format_messages(question=question, traces=llm.fit_trace(legacy, question=question))),
+            "session": run(llm, llm.answer_messages),
+        }
+        print(f"{'prompt':>15} {'prefilled tokens':>17} {'prefill s':>10}")
+        for name, (prefilled, seconds) in results.items():
+            print(f"{name:>15} {prefilled:17d} {seconds:10.2f}")
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Scaling benchmark of the sharded ground truth: computes the statistics of a
+capture with 1 to N processes and reports the speedup over a single pass.
+
+Usage:
+    python3 benchmarks/shard.py [capture] [--workers 1 2 4 8] [--packets N]
+
+Without a capture, a synthetic one with --packets packets is generated.
+"""
+import os
+import time
+import struct
+import argparse
+import tempfile
+from scapy.all import Ether, IP, IPv6, TCP, UDP, ICMP, raw
+from netexplainer.shard import sharded_stats
+from netexplainer.table import PacketTable
+
+
+def synthetic_capture(path: str, packets: int) -> None:
+    templates = [
+        raw(Ether(dst="00:00:00:00:00:02") / IP(src=f"10.0.{i % 256}.1", dst="10.0.0.2") / TCP(sport=1024 + i, dport=80) / (b"x" * (i % 64)))
+        for i in range(200)
+    ] + [
+        raw(Ether(dst="00:00:00:00:00:02") / IP(src="10.0.1.1", dst="10.0.2.2") / UDP() / b"payload"),
+        raw(Ether(dst="00:00:00:00:00:02") / IP(src="10.0.3.1", dst="10.0.4.2") / ICMP()),
+        raw(Ether(dst="00:00:00:00:00:02") / IPv6(src="2001:db8::1", dst="2001:db8::2") / TCP()),
+    ]
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for i in range(packets):
+            data = templates[i % len(templates)]
+            f.write(struct.pack("<IIII", 1700000000 + i // 1000, (i % 1000) * 1000, len(data), len(data)))
+            f.write(data)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", nargs="?", help="Capture to read, a synthetic one if not given")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--packets", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        capture = args.capture
+        if capture is None:
+            capture = os.path.join(tmpdir, "synthetic.pcap")
+            synthetic_capture(capture, args.packets)
+        print(f"Capture: {capture} ({os.path.getsize(capture) / 2 ** 20:.1f} MiB)")
+
+        start = time.perf_counter()
+        serial = PacketTable.from_file(capture).stats()
+        baseline = time.perf_counter() - start
+        print(f"{'serial':>8}: {baseline:8.2f} s")
+
+        for workers in args.workers:
+            start = time.perf_counter()
+            stats = sharded_stats(capture, workers, min_shard_size=1)
+            elapsed = time.perf_counter() - start
+            assert vars(stats) == vars(serial), "sharded statistics differ from the serial ones"
+            print(f"{workers:>8}: {elapsed:8.2f} s  speedup {baseline / elapsed:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
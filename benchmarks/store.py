@@ -0,0 +1,81 @@
+"""
+Read throughput benchmark of the compressed capture store: reads a capture
+stored uncompressed and compressed with each codec, and reports the size on
+disk and the time to decompress it, count its records and compute its records
+for the ground truth.
+
+The pages of each file are dropped from the page cache before every read, when
+the platform allows it, so the times approximate cold-cache reads.
+
+Usage:
+    python3 benchmarks/store.py [capture] [--codecs gzip zstd] [--packets N]
+
+Without a capture, a synthetic one with --packets packets is generated.
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from shard import synthetic_capture
+from netexplainer.reader import count_records, read_records
+from netexplainer.store import CODECS, CHUNK_SIZE, compress_capture, open_capture
+
+
+def drop_cache(path: str) -> None:
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def timed(path: str, function) -> float:
+    drop_cache(path)
+    start = time.perf_counter()
+    function(path)
+    return time.perf_counter() - start
+
+
+def decompress(path: str) -> None:
+    with open_capture(path) as stream:
+        while stream.read(CHUNK_SIZE):
+            pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", nargs="?", help="Capture to read, a synthetic one if not given")
+    parser.add_argument("--codecs", nargs="+", choices=CODECS, default=list(CODECS))
+    parser.add_argument("--packets", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        capture = os.path.join(tmpdir, "capture.pcap")
+        if args.capture is None:
+            synthetic_capture(capture, args.packets)
+        else:
+            shutil.copy(args.capture, capture)
+        size = os.path.getsize(capture) / 2 ** 20
+        print(f"Capture: {args.capture or 'synthetic'} ({size:.1f} MiB)")
+
+        stored = {"none": capture}
+        for codec in args.codecs:
+            copy = os.path.join(tmpdir, f"{codec}.pcap")
+            shutil.copy(capture, copy)
+            start = time.perf_counter()
+            stored[codec] = compress_capture(copy, codec)
+            print(f"Compressed with {codec} in {time.perf_counter() - start:.2f} s")
+
+        print(f"{'codec':>6} {'MiB':>8} {'ratio':>6} {'read MiB/s':>11} {'count s':>8} {'records s':>10}")
+        for codec, path in stored.items():
+            stored_size = os.path.getsize(path) / 2 ** 20
+            read = timed(path, decompress)
+            count = timed(path, count_records)
+            records = timed(path, lambda path: sum(1 for _ in read_records(path)))
+            print(f"{codec:>6} {stored_size:8.1f} {size / stored_size:6.1f} {size / read:11.1f} {count:8.2f} {records:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ from pathlib import Path
 from netexplainer.scraper import Scraper
 from netexplainer.logger import configure_logger
 from netexplainer.evaluator import Evaluator, QUESTIONS_PATH
+from netexplainer.llm import BATCH_MODES, PROMPT_MODES, MAX_CONCURRENT_SUBQUESTIONS
+from netexplainer.store import CODECS
 
 configure_logger(name="main", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
 logger = logging.getLogger("main")
@@ -18,10 +20,18 @@ if __name__ == "__main__":
     group.add_argument("--download-data", action="store_true", help="Download network files from Wireshark samples")
     group.add_argument("--clean-data", type=int, metavar="<N>", help="Keep network files with a maximum of N packets")
 
+    parser.add_argument("--compress", choices=CODECS, help="Store the downloaded network files compressed with this codec")
+    parser.add_argument("--chunked", action="store_true", help="Answer over windows of the traces that do not fit the context of the model")
+    parser.add_argument("--prompt-mode", choices=PROMPT_MODES, default="rows", help="Show the packets, the precomputed summaries or both to the models")
+    parser.add_argument("--select", metavar="<CONDITION>", help="Only evaluate the captures matching an SQL condition on the catalog, e.g. \"tcp > packets / 2 AND packets < 500\"")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_SUBQUESTIONS, metavar="<N>", help="Answer up to N sub-questions of a question at the same time")
+    parser.add_argument("--batch", choices=BATCH_MODES, help="Answer the sub-questions of each question, or every question of each trace, in a single call")
+    parser.add_argument("--no-cache", action="store_true", help="Ask the models again instead of reusing their cached responses")
+
     args = parser.parse_args()
 
     if args.download_data:
-        scraper = Scraper()
+        scraper = Scraper(compression=args.compress)
         scraper.download_captures()
         logger.debug("Downloaded network files from Wireshark samples")
         sys.exit(0)
@@ -40,5 +50,5 @@ if __name__ == "__main__":
 
     evaluator = Evaluator()
 
-    evaluator.evaluate(models_to_evaluate=models_to_evaluate, tools=False)
-    evaluator.evaluate(models_to_evaluate=models_to_evaluate, tools=True)
+    evaluator.evaluate(models_to_evaluate=models_to_evaluate, tools=False, chunked=args.chunked, prompt_mode=args.prompt_mode, selection=args.select, cache=not args.no_cache, concurrency=args.concurrency, batch=args.batch)
+    evaluator.evaluate(models_to_evaluate=models_to_evaluate, tools=True, chunked=args.chunked, prompt_mode=args.prompt_mode, selection=args.select, cache=not args.no_cache, concurrency=args.concurrency, batch=args.batch)
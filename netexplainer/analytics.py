@@ -0,0 +1,204 @@
+import logging
+from pathlib import Path
+from netexplainer.logger import configure_logger
+from netexplainer.reader import FIELDS, read_records
+from netexplainer.stats import TraceStats
+from netexplainer.table import PacketTable
+from netexplainer.shard import sharded_stats
+from netexplainer.sketch import TraceSketch
+
+configure_logger(name="analytics", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("analytics")
+
+"""
+This dictionary maps each supported question to the function that answers it
+and the packet fields that function needs.
+"""
+ANALYTICS = {}
+
+"""
+This dictionary maps the questions whose exact answer needs unbounded memory
+to the function that answers them approximately from a sketch.TraceSketch.
+"""
+APPROXIMATE_ANALYTICS = {}
+
+NO_DURATION = "There is only one packet in the trace, operation not possible"
+
+
+def analytic(question: str, fields: tuple = ()):
+    """
+    Register the decorated function as the answer to a question
+
+    Args:
+        question (str): The question answered by the function
+        fields (tuple): The packet fields the function needs, from reader.FIELDS
+
+    Returns:
+        Callable: The decorator
+    """
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown packet fields {unknown} for question {question}")
+
+    def register(function):
+        ANALYTICS[question] = (function, frozenset(fields))
+        return function
+    return register
+
+
+def approximate_analytic(question: str):
+    """
+    Register the decorated function as the approximate answer to a question, see APPROXIMATE_ANALYTICS
+
+    Args:
+        question (str): The question answered by the function, already registered with analytic
+
+    Returns:
+        Callable: The decorator
+    """
+    def register(function):
+        APPROXIMATE_ANALYTICS[question] = function
+        return function
+    return register
+
+
+def required_fields(questions) -> frozenset:
+    """
+    Get the packet fields needed to answer a set of questions
+
+    Args:
+        questions (Iterable[str]): The questions to answer
+
+    Returns:
+        frozenset: The union of the fields of the analytics of the questions
+    """
+    return frozenset().union(*(ANALYTICS[question][1] for question in questions if question in ANALYTICS))
+
+
+def answer_questions(file_path: str, questions, workers: int = 1, approximate: dict | None = None) -> dict:
+    """
+    Answer the questions over a capture, decoding only the fields they need in a single pass
+
+    Args:
+        file_path (str): The path of the capture
+        questions (Iterable[str]): The questions to answer, the ones without analytic are skipped
+        workers (int): The number of processes to split the capture between, see shard.sharded_stats
+        approximate (dict | None): The error bounds of the sketches to answer in bounded memory,
+            see sketch.TraceSketch, None for exact answers
+
+    Returns:
+        dict: Dictionary with the questions and answers
+    """
+    questions = [question for question in questions if question in ANALYTICS]
+    fields = required_fields(questions)
+    logger.debug(f'Answering {len(questions)} questions for file {file_path} with fields {sorted(fields)}')
+
+    if approximate is not None:
+        return answer_stats(sharded_stats(file_path, workers, fields, approximate=approximate), questions, approximate=True)
+    if workers > 1:
+        return answer_stats(sharded_stats(file_path, workers, fields), questions)
+    return answer_records(read_records(file_path, fields), questions)
+
+
+def answer_records(records, questions) -> dict:
+    """
+    Answer the questions over records already decoded from a capture
+
+    Args:
+        records (Iterable[tuple]): The (time, length, addresses, protocol) records, see reader.read_records
+        questions (Iterable[str]): The questions to answer, the ones without analytic are skipped
+
+    Returns:
+        dict: Dictionary with the questions and answers
+    """
+    return answer_stats(PacketTable.from_records(records).stats(), questions)
+
+
+def answer_stats(stats: TraceStats, questions, approximate: bool = False) -> dict:
+    """
+    Answer the questions from the statistics of a capture
+
+    Args:
+        stats (TraceStats): The statistics of the capture, a sketch.TraceSketch if approximate
+        questions (Iterable[str]): The questions to answer, the ones without analytic are skipped
+        approximate (bool): Whether to use the approximate analytics of the questions that have one
+
+    Returns:
+        dict: Dictionary with the questions and answers
+    """
+    answers = {}
+    for question in questions:
+        if approximate and question in APPROXIMATE_ANALYTICS:
+            answers[question] = APPROXIMATE_ANALYTICS[question](stats)
+        elif question in ANALYTICS:
+            answers[question] = ANALYTICS[question][0](stats)
+    return answers
+
+
+@analytic("What is the total number of packets in the trace?")
+def total_packets(stats: TraceStats):
+    return stats.packets
+
+
+@analytic("How many unique communicators are present in the trace?", fields=("address",))
+def unique_communicators(stats: TraceStats):
+    return len(stats.ip_count)
+
+
+@analytic("What is the IP that participates the most in communications in the trace?", fields=("address",))
+def most_common_ip(stats: TraceStats):
+    ip_count = stats.ip_count
+    if not ip_count:
+        return "No IP communications found"
+    max_count = max(ip_count.values())
+    most_common_ips = [ip for ip, count in ip_count.items() if count == max_count]
+    return " or ".join(most_common_ips) if len(most_common_ips) > 1 else most_common_ips[0]
+
+
+@approximate_analytic("How many unique communicators are present in the trace?")
+def approximate_unique_communicators(stats: TraceSketch):
+    distinct = stats.distinct_addresses
+    return f"{distinct.count()} (approximate, relative standard error {distinct.error:.2%})"
+
+
+@approximate_analytic("What is the IP that participates the most in communications in the trace?")
+def approximate_most_common_ip(stats: TraceSketch):
+    top = stats.top_addresses.top()
+    if not top:
+        return "No IP communications found"
+    ips = " or ".join(ip for ip, _, _ in top)
+    _, count, error = max(top, key=lambda item: item[2])
+    return f"{ips} (approximate, appears {count} times, overestimated by at most {error})"
+
+
+@analytic("What is the total size of transmitted bytes?", fields=("length",))
+def total_size(stats: TraceStats):
+    return stats.total_size
+
+
+@analytic("What is the average size of packets in bytes?", fields=("length",))
+def average_size(stats: TraceStats):
+    return stats.total_size / stats.packets if stats.packets else 0
+
+
+@analytic("What predominates in the capture: ICMP, TCP, or UDP?", fields=("protocol",))
+def predominant_protocol(stats: TraceStats):
+    protocol_count = stats.protocol_count
+    if sum(protocol_count.values()) == 0:
+        return "No ICMP, ICMPv6, TCP, or UDP packets found"
+    return max(protocol_count, key=protocol_count.get)
+
+
+@analytic("How long in seconds does the communication last?", fields=("time",))
+def duration(stats: TraceStats):
+    return stats.duration
+
+
+@analytic("What is the average number of packets sent per second?", fields=("time",))
+def average_packets_per_second(stats: TraceStats):
+    return stats.packets / stats.duration if stats.duration > 0 else NO_DURATION
+
+
+@analytic("What is the average bytes/s sent in the communication?", fields=("time", "length"))
+def average_bytes_per_second(stats: TraceStats):
+    return stats.total_size / stats.duration if stats.duration > 0 else NO_DURATION
@@ -0,0 +1,411 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import logging
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import lru_cache
+from pathlib import Path
+from subprocess import check_output
+import scapy
+from netexplainer.logger import configure_logger
+
+configure_logger(name="cache", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("cache")
+ANSWERS_CACHE_PATH = Path(__file__).parent / "data/cache/answers"
+RENDERED_CACHE_PATH = Path(__file__).parent / "data/cache/rendered"
+RESPONSES_CACHE_PATH = Path(__file__).parent / "data/cache/responses.sqlite"
+
+"""
+Maximum size in bytes of the cached responses of the models, the least
+recently used responses are evicted beyond it.
+"""
+RESPONSES_CACHE_SIZE = 256 * 2 ** 20
+
+"""
+Modules whose code determines the ground truth answers and the summaries.
+Changing any of them invalidates the cached answers and summaries.
+"""
+ANALYSIS_MODULES = ("store", "reader", "stats", "table", "shard", "sketch", "analytics", "summary")
+
+"""
+File mode creation mask of the process, read once at import since reading it
+means setting it. The files written atomically get the mode open() would give them.
+"""
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Compute the SHA-256 of a file, reading it in chunks
+
+    Args:
+        file_path (str): The path of the file
+
+    Returns:
+        str: The hexadecimal digest of the content of the file
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def questions_hash(questions) -> str:
+    """
+    Compute the hash of a set of questions
+
+    Args:
+        questions (Iterable[str]): The questions, in the order they are answered
+
+    Returns:
+        str: The hexadecimal digest of the questions
+    """
+    return hashlib.sha256(json.dumps(list(questions)).encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def analysis_version() -> str:
+    """
+    Compute the version of the analysis code from its sources and the scapy version
+
+    Returns:
+        str: The hexadecimal digest of the analysis code
+    """
+    digest = hashlib.sha256(scapy.__version__.encode('utf-8'))
+    for module in ANALYSIS_MODULES:
+        digest.update((Path(__file__).parent / f"{module}.py").read_bytes())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def tshark_version() -> str:
+    """
+    Get the version of the installed tshark, which determines the rendered traces
+
+    Returns:
+        str: The first line of the output of tshark --version
+    """
+    return check_output(["tshark", "--version"]).decode("utf-8").splitlines()[0].strip()
+
+
+@contextmanager
+def atomic_writer(path: Path, mode: str = 'w'):
+    """
+    Open a temporary file next to path that replaces it only once fully written,
+    so readers and concurrent writers never see a partial file
+
+    Args:
+        path (Path): The final path of the file
+        mode (str): The mode to open the temporary file with
+
+    Yields:
+        file: The temporary file
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        # mkstemp creates the file readable by its owner only
+        os.fchmod(fd, 0o666 & ~UMASK)
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return {"decimal": str(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(value: dict):
+    if set(value) == {"decimal"}:
+        return Decimal(value["decimal"])
+    return value
+
+
+class AnswerCache:
+    """
+    On-disk cache of the ground truth answers of the captures
+    """
+    def __init__(self, cache_dir: str = ANSWERS_CACHE_PATH):
+        """
+        Initialize the cache in the directory provided
+
+        Args:
+            cache_dir (str): The directory where the answers are stored
+        """
+        self.cache_dir = Path(cache_dir)
+
+    def __entry_path(self, capture_hash: str, variant: str | None) -> Path:
+        if variant is None:
+            return self.cache_dir / f"{capture_hash}.json"
+        return self.cache_dir / f"{capture_hash}-{variant}.json"
+
+    def get(self, capture_hash: str, questions, variant: str | None = None) -> dict | None:
+        """
+        Get the answers of a capture if they are cached and up to date
+
+        Args:
+            capture_hash (str): The hash of the content of the capture
+            questions (Iterable[str]): The questions to answer
+            variant (str | None): The way the answers are computed, None for the exact answers
+
+        Returns:
+            dict | None: The questions and answers, None if there is no valid entry
+        """
+        path = self.__entry_path(capture_hash, variant)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f, object_hook=_decode)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return None
+
+        if entry.get("questions") != questions_hash(questions) or entry.get("version") != analysis_version():
+            logger.debug(f"Cache entry {path} is stale")
+            return None
+
+        logger.debug(f"Loaded answers for capture {capture_hash} from cache")
+        return entry["answers"]
+
+    def put(self, capture_hash: str, questions, answers: dict, variant: str | None = None) -> None:
+        """
+        Store the answers of a capture, replacing any previous entry
+
+        Args:
+            capture_hash (str): The hash of the content of the capture
+            questions (Iterable[str]): The questions answered
+            answers (dict): The questions and answers
+            variant (str | None): The way the answers are computed, None for the exact answers
+        """
+        entry = {
+            "questions": questions_hash(questions),
+            "version": analysis_version(),
+            "answers": answers,
+        }
+        try:
+            with atomic_writer(self.__entry_path(capture_hash, variant)) as f:
+                json.dump(entry, f, default=_encode)
+            logger.debug(f"Stored answers for capture {capture_hash} in cache")
+        except (OSError, TypeError) as e:
+            logger.warning(f"Could not store answers for capture {capture_hash} in cache: {e}")
+
+
+class RenderCache:
+    """
+    On-disk cache of the rendered text of the captures, one file per capture,
+    rendering variant and tshark version
+    """
+    def __init__(self, cache_dir: str = RENDERED_CACHE_PATH):
+        """
+        Initialize the cache in the directory provided
+
+        Args:
+            cache_dir (str): The directory where the rendered traces are stored
+        """
+        self.cache_dir = Path(cache_dir)
+
+    def path(self, capture_hash: str, variant: str) -> Path:
+        """
+        Get the path of the rendered trace of a capture
+
+        Args:
+            capture_hash (str): The hash of the content of the capture
+            variant (str): The rendering variant, e.g. the context window size
+
+        Returns:
+            Path: The path of the rendered trace, whether it exists or not
+        """
+        version = hashlib.sha256(tshark_version().encode('utf-8')).hexdigest()[:12]
+        return self.cache_dir / f"{capture_hash}-{variant}-{version}.txt"
+
+    def get(self, capture_hash: str, variant: str) -> Path | None:
+        """
+        Get the rendered trace of a capture if it is cached
+
+        Args:
+            capture_hash (str): The hash of the content of the capture
+            variant (str): The rendering variant
+
+        Returns:
+            Path | None: The path of the rendered trace, None if it is not cached
+        """
+        path = self.path(capture_hash, variant)
+        if path.is_file():
+            logger.debug(f"Reusing rendered trace {path}")
+            return path
+        return None
+
+    @contextmanager
+    def writer(self, capture_hash: str, variant: str):
+        """
+        Open the rendered trace of a capture for writing, publishing it atomically once written
+
+        Args:
+            capture_hash (str): The hash of the content of the capture
+            variant (str): The rendering variant
+
+        Yields:
+            file: The file to write the rendered trace to
+        """
+        path = self.path(capture_hash, variant)
+        with atomic_writer(path) as f:
+            yield f
+        logger.debug(f"Stored rendered trace {path}")
+
+
+class ResponseCache:
+    """
+    Persistent cache of the responses of the models, stored in SQLite and addressed
+    by the hash of everything that determines a response, so only the calls that
+    changed are sent again to the models
+    """
+    def __init__(self, path: Path = RESPONSES_CACHE_PATH, max_size: int = RESPONSES_CACHE_SIZE):
+        """
+        Open the cache, creating it if needed
+
+        Args:
+            path (Path): The path of the SQLite database
+            max_size (int): The maximum size in bytes of the cached responses
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        # The windows of a trace are answered from several threads
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+            CREATE TABLE IF NOT EXISTS metadata (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            -- Running total of the sizes, so storing a response does not scan every response
+            INSERT OR IGNORE INTO metadata (name, value) SELECT 'size', COALESCE(SUM(size), 0) FROM responses;
+        """)
+
+    def close(self) -> None:
+        """
+        Close the cache
+        """
+        self.connection.close()
+
+    @staticmethod
+    def key(request: dict) -> str:
+        """
+        Compute the key of a request
+
+        Args:
+            request (dict): Everything that determines the response, e.g. the model, its parameters and the messages
+
+        Returns:
+            str: The hexadecimal digest of the canonical JSON of the request
+        """
+        canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """
+        Get a cached response, marking it as recently used
+
+        Args:
+            key (str): The key of the request
+
+        Returns:
+            str | None: The response, None if it is not cached
+        """
+        try:
+            with self.lock, self.connection:
+                row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read response {key} from cache: {e}")
+            return None
+
+        logger.debug(f"Loaded response {key} from cache")
+        return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Store a response, evicting the least recently used ones beyond the maximum size
+
+        Args:
+            key (str): The key of the request
+            response (str): The response
+        """
+        size = len(response.encode('utf-8'))
+        try:
+            with self.lock, self.connection:
+                replaced = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, accessed) VALUES (?, ?, ?, ?)",
+                    (key, response, size, time.time()))
+                total = self.__add_size(size - (replaced[0] if replaced else 0))
+                if total > self.max_size:
+                    evicted = self.__evict(total - self.max_size)
+                    logger.debug(f"Evicted {evicted} responses from cache")
+            logger.debug(f"Stored response {key} in cache")
+        except sqlite3.Error as e:
+            logger.warning(f"Could not store response {key} in cache: {e}")
+
+    def size(self) -> int:
+        """
+        Get the size of the cached responses
+
+        Returns:
+            int: The size in bytes of the cached responses
+        """
+        with self.lock:
+            return self.connection.execute("SELECT value FROM metadata WHERE name = 'size'").fetchone()[0]
+
+    def __add_size(self, delta: int) -> int:
+        """
+        Update the running total of the sizes of the responses, within the current transaction
+
+        Args:
+            delta (int): The bytes added, negative if removed
+
+        Returns:
+            int: The new size in bytes of the cached responses
+        """
+        self.connection.execute("UPDATE metadata SET value = value + ? WHERE name = 'size'", (delta,))
+        return self.connection.execute("SELECT value FROM metadata WHERE name = 'size'").fetchone()[0]
+
+    def __evict(self, excess: int) -> int:
+        """
+        Remove the least recently used responses until their size covers the excess
+
+        Args:
+            excess (int): The bytes to free
+
+        Returns:
+            int: The number of responses removed
+        """
+        keys, freed = [], 0
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if freed >= excess:
+                break
+            keys.append((key,))
+            freed += size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self.__add_size(-freed)
+        return len(keys)
@@ -0,0 +1,196 @@
+import os
+import sqlite3
+import logging
+from collections import Counter
+from pathlib import Path
+from netexplainer.cache import file_hash
+from netexplainer.logger import configure_logger
+from netexplainer.reader import NS_PER_SECOND, capture_format, read_records
+from netexplainer.stats import PROTOCOLS
+from netexplainer.store import SUFFIXES
+
+configure_logger(name="catalog", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("catalog")
+CATALOG_PATH = Path(__file__).parent / "data/cache/catalog.sqlite"
+
+"""
+Extensions of the files catalogued as captures, uncompressed or compressed with any codec of the store.
+"""
+CAPTURE_EXTENSIONS = tuple(extension + suffix for extension in (".cap", ".pcap", ".pcapng") for suffix in ("", *SUFFIXES.values()))
+
+"""
+Columns holding the number of packets of each counted protocol, e.g. tcp or icmpv6.
+"""
+PROTOCOL_COLUMNS = tuple(protocol.lower() for protocol in PROTOCOLS)
+
+"""
+Facts about the content of a capture, shared by every copy of it.
+"""
+FACT_COLUMNS = ("format", "linktype", "packets", "duration") + PROTOCOL_COLUMNS
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS captures (
+    path TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format TEXT,
+    linktype INTEGER,
+    packets INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    {", ".join(f"{column} INTEGER NOT NULL" for column in PROTOCOL_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS captures_stage_packets ON captures (stage, packets);
+CREATE INDEX IF NOT EXISTS captures_sha256 ON captures (sha256);
+"""
+
+
+def examine(file_path: str) -> dict:
+    """
+    Read a capture once to learn its format, link type, packet count, duration and protocol mix
+
+    Args:
+        file_path (str): The path of the capture
+
+    Returns:
+        dict: The value of each of FACT_COLUMNS
+    """
+    capture, linktype = capture_format(file_path)
+    packets, first, last = 0, None, None
+    protocols = Counter()
+    for time, _, _, protocol in read_records(file_path, fields=("time", "protocol")):
+        packets += 1
+        if first is None:
+            first = time
+        last = time
+        if protocol is not None:
+            protocols[protocol] += 1
+
+    facts = {
+        "format": capture,
+        "linktype": linktype,
+        "packets": packets,
+        "duration": max(last - first, 0) / NS_PER_SECOND if packets else 0.0,
+    }
+    facts.update({column: protocols[protocol] for protocol, column in zip(PROTOCOLS, PROTOCOL_COLUMNS)})
+    return facts
+
+
+class Catalog:
+    """
+    Persistent catalog of the raw and cleaned captures, stored in SQLite, so the
+    captures are read once and can be selected with queries on their facts
+    """
+    def __init__(self, path: Path = CATALOG_PATH):
+        """
+        Open the catalog, creating it if needed
+
+        Args:
+            path (Path): The path of the SQLite database
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the catalog
+        """
+        self.connection.close()
+
+    def sync(self, directory: str, stage: str) -> None:
+        """
+        Bring the catalog of a stage up to date with the captures of its directory.
+        Only new or modified captures are read, and captures with the same content
+        as one already catalogued reuse its facts.
+
+        Args:
+            directory (str): The directory of the captures
+            stage (str): The stage of the captures, e.g. raw or cleaned
+        """
+        directory = os.path.abspath(directory)
+        known = {row["path"]: row for row in self.connection.execute(
+            "SELECT path, size, mtime_ns FROM captures WHERE stage = ?", (stage,))}
+
+        present = set()
+        added = 0
+        for file in sorted(os.listdir(directory)):
+            if file.startswith(".") or not file.lower().endswith(CAPTURE_EXTENSIONS):
+                continue
+            path = os.path.join(directory, file)
+            present.add(path)
+            stat = os.stat(path)
+            row = known.get(path)
+            if row is not None and (row["size"], row["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            try:
+                self.__add(path, stage, stat)
+                added += 1
+            except Exception as e:
+                logger.error(f"Error cataloguing file {path}: {str(e)}")
+
+        removed = [(path,) for path in known if path not in present]
+        self.connection.executemany("DELETE FROM captures WHERE path = ?", removed)
+        self.connection.commit()
+        logger.debug(f"Catalog of {stage} captures synced with {directory}: {added} added or updated, {len(removed)} removed")
+
+    def __add(self, path: str, stage: str, stat: os.stat_result) -> None:
+        """
+        Catalog a capture, replacing its previous entry
+
+        Args:
+            path (str): The absolute path of the capture
+            stage (str): The stage of the capture
+            stat (os.stat_result): The status of the file
+        """
+        sha256 = file_hash(path)
+        row = self.connection.execute(
+            f"SELECT {', '.join(FACT_COLUMNS)} FROM captures WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone()
+        facts = dict(row) if row is not None else examine(path)
+
+        entry = {"path": path, "stage": stage, "sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **facts}
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO captures ({', '.join(entry)}) VALUES ({', '.join('?' * len(entry))})",
+            tuple(entry.values()))
+
+    def select(self, stage: str, where: str | None = None, params: tuple = (), unique: bool = True) -> list:
+        """
+        Select the captures of a stage, e.g. the TCP-heavy traces under 500 packets with
+        where="tcp > packets / 2 AND packets < 500"
+
+        Args:
+            stage (str): The stage of the captures
+            where (str | None): An SQL condition on the columns of the catalog, None to select every capture
+            params (tuple): The parameters of the condition
+            unique (bool): Whether to collapse the captures with the same content into the first of them
+
+        Returns:
+            list: The paths of the selected captures, sorted
+        """
+        condition = f"stage = ? AND ({where})" if where else "stage = ?"
+        if unique:
+            query = f"SELECT MIN(path) AS path FROM captures WHERE {condition} GROUP BY sha256 ORDER BY path"
+        else:
+            query = f"SELECT path FROM captures WHERE {condition} ORDER BY path"
+        return [row["path"] for row in self.connection.execute(query, (stage, *params))]
+
+    def get(self, path: str) -> dict | None:
+        """
+        Get the catalog entry of a capture
+
+        Args:
+            path (str): The path of the capture
+
+        Returns:
+            dict | None: The columns of the entry, None if the capture is not catalogued
+        """
+        row = self.connection.execute("SELECT * FROM captures WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return None if row is None else dict(row)
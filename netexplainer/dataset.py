@@ -1,18 +1,47 @@
-from scapy.all import rdpcap
 import os
-from subprocess import check_output
+from concurrent.futures import ProcessPoolExecutor
+from subprocess import check_output, Popen, PIPE, CalledProcessError
 import re
 import yaml
 import logging
 from pathlib import Path
 from netexplainer.logger import configure_logger
+from netexplainer.analytics import answer_questions, answer_records
+from netexplainer.reader import tshark_record, TSHARK_RECORD_FIELDS as RECORD_FIELDS
+from netexplainer.summary import TraceSummary
+from netexplainer.cache import AnswerCache, RenderCache, analysis_version, atomic_writer, file_hash
+from netexplainer.store import capture_source, strip_compression
 
 configure_logger(name="dataset", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
 logger = logging.getLogger("dataset")
 
+"""
+tshark fields rendered in the processed file, in the order of its header.
+The Info column is the last one so it can be dropped for small context windows.
+"""
+DISPLAY_FIELDS = (
+    "frame.number",
+    "frame.time_relative",
+    "_ws.col.Source",
+    "_ws.col.Destination",
+    "_ws.col.Protocol",
+    "frame.len",
+    "_ws.col.Info",
+)
+
+"""
+Splitter of tshark columns: tabs not escaped with a backslash.
+"""
+MATCH_TABS = re.compile(r"(?<!\\)\t")
+
+"""
+Number of conversations and endpoints listed in the summaries for each context window size.
+"""
+SUMMARY_TOP = {"small": 10, "big": 50}
+
 
 class Dataset:
-    def __init__(self, file_path: str, questions_path: str, windows_context_size: str):
+    def __init__(self, file_path: str, questions_path: str, windows_context_size: str, use_cache: bool = True, single_read: bool = False, summaries: bool = False, workers: int = 1, approximate: dict | None = None):
         """
         Initialize the dataset object with the file provided
 
@@ -20,6 +49,13 @@ class Dataset:
             file_path (str): The path of the file to process
             questions_path (str): The path of the questions file
             windows_context_size (str): The size of the context window of the LLM
+            use_cache (bool): Whether to reuse the answers and the rendered trace cached for an unchanged capture
+            single_read (bool): Whether to read the capture once with tshark for both the
+                processed file and the answers, following tshark's dissection instead of scapy's
+            summaries (bool): Whether to also write the summaries of the capture to summary_file
+            workers (int): The number of processes to split the capture between to answer the questions
+            approximate (dict | None): The error bounds of the sketches to answer the questions about
+                addresses in bounded memory, see sketch.TraceSketch, None for exact answers
         """
         if not os.path.exists(file_path):
             logger.error(f'The path {file_path} does not exist')
@@ -27,7 +63,7 @@ class Dataset:
         elif not os.path.isfile(file_path):
             logger.error(f'The path {file_path} is not a file, please provide a file')
             raise FileExistsError(f'The path {file_path} is not a file, please provide a file')
-        elif not file_path.endswith('.pcap') and not file_path.endswith('.pcapng') and not file_path.endswith('.cap'):
+        elif not strip_compression(file_path).endswith(('.pcap', '.pcapng', '.cap')):
             logger.error(f'The file {file_path} is not a network file, please provide a pcap or pcapng file')
             raise TypeError(f'The file {file_path} is not a network file, please provide a pcap or pcapng file')
         else:
@@ -44,6 +80,8 @@ class Dataset:
             raise TypeError(f'The file {questions_path} is not a yaml file, please provide a yaml file')
         else:
             self.__questions_path = os.path.abspath(questions_path)
+        self.__workers = workers
+        self.__approximate = approximate
         
         with open(self.__questions_path, 'r') as file:
             data = yaml.safe_load(file)
@@ -58,103 +96,238 @@ class Dataset:
             self.questions_subquestions[question] = subquestions
             self.divide_in_subquestions[question] = divide_in_subquestions
 
-        self.questions_answers = self.__answer_question(self.__path)
-        self.processed_file = self.__process_file(self.__path, windows_context_size)
+        if single_read:
+            self.questions_answers, self.processed_file = self.__read_once(self.__path, windows_context_size)
+        else:
+            capture_hash = file_hash(self.__path) if use_cache else None
+            self.questions_answers = self.__load_answers(self.__path, capture_hash)
+            self.processed_file = self.__process_file(self.__path, windows_context_size, capture_hash)
+
+        self.summary_file = None
+        if summaries:
+            capture_hash = file_hash(self.__path) if use_cache and not single_read else None
+            self.summary_file = self.__summarize_file(self.__path, windows_context_size, capture_hash)
+
+    def __read_once(self, file_path: str, windows_context_size: str) -> tuple:
+        """
+        Read the capture once with tshark and use its fields for both the processed file and the answers
+
+        Args:
+            file_path (str): The path of the file to process
+            windows_context_size (str): The size of the context window of the LLM
+
+        Returns:
+            tuple: The dictionary with the questions and answers, and the path of the processed file
+        """
+        logger.debug(f'Reading file {file_path} once with tshark')
+        rows = self.__cap_to_fields(file_path)
+
+        records = (tshark_record(row[len(DISPLAY_FIELDS):]) for row in rows)
+        questions_answers = answer_records(records, self.questions_subquestions.keys())
+
+        display_columns = len(DISPLAY_FIELDS) if windows_context_size == "big" else len(DISPLAY_FIELDS) - 1
+        packets = (self.__format_row(row[:display_columns]) for row in rows)
+        txt_file_path = self.__write_processed_file(file_path, windows_context_size, packets)
+
+        logger.debug(f'File {file_path} read once, answers computed and saved as {txt_file_path}')
+        return questions_answers, txt_file_path
+
+    def __cap_to_fields(self, file: str) -> list:
+        """
+        Extract the display and ground truth fields of every packet using tshark
+
+        Args:
+            file (str): The path of the file to process
+
+        Returns:
+            list: One list of fields per packet, the DISPLAY_FIELDS followed by the RECORD_FIELDS
+        """
+        logger.debug(f'Extracting fields of file {file}')
+        options = ["-T", "fields", "-E", "separator=/t", "-E", "occurrence=f"]
+        for field in DISPLAY_FIELDS + RECORD_FIELDS:
+            options += ["-e", field]
+        try:
+            with capture_source(file) as (source, stdin):
+                out = check_output(["tshark", "-r", source] + options, stdin=stdin)
+        except Exception as e:
+            logger.error(f"Error extracting fields of file {file}: {e}")
+            raise Exception(f"Fail reading the file. ERROR: {e}")
+
+        return [MATCH_TABS.split(line) for line in out.decode("utf-8").splitlines() if line.strip()]
+
+    def __format_row(self, columns: list) -> str:
+        """
+        Format the columns of a packet as a row of the processed file
+
+        Args:
+            columns (list): The columns of the packet
+
+        Returns:
+            str: The formatted row
+        """
+        return " | ".join(col.strip().replace("\u2192", "->").replace('"', "'") for col in columns) + "\n"
+
+    def __write_processed_file(self, file_path: str, windows_context_size: str, packets) -> str:
+        """
+        Write the processed file next to the capture, one per context window size, publishing it atomically
+
+        Args:
+            file_path (str): The path of the capture
+            windows_context_size (str): The size of the context window of the LLM
+            packets (Iterable[str]): The formatted rows of the packets
+
+        Returns:
+            str: The path of the processed file
+        """
+        txt_file_path = re.sub(r"\.(pcapng|pcap|cap)$", f".{windows_context_size}.txt", strip_compression(file_path))
+        with atomic_writer(Path(txt_file_path)) as f:
+            self.__write_rows(f, windows_context_size, packets)
+        return txt_file_path
+
+    def __write_rows(self, f, windows_context_size: str, packets) -> None:
+        """
+        Write the header and the packets of the processed file, row by row
+
+        Args:
+            f (file): The file to write to
+            windows_context_size (str): The size of the context window of the LLM
+            packets (Iterable[str]): The formatted rows of the packets
+        """
+        if windows_context_size == "big":
+            f.write("No.|Time|Source|Destination|Protocol|Length|Info\n")
+        else:
+            f.write("No.|Time|Source|Destination|Protocol|Length\n")
+        for row in packets:
+            f.write(row)
     
-    def __process_file(self, file_path: str, windows_context_size: str) -> str:
+    def __process_file(self, file_path: str, windows_context_size: str, capture_hash: str | None = None) -> str:
         """
-        Process the file and convert it to txt format
+        Process the file and convert it to txt format, streaming tshark's output to the file
         
         Args:
             file_path (str): The path of the file to process
             windows_context_size (str): The size of the context window of the LLM
+            capture_hash (str | None): The hash of the capture to reuse its cached rendering,
+                None to write the processed file next to the capture
 
         Returns:
             str: The path of the processed file
         """
+        if capture_hash is not None:
+            cache = RenderCache()
+            cached = cache.get(capture_hash, windows_context_size)
+            if cached is not None:
+                return str(cached)
+
         logger.debug(f'Processing file {file_path}')
-        packets = self.__cap_to_str(file_path, windows_context_size)
-        txt_file_path = file_path.replace('.pcapng', '.txt').replace('.pcap', '.txt').replace('.cap', '.txt')
-        with open(txt_file_path, 'w') as f:
-            if windows_context_size == "big":
-                f.write("No.|Time|Source|Destination|Protocol|Length|Info\n")
-            else:
-                f.write("No.|Time|Source|Destination|Protocol|Length\n")
-            f.write(packets)
+        packets = (self.__clean_cap_line(line, windows_context_size) for line in self.__cap_to_lines(file_path) if line.strip())
+        if capture_hash is None:
+            txt_file_path = self.__write_processed_file(file_path, windows_context_size, packets)
+        else:
+            with cache.writer(capture_hash, windows_context_size) as f:
+                self.__write_rows(f, windows_context_size, packets)
+            txt_file_path = str(cache.path(capture_hash, windows_context_size))
         logger.debug(f'File {file_path} processed and saved as {txt_file_path}')
         return txt_file_path
 
-    def __cap_to_str(self, file: str, windows_context_size: str) -> str:
+    def __summarize_file(self, file_path: str, windows_context_size: str, capture_hash: str | None = None) -> str:
         """
-        Convert the pcap file to a string using tshark
+        Write the conversations, protocol hierarchy, endpoints and I/O summaries of the capture
 
         Args:
-            file (str): The path of the file to process
+            file_path (str): The path of the file to process
             windows_context_size (str): The size of the context window of the LLM
+            capture_hash (str | None): The hash of the capture to reuse its cached summaries,
+                None to write them next to the capture
 
         Returns:
-            str: The capture in string format
+            str: The path of the summary file
+        """
+        if capture_hash is None:
+            summary_file_path = re.sub(r"\.(pcapng|pcap|cap)$", f".summary.{windows_context_size}.txt", strip_compression(file_path))
+            with atomic_writer(Path(summary_file_path)) as f:
+                f.write(TraceSummary.from_file(file_path).to_text(SUMMARY_TOP[windows_context_size]))
+            return summary_file_path
+
+        cache = RenderCache()
+        variant = f"summary-{windows_context_size}-{analysis_version()[:12]}"
+        cached = cache.get(capture_hash, variant)
+        if cached is not None:
+            return str(cached)
+
+        text = TraceSummary.from_file(file_path).to_text(SUMMARY_TOP[windows_context_size])
+        with cache.writer(capture_hash, variant) as f:
+            f.write(text)
+        return str(cache.path(capture_hash, variant))
+
+    def __cap_to_lines(self, file: str):
+        """
+        Read the pcap file line by line from a tshark pipe
+
+        Args:
+            file (str): The path of the file to process
+
+        Yields:
+            str: Each line printed by tshark
         """
         logger.debug(f'Converting file {file} to string')
         try:
-            out = check_output(
-                [
-                    "tshark",
-                    "-r",
-                    file,
-                    "-T",
-                    "tabs",
-                ]
-            )
+            with capture_source(file) as (source, stdin), \
+                 Popen(["tshark", "-r", source, "-T", "tabs"], stdin=stdin, stdout=PIPE, encoding="utf-8") as process:
+                yield from process.stdout
+            if process.returncode:
+                raise CalledProcessError(process.returncode, process.args)
             logger.debug(f'File {file} converted to string')
-            return self.__clean_cap_format(out.decode("utf-8"), windows_context_size)
         except Exception as e:
             logger.error(f"Error converting file {file} to string: {e}")
             raise Exception(f"Fail reading the file. ERROR: {e}")
 
-    def __clean_cap_format(self, cap: str, windows_context_size: str) -> str:
+    def __clean_cap_line(self, line: str, windows_context_size: str) -> str:
         """
-        Clean the capture format to a more readable format
+        Clean a line of the capture to a row of the processed file
 
         Args:
-            cap (str): The capture to clean
+            line (str): The line printed by tshark
             windows_context_size (str): The size of the context window of the LLM
 
         Returns:
-            str: The cleaned capture
+            str: The formatted row
         """
-        logger.debug(f'Cleaning capture format')
-        # Split the string by lines
-        cap_lines = cap.strip().split("\n")
-
-        match_tabs = r"(?<!\\)\t"
-
-        table_rows = []
+        columns = MATCH_TABS.split(line.strip())
+        if windows_context_size != "big":
+            columns = columns[:-1]
 
-        for line in cap_lines:
-            if windows_context_size == "big":
-                columns = re.split(match_tabs, line.strip())
-            else:
-                columns = re.split(match_tabs, line.strip())[:-1]
+        if "\u2192" in columns:
+            # Remove it from list
+            columns.remove("\u2192")
 
-            if "\u2192" in columns:
-                # Remove it from list
-                columns.remove("\u2192")
+        return self.__format_row(columns)
 
-            # Format columns elements before append them to the table
-            for i, col in enumerate(columns):
-                col = col.strip().replace("\u2192", "->").replace('"', "'")
-                columns[i] = col
-
-            table_rows.append(columns)
-
-        cap_formated = ""
+    def __load_answers(self, file_path: str, capture_hash: str | None) -> dict:
+        """
+        Get the answers from the cache, answering and caching them if there is no valid entry
 
-        for row in table_rows:
-            cap_formated += " | ".join(row) + "\n"
+        Args:
+            file_path (str): The path of the file to process
+            capture_hash (str | None): The hash of the capture, None to skip the answers cache
 
-        logger.debug(f'Capture format cleaned')
-        return cap_formated
+        Returns:
+            dict: Dictionary with the questions and answers
+        """
+        if capture_hash is None:
+            return self.__answer_question(file_path)
+
+        cache = AnswerCache()
+        questions = list(self.questions_subquestions.keys())
+        variant = None
+        if self.__approximate is not None:
+            variant = "approximate-" + "-".join(f"{name}={value}" for name, value in sorted(self.__approximate.items()))
+
+        questions_answers = cache.get(capture_hash, questions, variant)
+        if questions_answers is None:
+            questions_answers = self.__answer_question(file_path)
+            cache.put(capture_hash, questions, questions_answers, variant)
+        return questions_answers
 
     def __answer_question(self, file_path: str) -> dict:
         """
@@ -167,91 +340,47 @@ class Dataset:
             dict: Dictionary with the questions and answers
         """
         logger.debug(f'Answering questions for file {file_path}')
-        packets = rdpcap(file_path)
-        questions_answers = {}
-        total_size = 0
-        duration = 0
-
-        for packet in packets:
-            total_size += len(packet)
-
-        if len(packets) > 0:
-            start_time = packets[0].time
-            end_time = packets[-1].time
-            duration = end_time - start_time if end_time > start_time else 0
-        else:
-            duration = 0
-
-        for question in self.questions_subquestions.keys():
-            if question == "What is the total number of packets in the trace?":
-                questions_answers[question] = len(packets)
-
-            elif question == "How many unique communicators are present in the trace?":
-                unique_communicators = set()
-                for packet in packets:
-                    if packet.haslayer('IP'):
-                        unique_communicators.add(packet['IP'].src)
-                        unique_communicators.add(packet['IP'].dst)
-                    elif packet.haslayer('IPv6'):
-                        unique_communicators.add(packet['IPv6'].src)
-                        unique_communicators.add(packet['IPv6'].dst)
-                questions_answers[question] = len(unique_communicators)
-
-            elif question == "What is the IP that participates the most in communications in the trace?":
-                ip_count = {}
-                for packet in packets:
-                    if packet.haslayer('IP'):
-                        src_ip = packet['IP'].src
-                        dst_ip = packet['IP'].dst
-                        ip_count[src_ip] = ip_count.get(src_ip, 0) + 1
-                        ip_count[dst_ip] = ip_count.get(dst_ip, 0) + 1
-                    elif packet.haslayer('IPv6'):
-                        src_ip = packet['IPv6'].src
-                        dst_ip = packet['IPv6'].dst
-                        ip_count[src_ip] = ip_count.get(src_ip, 0) + 1
-                        ip_count[dst_ip] = ip_count.get(dst_ip, 0) + 1
-                if ip_count:
-                    max_count = max(ip_count.values())
-                    most_common_ips = [ip for ip, count in ip_count.items() if count == max_count]
-                    most_common_ip = " or ".join(most_common_ips) if len(most_common_ips) > 1 else most_common_ips[0]
-                else:
-                    most_common_ip = "No IP communications found"
-                questions_answers[question] = most_common_ip
-
-            elif question == "What is the total size of transmitted bytes?":
-                questions_answers[question] = total_size
-
-            elif question == "What is the average size of packets in bytes?":
-                average_size = total_size / len(packets) if packets else 0
-                questions_answers[question] = average_size
-
-            elif question == "What predominates in the capture: ICMP, TCP, or UDP?":
-                protocol_count = {'ICMP': 0, 'ICMPv6': 0, 'TCP': 0, 'UDP': 0}
-                for packet in packets:
-                    if packet.haslayer('ICMP'):
-                        protocol_count['ICMP'] += 1
-                    elif packet.haslayer('ICMPv6'):
-                        protocol_count['ICMPv6'] += 1
-                    elif packet.haslayer('TCP'):
-                        protocol_count['TCP'] += 1
-                    elif packet.haslayer('UDP'):
-                        protocol_count['UDP'] += 1
-                if sum(protocol_count.values()) == 0:
-                    predominant_protocol = "No ICMP, ICMPv6, TCP, or UDP packets found"
-                else:
-                    predominant_protocol = max(protocol_count, key=protocol_count.get)
-                questions_answers[question] = predominant_protocol
-
-            elif question == "How long in seconds does the communication last?":
-                questions_answers[question] = duration
-
-            elif question == "What is the average number of packets sent per second?":
-                average_packets_per_second = len(packets) / duration if duration > 0 else "There is only one packet in the trace, operation not possible"
-                questions_answers[question] = average_packets_per_second
-
-            elif question == "What is the average bytes/s sent in the communication?":
-                average_bytes_per_second = total_size / duration if duration > 0 else "There is only one packet in the trace, operation not possible"
-                questions_answers[question] = average_bytes_per_second
-
+        questions_answers = answer_questions(file_path, self.questions_subquestions.keys(), self.__workers, self.__approximate)
         logger.debug(f'Questions answered for file {file_path}')
         return questions_answers
+
+
+def _init_worker() -> None:
+    """
+    Import scapy's layers once per worker, before its first capture
+    """
+    import scapy.all  # noqa: F401
+
+
+def _prepare_dataset(file_path: str, questions_path: str, windows_context_size: str, kwargs: dict) -> Dataset:
+    return Dataset(file_path, questions_path, windows_context_size, **kwargs)
+
+
+def prepare_datasets(file_paths: list, questions_path: str, windows_context_sizes, max_workers: int | None = None, **kwargs) -> dict:
+    """
+    Prepare the datasets of several captures in parallel with a pool of processes
+
+    Args:
+        file_paths (list): The paths of the captures
+        questions_path (str): The path of the questions file
+        windows_context_sizes (Iterable[str]): The sizes of the context windows to prepare each capture for
+        max_workers (int | None): The number of processes, the number of CPUs if None
+        kwargs: The other arguments of Dataset
+
+    Returns:
+        dict: The datasets by (file path, windows context size), without the captures that failed
+    """
+    jobs = [(file_path, size) for file_path in file_paths for size in sorted(set(windows_context_sizes))]
+    logger.debug(f'Preparing {len(jobs)} datasets with {max_workers or os.cpu_count()} processes')
+
+    datasets = {}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+        futures = {job: executor.submit(_prepare_dataset, job[0], questions_path, job[1], kwargs) for job in jobs}
+        for job, future in futures.items():
+            try:
+                datasets[job] = future.result()
+            except Exception as e:
+                logger.error(f'Error preparing file {job[0]} for {job[1]} context windows: {e}')
+
+    logger.debug(f'Prepared {len(datasets)} of {len(jobs)} datasets')
+    return datasets
@@ -1,23 +1,22 @@
 import os
-import time
 import re
 import logging
 from pathlib import Path
 import plotly.express as px
 import plotly.graph_objects as go
-from netexplainer.dataset import Dataset
-from netexplainer.llm import models
-from netexplainer.dataset import Dataset
+from netexplainer.catalog import Catalog
+from netexplainer.dataset import Dataset, prepare_datasets
+from netexplainer.llm import MAX_CONCURRENT_SUBQUESTIONS, models, run_async
 from netexplainer.logger import configure_logger
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnableLambda
 from langchain.prompts import ChatPromptTemplate
 from langchain.agents import AgentExecutor
-from langchain_ollama import ChatOllama
 
 configure_logger(name="evaluator", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
 logger = logging.getLogger("evaluator")
 QUESTIONS_PATH = "netexplainer/data/questions.yaml"
+CLEANED_DIR = "netexplainer/data/cleaned/"
 
 
 class Evaluator:
@@ -59,7 +58,8 @@ class Evaluator:
                 | StrOutputParser()
             )
 
-        answer = chain.invoke({"question": question, "subquestions_LLM": subquestions, "subquestions": dataset.questions_subquestions[question]})
+        inputs = {"question": question, "subquestions_LLM": subquestions, "subquestions": dataset.questions_subquestions[question]}
+        answer = llm.limiter.call(lambda: chain.invoke(inputs), llm.request_tokens(prompt.format_messages(**inputs)))
         logger.debug(f"Question: {question}, Subquestions LLM: {subquestions}, Subquestions: {dataset.questions_subquestions[question]}, Similarity: {answer}")
         return answer
 
@@ -99,54 +99,106 @@ class Evaluator:
                 | StrOutputParser()
             )
 
-        answer = chain.invoke({"question": question, "answer_LLM": answer_llm, "answer": dataset.questions_answers[question]})
+        inputs = {"question": question, "answer_LLM": answer_llm, "answer": dataset.questions_answers[question]}
+        answer = llm.limiter.call(lambda: chain.invoke(inputs), llm.request_tokens(prompt.format_messages(**inputs)))
         logger.debug(f"Question: {question}, Answer LLM: {answer_llm}, Answer: {dataset.questions_answers[question]}, Comparison: {answer}")
         return answer
 
-    def evaluate(self, models_to_evaluate: list, tools: bool = False) -> None:
+    def answer_batch(self, llm, dataset: Dataset) -> dict:
+        """
+        Answer every question of a capture with a single call about its trace: the questions
+        are decomposed first, and their sub-questions, or the questions that are not divided,
+        are answered together.
+
+        Args:
+            llm (LLM): The model answering the questions
+            dataset (Dataset): The dataset containing the questions
+
+        Returns:
+            dict: The sub-questions and the final answer of each question, empty if the batch failed
+        """
+        try:
+            items = {
+                question: llm.get_subquestions(question) if dataset.divide_in_subquestions[question] else [question]
+                for question in dataset.questions_subquestions.keys()
+            }
+            answers = iter(llm.answer_batch([item for question in items for item in items[question]]))
+
+            prepared = {}
+            for question, subquestions in items.items():
+                subanswers = [next(answers) for _ in subquestions]
+                if dataset.divide_in_subquestions[question]:
+                    prepared[question] = (subquestions, llm.get_final_answer(question, subquestions, subanswers))
+                else:
+                    prepared[question] = (subquestions, subanswers[0])
+            return prepared
+        except Exception as e:
+            logger.error(f"Error answering the questions of file {os.path.basename(dataset.processed_file)} in a batch: {e}")
+            return {}
+
+    def evaluate(self, models_to_evaluate: list, tools: bool = False, chunked: bool = False, prompt_mode: str = "rows", selection: str | None = None, cache: bool = True, concurrency: int = MAX_CONCURRENT_SUBQUESTIONS, batch: str | None = None) -> None:
         """
         Evaluates the models without using any tools.
 
         Args:
             models_to_evaluate (list): List of models to evaluate.
             tools (bool): Whether to use tools or not.
+            chunked (bool): Whether to answer over windows of the traces that do not fit the context.
+            prompt_mode (str): What the prompts show of the traces: rows, summary or summary+rows.
+            selection (str | None): SQL condition on the catalog selecting the captures to evaluate, all of them if None.
+            cache (bool): Whether to reuse the cached responses of the models.
+            concurrency (int): Maximum number of sub-questions of a question answered at the same time.
+            batch (str | None): What is answered in a single call about each trace, one of BATCH_MODES, nothing if None.
         """
+        with Catalog() as catalog:
+            catalog.sync(CLEANED_DIR, "cleaned")
+            paths = catalog.select("cleaned", selection)
+        logger.debug(f"Selected {len(paths)} captures to evaluate")
+        datasets = prepare_datasets(
+            paths,
+            QUESTIONS_PATH,
+            {models[f"{model}"][1] for model in models_to_evaluate},
+            summaries=prompt_mode != "rows",
+        )
+
         for model in models_to_evaluate:
             all_results = []
 
-            for file in os.listdir("netexplainer/data/cleaned/"):
-                if file.endswith(".txt"):
+            for path in paths:
+                file = os.path.basename(path)
+                dataset = datasets.get((path, models[f"{model}"][1]))
+                if dataset is None:
+                    logger.error(f"Skipping file {file} with model {model}, it could not be prepared")
                     continue
 
                 try:
                     logger.debug(f"Processing file: {file} with model: {model}")
-                    dataset = Dataset(os.path.join("netexplainer/data/cleaned/", file), QUESTIONS_PATH, models[f"{model}"][1])
-                    llm = models[f"{model}"][0](dataset.processed_file, tools=tools)
+                    llm = models[f"{model}"][0](dataset.processed_file, tools=tools, chunked=chunked, summary_path=dataset.summary_file, prompt_mode=prompt_mode, cache=cache)
+
+                    prepared = self.answer_batch(llm, dataset) if batch == "questions" else {}
 
                     for question in dataset.questions_subquestions.keys():
                         logger.debug(f"Processing question: {question} with model: {model}")
+                        llm.refresh = False
                         for _ in range(10):
                             logger.debug(f"Attempting to process question: {question} with model: {model}, attempt: {_ + 1}")
                             try:
-                                if dataset.divide_in_subquestions[question]:
+                                if question in prepared:
+                                    # Only the first attempt reuses the answer of the batch
+                                    subquestions, final_answer = prepared.pop(question)
+                                elif dataset.divide_in_subquestions[question]:
                                     subquestions = llm.get_subquestions(question)
-
-                                    answers = []
-                                    for subquestion in subquestions:
-                                        if not isinstance(llm.llm, ChatOllama): time.sleep(2.5)
-                                        answer = llm.answer_subquestion(subquestion)
-                                        answers.append(answer)
-
-                                    if not isinstance(llm.llm, ChatOllama): time.sleep(2.5)
-                                    final_answer = llm.get_final_answer(question, subquestions, answers)
+                                    if batch == "subquestions":
+                                        answers = llm.answer_batch(subquestions)
+                                    else:
+                                        answers = run_async(llm.aanswer_subquestions(subquestions, max_concurrency=concurrency))
+                                    final_answer = run_async(llm.aget_final_answer(question, subquestions, answers))
 
                                 else:
-                                    if not isinstance(llm.llm, ChatOllama): time.sleep(2.5)
                                     final_answer = llm.answer_subquestion(question)
 
                                 try:
                                     if dataset.divide_in_subquestions[question]:
-                                        if not isinstance(llm.llm, ChatOllama): time.sleep(2)
                                         subquestions_eval = self.evaluate_subquestions(question, subquestions, dataset)
                                     else:
                                         subquestions_eval = 100
@@ -155,7 +207,6 @@ class Evaluator:
                                     subquestions_eval = "ERROR"
 
                                 try:
-                                    if not isinstance(llm.llm, ChatOllama): time.sleep(2)
                                     answers_eval = self.evaluate_answer(question, final_answer, dataset)
                                 except Exception as e:
                                     logger.error(f"Error evaluating answers: {e}")
@@ -168,7 +219,8 @@ class Evaluator:
                                 logger.error(f"Error processing question {question} in file {file}: {e}")
                                 subquestions_eval = "ERROR"
                                 answers_eval = "PROBLEM"
-                                time.sleep(10)
+                                # A cached response may have caused the error, ask the model again
+                                llm.refresh = True
 
                         all_results.append({
                             "model": model,
@@ -185,7 +237,6 @@ class Evaluator:
 
                 except Exception as e:
                     logger.error(f"Error processing file {file} with model {model}: {e}")
-                    time.sleep(10)
 
             logger.debug("Generating pie charts")
             self.generate_pie_charts(all_results, tools)
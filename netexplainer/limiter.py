@@ -0,0 +1,221 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from netexplainer.logger import configure_logger
+
+configure_logger(name="limiter", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("limiter")
+
+"""
+Number of times a call rejected by the rate limits of the provider is retried.
+"""
+MAX_RETRIES = 6
+
+"""
+Pause after the first rate-limit error, doubled on each consecutive one up to
+the maximum, in seconds.
+"""
+MIN_BACKOFF = 2.0
+MAX_BACKOFF = 60.0
+
+"""
+Fraction of the quota kept after each rate-limit error and fraction of the
+quota recovered after each successful call, so the rate settles just under
+the real limit of the provider.
+"""
+DECREASE_FACTOR = 0.5
+INCREASE_STEP = 0.05
+MIN_RATE_FRACTION = 0.1
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Tell whether an error of a provider means that its rate limits were exceeded
+
+    Args:
+        error (Exception): The error raised by the call
+
+    Returns:
+        bool: Whether the call was rejected by the rate limits
+    """
+    for attribute in ("status_code", "code", "status"):
+        if getattr(error, attribute, None) == 429:
+            return True
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in ("429", "rate limit", "resourceexhausted", "resource has been exhausted", "quota"))
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a rate per minute. Amounts are reserved
+    in advance and may leave the bucket in debt, so a request larger than the
+    bucket is delayed instead of blocked forever.
+    """
+    def __init__(self, per_minute: float):
+        """
+        Initialize the bucket full
+
+        Args:
+            per_minute (float): The amount refilled per minute, also the capacity of the bucket
+        """
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, fraction: float = 1.0) -> float:
+        """
+        Take an amount from the bucket
+
+        Args:
+            amount (float): The amount to take
+            fraction (float): The fraction of the nominal rate currently allowed
+
+        Returns:
+            float: The seconds to wait before the amount is available
+        """
+        now = time.monotonic()
+        rate = self.rate * fraction
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+        self.updated = now
+        self.level -= amount
+        return max(-self.level / rate, 0.0)
+
+
+class RateLimiter:
+    """
+    Requests and tokens per minute limits of a provider, shared by every model and
+    thread calling it, with an adaptive backoff when the provider still rejects calls
+    """
+    def __init__(self, name: str, requests_per_minute: float | None = None, tokens_per_minute: float | None = None):
+        """
+        Initialize the limiter, without limits for the quotas that are None
+
+        Args:
+            name (str): The name of the provider
+            requests_per_minute (float | None): The requests allowed per minute
+            tokens_per_minute (float | None): The tokens allowed per minute
+        """
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.fraction = 1.0
+        self.backoff = 0.0
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reserve a request of a number of tokens
+
+        Args:
+            tokens (int): The estimated tokens of the request
+
+        Returns:
+            float: The seconds to wait before sending the request
+        """
+        with self.lock:
+            delay = max(self.paused_until - time.monotonic(), 0.0)
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    delay = max(delay, bucket.reserve(amount, self.fraction))
+            return delay
+
+    def succeeded(self) -> None:
+        """
+        Record a call accepted by the provider, recovering part of the quota
+        """
+        with self.lock:
+            self.backoff = 0.0
+            self.fraction = min(self.fraction + INCREASE_STEP, 1.0)
+
+    def rejected(self) -> float:
+        """
+        Record a call rejected by the rate limits of the provider, reducing the rate
+        and pausing every call for an exponentially growing time
+
+        Returns:
+            float: The seconds of the pause
+        """
+        with self.lock:
+            self.fraction = max(self.fraction * DECREASE_FACTOR, MIN_RATE_FRACTION)
+            self.backoff = min(max(self.backoff * 2, MIN_BACKOFF), MAX_BACKOFF)
+            pause = self.backoff * random.uniform(1.0, 1.5)
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        logger.warning(f"Rate limited by {self.name}, pausing {pause:.1f} s and sending at {self.fraction:.0%} of the quota")
+        return pause
+
+    def call(self, function, tokens: int = 0):
+        """
+        Call a function sending a request to the provider within its rate limits
+
+        Args:
+            function (Callable): The function sending the request
+            tokens (int): The estimated tokens of the request
+
+        Returns:
+            Any: The result of the function
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            delay = self.reserve(tokens)
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                result = function()
+            except Exception as e:
+                if attempt == MAX_RETRIES or not is_rate_limit_error(e):
+                    raise
+                self.rejected()
+                continue
+            self.succeeded()
+            return result
+
+    async def acall(self, function, tokens: int = 0):
+        """
+        Await a coroutine function sending a request to the provider within its rate limits
+
+        Args:
+            function (Callable): The coroutine function sending the request
+            tokens (int): The estimated tokens of the request
+
+        Returns:
+            Any: The result of the coroutine
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            delay = self.reserve(tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                result = await function()
+            except Exception as e:
+                if attempt == MAX_RETRIES or not is_rate_limit_error(e):
+                    raise
+                self.rejected()
+                continue
+            self.succeeded()
+            return result
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str, requests_per_minute: float | None = None, tokens_per_minute: float | None = None) -> RateLimiter:
+    """
+    Get the limiter shared by every caller of a provider, creating it on first use
+
+    Args:
+        name (str): The name of the provider
+        requests_per_minute (float | None): The requests allowed per minute
+        tokens_per_minute (float | None): The tokens allowed per minute
+
+    Returns:
+        RateLimiter: The limiter of the provider
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name, requests_per_minute, tokens_per_minute)
+        return _limiters[name]
@@ -1,22 +1,188 @@
 import os
+import json
 import math
+import asyncio
 import numexpr
 import logging
 import warnings
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from netexplainer.cache import ResponseCache
+from netexplainer.limiter import RateLimiter, get_limiter
 from netexplainer.logger import configure_logger
+from netexplainer.render import CHARS_PER_TOKEN, estimate_tokens, fit_trace, chunk_trace
 from langchain_community.document_loaders import TextLoader
 from langchain.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.tools import tool
-from langchain_core.messages import ToolMessage, BaseMessage
+from langchain_core.messages import ToolMessage, BaseMessage, HumanMessage, message_to_dict, messages_from_dict
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langchain_ollama import ChatOllama
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 configure_logger(name="llm", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
 logger = logging.getLogger("llm")
 
+"""
+Tokens of the context window kept free for the answer of the model.
+"""
+RESPONSE_TOKENS = 1024
+
+"""
+Tokens of the context window kept for the question appended to the prefix of an
+analysis session, so the trace in the prefix does not depend on the question.
+"""
+QUESTION_TOKENS = 128
+
+"""
+How long Ollama keeps a model loaded after a call. The same value is sent in every
+call, so the model and its prompt cache stay in memory between the questions.
+"""
+KEEP_ALIVE = "30m"
+
+"""
+Maximum number of windows of a trace asked at the same time in chunked mode.
+"""
+MAX_CONCURRENT_WINDOWS = 8
+
+"""
+Default maximum number of sub-questions of a question asked at the same time.
+"""
+MAX_CONCURRENT_SUBQUESTIONS = 4
+
+"""
+What the prompts show of the capture: its packet rows, its precomputed
+summaries, or the summaries followed by the rows.
+"""
+PROMPT_MODES = ("rows", "summary", "summary+rows")
+
+"""
+What is answered in a single call about the trace in batched mode: the
+sub-questions of a question, or every question of the capture.
+"""
+BATCH_MODES = ("subquestions", "questions")
+
+"""
+JSON schema of the answers to a batch of questions, identified by their number.
+"""
+BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "answers": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"id": {"type": "integer"}, "answer": {"type": "string"}},
+                "required": ["id", "answer"],
+            },
+        },
+    },
+    "required": ["answers"],
+}
+
+"""
+Fields of the chat models that do not change their responses, such as clients,
+credentials, callbacks and timeouts, left out of the keys of the cached responses.
+"""
+NON_GENERATION_FIELDS = {
+    "name", "cache", "verbose", "callbacks", "callback_manager", "tags", "metadata",
+    "custom_get_token_ids", "rate_limiter", "disable_streaming", "keep_alive", "base_url",
+    "client", "client_kwargs", "client_options", "async_client_running", "transport",
+    "additional_headers", "google_api_key", "credentials", "max_retries", "timeout",
+    "default_metadata",
+}
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def response_cache() -> ResponseCache:
+    """
+    Get the response cache shared by every model, opening it on first use
+
+    Returns:
+        ResponseCache: The response cache
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def run_async(coroutine):
+    """
+    Run a coroutine on the event loop shared by every model and wait for its result.
+    The asynchronous clients of the models are bound to the loop they are first used
+    in, so they are always run in the same one, kept alive by a background thread.
+
+    Args:
+        coroutine (Coroutine): The coroutine to run
+
+    Returns:
+        Any: The result of the coroutine
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _loop).result()
+
+
+def parse_batch_answers(text: str, count: int) -> dict:
+    """
+    Parse the answers to a batch of questions from a response of a model, tolerating
+    text or code fences around the JSON and answers given as a list or a mapping
+
+    Args:
+        text (str): The response of the model
+        count (int): The number of questions of the batch
+
+    Returns:
+        dict: The answer to each question parsed, by its number starting at 1
+    """
+    decoder = json.JSONDecoder()
+    for start, char in enumerate(text):
+        if char not in "{[":
+            continue
+        try:
+            value, _ = decoder.raw_decode(text, start)
+        except ValueError:
+            continue
+        if isinstance(value, dict) and "answers" in value:
+            value = value["answers"]
+
+        if isinstance(value, dict):
+            items = value.items()
+        elif isinstance(value, list) and all(isinstance(item, dict) and "answer" in item for item in value):
+            items = [(item.get("id", i), item["answer"]) for i, item in enumerate(value, start=1)]
+        elif isinstance(value, list):
+            items = enumerate(value, start=1)
+        else:
+            continue
+
+        answers = {}
+        for number, answer in items:
+            try:
+                number = int(number)
+            except (TypeError, ValueError):
+                continue
+            if not 1 <= number <= count or answer is None:
+                continue
+            answer = answer.strip() if isinstance(answer, str) else json.dumps(answer)
+            if answer:
+                answers[number] = answer
+        if answers:
+            return answers
+    return {}
+
 
 @tool
 def calculator(expression: str) -> str:
@@ -40,12 +206,25 @@ def calculator(expression: str) -> str:
     )
 
 class LLM:
-    def __init__(self, data_path: str):
+    provider = "local"
+
+    def __init__(self, data_path: str, chunked: bool = False, summary_path: str | None = None, prompt_mode: str = "rows", cache: bool = True):
         """
         Initialize the LLM object with the file provided
         Args:
             data_path (str): The path of the file to process
+            chunked (bool): Whether to answer over windows of the trace when it does not fit the context
+            summary_path (str | None): The path of the summaries of the trace
+            prompt_mode (str): What the prompts show of the trace, one of PROMPT_MODES
+            cache (bool): Whether to reuse the cached responses of the model, only cached at temperature 0
         """
+        if prompt_mode not in PROMPT_MODES:
+            logger.error(f'Unknown prompt mode {prompt_mode}, use one of {PROMPT_MODES}')
+            raise ValueError(f'Unknown prompt mode {prompt_mode}, use one of {PROMPT_MODES}')
+        elif prompt_mode != "rows" and summary_path is None:
+            logger.error(f'The prompt mode {prompt_mode} needs the summaries of the trace')
+            raise ValueError(f'The prompt mode {prompt_mode} needs the summaries of the trace')
+
         if not os.path.exists(data_path):
             logger.error(f'The path {data_path} does not exist')
             raise FileNotFoundError(f'The path {data_path} does not exist')
@@ -60,43 +239,207 @@ class LLM:
         self.llm = None
         self.model = None
         self.tools = False
+        self.context_size = None
+        self.chunked = chunked
+        self.cache = cache
+        # Ask again instead of reusing the cached responses, e.g. after a failed attempt
+        self.refresh = False
+        self.__traces = {}
+        self.__session = {}
         loader = TextLoader(data_path)
         self.file = loader.load()
+        self.prompt_mode = prompt_mode
+        self.summary = TextLoader(summary_path).load()[0].page_content if summary_path is not None else None
 
-    def call_llm(self, messages: list[BaseMessage], tools: bool = False) -> str:
+    def call_llm(self, messages: list[BaseMessage], tools: bool = False, schema: dict | None = None) -> str:
         """
         Call the LLM with the provided messages and return the response.
         Args:
             messages (list[BaseMessage]): The list of messages to process
             tools (bool): Whether to use tools or not
+            schema (dict | None): The JSON schema the response must follow, if the backend can enforce it
         Returns:
             str: The response from the LLM
         """
-        if tools:
-            response = self.llm_with_tools.invoke(messages)
-        else:
-            response = self.llm.invoke(messages)
+        logger.debug(f"Model: {self.model}, Prompt tokens: {estimate_tokens(''.join(str(message.content) for message in messages))}")
+        response = self.invoke(messages, tools=tools, schema=schema)
 
         if response.tool_calls:
-            tool_responses = []
-            for tool_call in response.tool_calls:
-                if tool_call['name'] == "calculator":
-                    result = calculator.invoke(tool_call['args']['expression'])
-                    tool_responses.append(
-                        ToolMessage(
-                            content=result,
-                            name=tool_call['name'],
-                            tool_call_id=tool_call['id']
-                        )
-                    )
+            messages.append(response)
+            messages.extend(self.run_tools(response))
+
+            return self.call_llm(messages, tools=tools, schema=schema)
+        else:
+            return response.content
 
+    async def acall_llm(self, messages: list[BaseMessage], tools: bool = False) -> str:
+        """
+        Call the LLM asynchronously with the provided messages and return the response.
+        Args:
+            messages (list[BaseMessage]): The list of messages to process
+            tools (bool): Whether to use tools or not
+        Returns:
+            str: The response from the LLM
+        """
+        logger.debug(f"Model: {self.model}, Prompt tokens: {estimate_tokens(''.join(str(message.content) for message in messages))}")
+        response = await self.ainvoke(messages, tools=tools)
+
+        if response.tool_calls:
             messages.append(response)
-            messages.extend(tool_responses)
+            messages.extend(self.run_tools(response))
 
-            return self.call_llm(messages, tools=tools)
+            return await self.acall_llm(messages, tools=tools)
         else:
             return response.content
 
+    def run_tools(self, response: BaseMessage) -> list[ToolMessage]:
+        """
+        Run the tools called in a response of the model
+        Args:
+            response (BaseMessage): The response with the tool calls
+        Returns:
+            list[ToolMessage]: The results of the tools, to send back to the model
+        """
+        tool_responses = []
+        for tool_call in response.tool_calls:
+            try:
+                if tool_call['name'] != "calculator":
+                    raise ValueError(f"Unknown tool {tool_call['name']}")
+                result = calculator.invoke(tool_call['args']['expression'])
+                status = "success"
+            except Exception as e:
+                # The model is told about the error so it can correct the call
+                logger.debug(f"Model: {self.model}, Tool call {tool_call} failed: {e}")
+                result = f"Error: {e}"
+                status = "error"
+            tool_responses.append(
+                ToolMessage(
+                    content=result,
+                    name=tool_call['name'],
+                    tool_call_id=tool_call['id'],
+                    status=status
+                )
+            )
+        return tool_responses
+
+    def invoke(self, messages: list[BaseMessage], tools: bool = False, schema: dict | None = None) -> BaseMessage:
+        """
+        Invoke the model once, reusing its cached response to the same request
+        Args:
+            messages (list[BaseMessage]): The list of messages to send, including the tool call turns
+            tools (bool): Whether to use tools or not
+            schema (dict | None): The JSON schema the response must follow, if the backend can enforce it
+        Returns:
+            BaseMessage: The response of the model
+        """
+        key, response = self.cached(messages, tools, schema)
+        if response is None:
+            llm = self.llm_with_tools if tools else self.llm
+            if schema is not None and self.provider == "ollama":
+                llm = llm.bind(format=schema)
+            response = self.limiter.call(lambda: llm.invoke(messages), self.request_tokens(messages))
+            self.store(key, response)
+        return response
+
+    async def ainvoke(self, messages: list[BaseMessage], tools: bool = False) -> BaseMessage:
+        """
+        Invoke the model once asynchronously, reusing its cached response to the same request
+        Args:
+            messages (list[BaseMessage]): The list of messages to send, including the tool call turns
+            tools (bool): Whether to use tools or not
+        Returns:
+            BaseMessage: The response of the model
+        """
+        key, response = self.cached(messages, tools)
+        if response is None:
+            llm = self.llm_with_tools if tools else self.llm
+            response = await self.limiter.acall(lambda: llm.ainvoke(messages), self.request_tokens(messages))
+            self.store(key, response)
+        return response
+
+    @property
+    def limiter(self) -> RateLimiter:
+        """
+        The rate limiter of the provider of the model, see RATE_LIMITS
+        """
+        return get_limiter(self.provider, **RATE_LIMITS.get(self.provider, {}))
+
+    def request_tokens(self, messages: list[BaseMessage]) -> int:
+        """
+        Estimate the tokens a request counts against the quota of the provider
+        Args:
+            messages (list[BaseMessage]): The list of messages to send
+        Returns:
+            int: The tokens of the messages and of the longest answer expected
+        """
+        return estimate_tokens("".join(str(message.content) for message in messages)) + RESPONSE_TOKENS
+
+    def cached(self, messages: list[BaseMessage], tools: bool = False, schema: dict | None = None) -> tuple:
+        """
+        Look up the cached response of the model to the messages
+        Args:
+            messages (list[BaseMessage]): The list of messages to send
+            tools (bool): Whether to use tools or not
+            schema (dict | None): The JSON schema the response must follow
+        Returns:
+            tuple: The key of the request and the cached response, None for both if the cache is bypassed
+            and None for the response if it is not cached or is being refreshed
+        """
+        if not self.cache or not self.deterministic():
+            return None, None
+        key = ResponseCache.key(self.request(messages, tools, schema))
+        if self.refresh:
+            return key, None
+        cached = response_cache().get(key)
+        return key, messages_from_dict([json.loads(cached)])[0] if cached is not None else None
+
+    def deterministic(self) -> bool:
+        """
+        Tell whether the model answers the same request always the same way, so its responses can be cached
+        Returns:
+            bool: Whether the model is run at temperature 0
+        """
+        return getattr(self.llm, "temperature", None) == 0
+
+    def store(self, key: str | None, response: BaseMessage) -> None:
+        """
+        Store a response of the model in the cache
+        Args:
+            key (str | None): The key of the request, None if the cache is bypassed
+            response (BaseMessage): The response of the model
+        """
+        if key is not None:
+            response_cache().put(key, json.dumps(message_to_dict(response)))
+
+    def request(self, messages: list[BaseMessage], tools: bool = False, schema: dict | None = None) -> dict:
+        """
+        Describe everything that determines the response of the model to the messages
+        Args:
+            messages (list[BaseMessage]): The list of messages to send
+            tools (bool): Whether to use tools or not
+            schema (dict | None): The JSON schema the response must follow
+        Returns:
+            dict: The model, its generation parameters, its tools, the schema and the messages
+        """
+        request = {
+            "class": type(self.llm).__name__,
+            "model": self.model,
+            "parameters": self.llm.model_dump(mode="json", exclude_none=True, exclude=NON_GENERATION_FIELDS),
+            "tools": [convert_to_openai_tool(calculator)] if tools else [],
+            "messages": [
+                {
+                    "type": message.type,
+                    "content": message.content,
+                    "tool_calls": [(call["name"], call["args"], call["id"]) for call in getattr(message, "tool_calls", [])],
+                    "tool_call_id": getattr(message, "tool_call_id", None),
+                }
+                for message in messages
+            ],
+        }
+        if schema is not None:
+            request["schema"] = schema
+        return request
+
     def get_subquestions(self, question: str) -> list:
         """
         Get sub-questions from the LLM
@@ -126,20 +469,285 @@ class LLM:
         Returns:
             str: The answer to the question
         """
+        messages = self.answer_messages(question)
+        if messages is None:
+            return self.answer_subquestion_chunked(question)
+
+        answer = self.call_llm(messages, tools=self.tools)
+
+        logger.debug(f"Model: {self.model}, Question: {question}, Answer: {answer}")
+        return answer
+
+    async def aanswer_subquestion(self, question: str) -> str:
+        """
+        Answer the sub-question using the LLM asynchronously
+        Args:
+            question (str): The question to process
+        Returns:
+            str: The answer to the question
+        """
+        messages = self.answer_messages(question)
+        if messages is None:
+            # The windows of the trace are already answered concurrently by a pool of threads
+            return await asyncio.to_thread(self.answer_subquestion_chunked, question)
+
+        answer = await self.acall_llm(messages, tools=self.tools)
+
+        logger.debug(f"Model: {self.model}, Question: {question}, Answer: {answer}")
+        return answer
+
+    async def aanswer_subquestions(self, questions: list, max_concurrency: int = MAX_CONCURRENT_SUBQUESTIONS) -> list:
+        """
+        Answer the sub-questions concurrently, as they do not depend on each other
+        Args:
+            questions (list): The sub-questions to process
+            max_concurrency (int): The maximum number of sub-questions asked at the same time
+        Returns:
+            list: The answers, in the order of the sub-questions
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def answer(question: str) -> str:
+            async with semaphore:
+                return await self.aanswer_subquestion(question)
+
+        return list(await asyncio.gather(*(answer(question) for question in questions)))
+
+    def answer_batch(self, questions: list) -> list:
+        """
+        Answer several questions about the trace in a single call, asking for the answers
+        as JSON, and ask again one by one only the questions whose answer could not be parsed
+        Args:
+            questions (list): The questions to process
+        Returns:
+            list: The answers, in the order of the questions
+        """
+        prefix = self.session_prefix()
+        if prefix is None:
+            logger.debug(f"Model: {self.model}, the trace is answered in windows, answering {len(questions)} questions one by one")
+            return [self.answer_subquestion(question) for question in questions]
+
+        template = """Answer each of the following questions about the trace.
+        DON'T GIVE FUNCTIONS OR CODE, ONLY THE ANSWERS.
+        Reply only with a JSON object of the form {{"answers": [{{"id": 1, "answer": "..."}}]}},
+        with one answer for each question, identified by its number.
+        Questions:
+        {questions}"""
+        prompt = ChatPromptTemplate.from_messages([("human", template)])
+        numbered = "\n".join(f'{i}. "{question}"' for i, question in enumerate(questions, start=1))
+
+        response = self.call_llm([*prefix, *prompt.format_messages(questions=numbered)], tools=self.tools, schema=BATCH_SCHEMA)
+        answers = parse_batch_answers(response if isinstance(response, str) else json.dumps(response), len(questions))
+
+        missing = [question for i, question in enumerate(questions, start=1) if i not in answers]
+        logger.debug(f"Model: {self.model}, Questions: {questions}, Batch answers: {answers}, Unparsed: {missing}")
+        return [answers[i] if i in answers else self.answer_subquestion(question) for i, question in enumerate(questions, start=1)]
+
+    def answer_messages(self, question: str) -> list[BaseMessage] | None:
+        """
+        Build the messages asking the sub-question in the analysis session of the trace
+        Args:
+            question (str): The question to process
+        Returns:
+            list[BaseMessage] | None: The messages, None if the trace must be answered in windows
+        """
+        prefix = self.session_prefix()
+        if prefix is None:
+            return None
+        return [*prefix, self.question_message(question)]
+
+    def question_message(self, question: str) -> HumanMessage:
+        """
+        Build the message asking a question at the end of the analysis session
+        Args:
+            question (str): The question to process
+        Returns:
+            HumanMessage: The message
+        """
+        return HumanMessage(content=f'Question: "{question}"')
+
+    def session_prefix(self) -> list[BaseMessage] | None:
+        """
+        Get the messages opening the analysis session of the trace: the instructions and the
+        trace as shown by the prompt mode. They are the same for every question, which is only
+        appended after them, so the backends can reuse the prefill of the prefix between calls.
+        Returns:
+            list[BaseMessage] | None: The messages, None if the trace must be answered in windows
+        """
+        if self.prompt_mode not in self.__session:
+            self.__session[self.prompt_mode] = self.__build_prefix(self.prompt_mode)
+        return self.__session[self.prompt_mode]
+
+    def __build_prefix(self, prompt_mode: str) -> list[BaseMessage] | None:
+        if prompt_mode == "summary":
+            template = """You are a network analyst that answer questions about network traces.
+        Use the following summaries of a network trace to answer the questions.
+        DON'T GIVE FUNCTIONS OR CODE, ONLY THE ANSWER.
+        Summaries:
+        {summary}"""
+            return ChatPromptTemplate.from_messages([("system", template)]).format_messages(summary=self.summary)
+
         template = """You are a network analyst that answer questions about network traces.
         Use the following network trace to answer the questions.
         DON'T GIVE FUNCTIONS OR CODE, ONLY THE ANSWER.
-        Question: "{question}"
         Trace:
         {traces}"""
-        prompt = ChatPromptTemplate.from_template(template)
-        messages = {"traces": self.file[0].page_content, "question": question}
+        if prompt_mode == "summary+rows":
+            template = """You are a network analyst that answer questions about network traces.
+        Use the following summaries of a network trace and its packets to answer the questions.
+        DON'T GIVE FUNCTIONS OR CODE, ONLY THE ANSWER.
+        Summaries:
+        {summary}
+        Trace:
+        {traces}"""
+        prompt = ChatPromptTemplate.from_messages([("system", template)])
+        context = {"summary": self.summary} if prompt_mode == "summary+rows" else {}
+        if self.chunked and self.context_size is not None and estimate_tokens(self.file[0].page_content) > self.trace_budget(prompt, **context):
+            return None
+        return prompt.format_messages(traces=self.fit_trace(prompt, **context), **context)
 
-        answer = self.call_llm(prompt.format_messages(**messages), tools=self.tools)
+    def window_prefixes(self) -> list[list[BaseMessage]]:
+        """
+        Get the messages opening the analysis session of each window of the trace, the same for every question
+        Returns:
+            list[list[BaseMessage]]: The messages of each window
+        """
+        if "windows" not in self.__session:
+            template = """You are a network analyst that answer questions about network traces.
+        The trace is too long to be read at once, you are given part {part} of {parts} of it.
+        Answer the question only for the packets of this part, giving the partial values needed
+        to combine it with the other parts (counts, sums, first and last times, lists of addresses).
+        DON'T GIVE FUNCTIONS OR CODE, ONLY THE ANSWER.
+        Part of the trace:
+        {traces}"""
+            prompt = ChatPromptTemplate.from_messages([("system", template)])
+            trace = self.file[0].page_content
+            # The number of windows is bounded by the number of packets
+            max_parts = str(trace.count("\n"))
+            windows = chunk_trace(trace, self.trace_budget(prompt, part=max_parts, parts=max_parts))
+            self.__session["windows"] = [
+                prompt.format_messages(traces=window, part=part, parts=len(windows))
+                for part, window in enumerate(windows, start=1)
+            ]
+        return self.__session["windows"]
 
-        logger.debug(f"Model: {self.model}, Question: {question}, Answer: {answer}")
+    def answer_subquestion_chunked(self, question: str) -> str:
+        """
+        Answer the sub-question over each window of the trace concurrently and combine the partial answers
+        Args:
+            question (str): The question to process
+        Returns:
+            str: The answer to the question
+        """
+        windows = self.window_prefixes()
+
+        def answer_window(prefix: list[BaseMessage]) -> str:
+            return self.call_llm([*prefix, self.question_message(question)], tools=self.tools)
+
+        logger.debug(f"Model: {self.model}, Question: {question}, Answering over {len(windows)} windows")
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_WINDOWS, len(windows))) as executor:
+            partial_answers = list(executor.map(answer_window, windows))
+
+        answer = self.combine_answers(question, partial_answers)
+
+        logger.debug(f"Model: {self.model}, Question: {question}, Partial answers: {partial_answers}, Answer: {answer}")
         return answer
 
+    def combine_answers(self, question: str, partial_answers: list) -> str:
+        """
+        Combine the answers to the sub-question over consecutive windows of the trace. When they do
+        not fit the context window together, they are combined hierarchically: consecutive groups
+        that fit are combined concurrently into partial answers of more parts, until one group is left.
+        Args:
+            question (str): The question to process
+            partial_answers (list): The answers over each window, in the order of the windows
+        Returns:
+            str: The answer to the question for the whole trace
+        """
+        template = """You are a network analyst that answer questions about network traces.
+        The trace was split in consecutive parts and the question was answered for each part.
+        Combine the partial answers into the answer for {scope}, adding counts and sums,
+        and keeping the first and last times. Use the calculator for the arithmetic if you have it.
+        DON'T GIVE FUNCTIONS OR CODE, ONLY THE ANSWER.
+        Partial answers:
+        {context}
+        Question: "{question}\""""
+        prompt = ChatPromptTemplate.from_template(template)
+        intermediate_scope = "parts {first} to {last} of the trace, giving the partial values needed to combine it with the other parts"
+
+        budget = None
+        if self.context_size is not None:
+            longest_scope = intermediate_scope.format(first=len(partial_answers), last=len(partial_answers))
+            overhead = estimate_tokens("".join(str(message.content) for message in prompt.format_messages(context="", question=question, scope=longest_scope)))
+            # Answers are cut to half the budget, so any two of them fit together
+            budget = max((self.context_size - overhead - RESPONSE_TOKENS) // 2, 1)
+
+        def entry(first: int, last: int, answer: str) -> str:
+            label = f"Part {first}" if first == last else f"Parts {first} to {last}"
+            text = f"{label}: {answer}"
+            if budget is not None and estimate_tokens(text + "\n\n") > budget:
+                text = text[:max(budget * CHARS_PER_TOKEN - len("\n\n [...]"), 0)] + " [...]"
+            return text
+
+        def combine(group: list, scope: str) -> str:
+            context = "\n\n".join(entry(*part) for part in group)
+            return self.call_llm(prompt.format_messages(context=context, question=question, scope=scope), tools=self.tools)
+
+        parts = [(i, i, answer) for i, answer in enumerate(partial_answers, start=1)]
+        while True:
+            groups, group, size = [], [], 0
+            for part in parts:
+                tokens = estimate_tokens(entry(*part) + "\n\n")
+                # Groups take at least two parts, so every round reduces the number of parts
+                if len(group) > 1 and budget is not None and size + tokens > 2 * budget:
+                    groups.append(group)
+                    group, size = [], 0
+                group.append(part)
+                size += tokens
+            groups.append(group)
+            if len(groups) == 1:
+                return combine(groups[0], "the whole trace")
+
+            logger.debug(f"Model: {self.model}, Question: {question}, Combining {len(parts)} partial answers in {len(groups)} groups")
+            def combine_group(group: list) -> str:
+                if len(group) == 1:
+                    return group[0][2]
+                return combine(group, intermediate_scope.format(first=group[0][0], last=group[-1][1]))
+
+            with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_WINDOWS, len(groups))) as executor:
+                answers = list(executor.map(combine_group, groups))
+            parts = [(group[0][0], group[-1][1], answer) for group, answer in zip(groups, answers)]
+
+    def trace_budget(self, prompt: ChatPromptTemplate, **kwargs) -> int:
+        """
+        Get the tokens of the context window left for the trace in the prefix of an analysis session
+        Args:
+            prompt (ChatPromptTemplate): The prompt the trace is inserted in as {traces}
+            kwargs: The other variables of the prompt
+        Returns:
+            int: The number of tokens available for the trace
+        """
+        overhead = estimate_tokens("".join(str(message.content) for message in prompt.format_messages(traces="", **kwargs)))
+        return max(self.context_size - overhead - QUESTION_TOKENS - RESPONSE_TOKENS, 0)
+
+    def fit_trace(self, prompt: ChatPromptTemplate, **kwargs) -> str:
+        """
+        Render the trace to fit the context window of the model together with the prompt
+        Args:
+            prompt (ChatPromptTemplate): The prompt the trace is inserted in as {traces}
+            kwargs: The other variables of the prompt
+        Returns:
+            str: The trace, degraded if it does not fit
+        """
+        trace = self.file[0].page_content
+        if self.context_size is None:
+            return trace
+
+        budget = self.trace_budget(prompt, **kwargs)
+        if budget not in self.__traces:
+            self.__traces[budget] = fit_trace(trace, budget)
+        return self.__traces[budget]
+
     def format_qa_pairs(self, questions: list, answers: list) -> str:
         """
         Format the questions and answers into a string
@@ -164,33 +772,66 @@ class LLM:
         Returns:
             str: The final answer
         """
+        final_answer = self.call_llm(self.final_messages(question, subquestions, answers), tools=self.tools)
+
+        logger.debug(f"Model: {self.model}, Question: {question}, Final answer: {final_answer}")
+        return final_answer
+
+    async def aget_final_answer(self, question:str, subquestions: list, answers: list) -> str:
+        """
+        Combine the questions and answers to get a final answer asynchronously
+        Args:
+            question (str): The question to process
+            subquestions (list): The list of sub-questions
+            answers (list): The list of answers to the sub-questions
+        Returns:
+            str: The final answer
+        """
+        final_answer = await self.acall_llm(self.final_messages(question, subquestions, answers), tools=self.tools)
+
+        logger.debug(f"Model: {self.model}, Question: {question}, Final answer: {final_answer}")
+        return final_answer
+
+    def final_messages(self, question:str, subquestions: list, answers: list) -> list[BaseMessage]:
+        """
+        Build the messages asking to combine the answers to the sub-questions
+        Args:
+            question (str): The question to process
+            subquestions (list): The list of sub-questions
+            answers (list): The list of answers to the sub-questions
+        Returns:
+            list[BaseMessage]: The messages
+        """
         template = """Here is a set of Q+A pairs:
         {context}
         Use these to synthesize an answer to the question: {question}"""
         prompt = ChatPromptTemplate.from_template(template)
         messages = {"context": self.format_qa_pairs(subquestions, answers), "question": question}
-
-        final_answer = self.call_llm(prompt.format_messages(**messages), tools=self.tools)
-
-        logger.debug(f"Model: {self.model}, Question: {question}, Final answer: {final_answer}")
-        return final_answer
+        return prompt.format_messages(**messages)
 
 
 class LLM_GEMINI(LLM):
     """
     Class for Google Gemini LLM
     """
-    def __init__(self, data_path: str, tools: bool = False):
+    provider = "google"
+
+    def __init__(self, data_path: str, tools: bool = False, chunked: bool = False, summary_path: str | None = None, prompt_mode: str = "rows", cache: bool = True):
         """
         Initialize the LLM object with the file provided
         Args:
             data_path (str): The path of the file to process
+            chunked (bool): Whether to answer over windows of the trace when it does not fit the context
+            summary_path (str | None): The path of the summaries of the trace
+            prompt_mode (str): What the prompts show of the trace, one of PROMPT_MODES
+            cache (bool): Whether to reuse the cached responses of the model
         """
-        super().__init__(data_path)
+        super().__init__(data_path, chunked, summary_path, prompt_mode, cache)
         os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
 
         self.model = "gemini-2.0-flash"
         self.tools = tools
+        self.context_size = 1048576
 
         llm = ChatGoogleGenerativeAI(
             model=self.model,
@@ -212,20 +853,28 @@ class LLM_QWEN_2_5_7B(LLM):
     """
     Class for Qwen2.5 7B LLM
     """
-    def __init__(self, data_path: str, tools: bool = False):
+    provider = "ollama"
+
+    def __init__(self, data_path: str, tools: bool = False, chunked: bool = False, summary_path: str | None = None, prompt_mode: str = "rows", cache: bool = True):
         """
         Initialize the LLM object with the file provided
         Args:
             data_path (str): The path of the file to process
+            chunked (bool): Whether to answer over windows of the trace when it does not fit the context
+            summary_path (str | None): The path of the summaries of the trace
+            prompt_mode (str): What the prompts show of the trace, one of PROMPT_MODES
+            cache (bool): Whether to reuse the cached responses of the model
         """
-        super().__init__(data_path)
+        super().__init__(data_path, chunked, summary_path, prompt_mode, cache)
 
         self.model = "qwen2.5"
         self.tools = tools
+        self.context_size = 32768
 
         llm = ChatOllama(
             model=self.model,
-            num_ctx=32768,
+            num_ctx=self.context_size,
+            keep_alive=KEEP_ALIVE,
         )
 
         self.llm = llm
@@ -241,23 +890,32 @@ class LLM_GEMMA_3(LLM):
     """
     Class for Google Gemma 3 LLM
     """
-    def __init__(self, data_path: str, tools: bool = False):
+    provider = "google"
+
+    def __init__(self, data_path: str, tools: bool = False, chunked: bool = False, summary_path: str | None = None, prompt_mode: str = "rows", cache: bool = True):
         """
         Initialize the LLM object with the file provided
         Args:
             data_path (str): The path of the file to process
+            chunked (bool): Whether to answer over windows of the trace when it does not fit the context
+            summary_path (str | None): The path of the summaries of the trace
+            prompt_mode (str): What the prompts show of the trace, one of PROMPT_MODES
+            cache (bool): Whether to reuse the cached responses of the model
         """
-        super().__init__(data_path)
+        super().__init__(data_path, chunked, summary_path, prompt_mode, cache)
         os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
 
         self.model = "gemma-3-27b-it"
         self.tools = tools
+        self.context_size = 131072
 
         llm = ChatGoogleGenerativeAI(
             model=self.model,
             temperature=0,
             max_tokens=None,
             timeout=None,
+            # Gemma has no system instructions, the prefix is sent at the start of the question
+            convert_system_message_to_human=True,
         )
 
         self.llm = llm
@@ -273,19 +931,29 @@ class LLM_LLAMA2_7B(LLM):
     """
     Class for Llama 2 7B LLM
     """
-    def __init__(self, data_path: str, tools: bool = False):
+    provider = "ollama"
+
+    def __init__(self, data_path: str, tools: bool = False, chunked: bool = False, summary_path: str | None = None, prompt_mode: str = "rows", cache: bool = True):
         """
         Initialize the LLM object with the file provided
         Args:
             data_path (str): The path of the file to process
+            chunked (bool): Whether to answer over windows of the trace when it does not fit the context
+            summary_path (str | None): The path of the summaries of the trace
+            prompt_mode (str): What the prompts show of the trace, one of PROMPT_MODES
+            cache (bool): Whether to reuse the cached responses of the model
         """
-        super().__init__(data_path)
+        super().__init__(data_path, chunked, summary_path, prompt_mode, cache)
 
         self.model = "llama2"
         self.tools = tools
+        # Ollama's default num_ctx
+        self.context_size = 2048
 
         llm = ChatOllama(
             model=self.model,
+            num_ctx=self.context_size,
+            keep_alive=KEEP_ALIVE,
         )
 
         self.llm = llm
@@ -301,20 +969,28 @@ class LLM_MISTRAL_7B(LLM):
     """
     Class for Mistral 7B LLM using Ollama
     """
-    def __init__(self, data_path: str, tools: bool = False):
+    provider = "ollama"
+
+    def __init__(self, data_path: str, tools: bool = False, chunked: bool = False, summary_path: str | None = None, prompt_mode: str = "rows", cache: bool = True):
         """
         Initialize the LLM object with the file provided
         Args:
             data_path (str): The path of the file to process
+            chunked (bool): Whether to answer over windows of the trace when it does not fit the context
+            summary_path (str | None): The path of the summaries of the trace
+            prompt_mode (str): What the prompts show of the trace, one of PROMPT_MODES
+            cache (bool): Whether to reuse the cached responses of the model
         """
-        super().__init__(data_path)
+        super().__init__(data_path, chunked, summary_path, prompt_mode, cache)
 
         self.model = "mistral"
         self.tools = tools
+        self.context_size = 32768
 
         llm = ChatOllama(
             model=self.model,
-            num_ctx=32768,
+            num_ctx=self.context_size,
+            keep_alive=KEEP_ALIVE,
         )
 
         self.llm = llm
@@ -330,20 +1006,28 @@ class LLM_LLAMA3_8B(LLM):
     """
     Class for Llama3.1 8B LLM
     """
-    def __init__(self, data_path: str, tools: bool = False):
+    provider = "ollama"
+
+    def __init__(self, data_path: str, tools: bool = False, chunked: bool = False, summary_path: str | None = None, prompt_mode: str = "rows", cache: bool = True):
         """
         Initialize the LLM object with the file provided
         Args:
             data_path (str): The path of the file to process
+            chunked (bool): Whether to answer over windows of the trace when it does not fit the context
+            summary_path (str | None): The path of the summaries of the trace
+            prompt_mode (str): What the prompts show of the trace, one of PROMPT_MODES
+            cache (bool): Whether to reuse the cached responses of the model
         """
-        super().__init__(data_path)
+        super().__init__(data_path, chunked, summary_path, prompt_mode, cache)
 
         self.model = "llama3.1"
         self.tools = tools
+        self.context_size = 128000
 
         llm = ChatOllama(
             model=self.model,
-            num_ctx=128000,
+            num_ctx=self.context_size,
+            keep_alive=KEEP_ALIVE,
         )
 
         self.llm = llm
@@ -359,20 +1043,28 @@ class LLM_GEMMA3_12B_Ollama(LLM):
     """
     Class for Gemma3 12B LLM using Ollama
     """
-    def __init__(self, data_path: str, tools: bool = False):
+    provider = "ollama"
+
+    def __init__(self, data_path: str, tools: bool = False, chunked: bool = False, summary_path: str | None = None, prompt_mode: str = "rows", cache: bool = True):
         """
         Initialize the LLM object with the file provided
         Args:
             data_path (str): The path of the file to process
+            chunked (bool): Whether to answer over windows of the trace when it does not fit the context
+            summary_path (str | None): The path of the summaries of the trace
+            prompt_mode (str): What the prompts show of the trace, one of PROMPT_MODES
+            cache (bool): Whether to reuse the cached responses of the model
         """
-        super().__init__(data_path)
+        super().__init__(data_path, chunked, summary_path, prompt_mode, cache)
 
         self.model = "gemma3:12b"
         self.tools = tools
+        self.context_size = 128000
 
         llm = ChatOllama(
             model=self.model,
-            num_ctx=128000,
+            num_ctx=self.context_size,
+            keep_alive=KEEP_ALIVE,
         )
 
         self.llm = llm
@@ -384,6 +1076,16 @@ class LLM_GEMMA3_12B_Ollama(LLM):
         else:
             logger.debug("Using Gemma3 12B LLM using Ollama without tools")
 
+"""
+Requests and tokens per minute allowed by each provider, shared by all its models.
+The Google limits are those of the free tier of the Gemini API; the local Ollama
+server has none.
+"""
+RATE_LIMITS = {
+    "google": {"requests_per_minute": 15, "tokens_per_minute": 1_000_000},
+    "ollama": {},
+}
+
 """
 This dictionary maps model names to their respective LLM classes and
 if windows context size is small or big.
@@ -0,0 +1,804 @@
+import mmap
+import socket
+import struct
+from decimal import Decimal
+import logging
+from pathlib import Path
+from scapy.all import PcapReader, TCP, UDP, conf
+from scapy.data import MTU
+from netexplainer.logger import configure_logger
+from netexplainer.stats import PROTOCOLS, packet_addresses, packet_protocol
+from netexplainer.store import MAGIC as COMPRESSED_MAGIC, open_capture
+
+configure_logger(name="reader", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("reader")
+
+"""
+Nanoseconds per second, timestamps are read as integer nanoseconds
+so the ground truth does not lose precision to floating point.
+"""
+NS_PER_SECOND = 10 ** 9
+
+"""
+Packet fields that can be requested from the reader. Only address and protocol
+need the layer 3 and 4 headers to be decoded.
+"""
+FIELDS = ("time", "length", "address", "protocol")
+HEADER_FIELDS = frozenset(("address", "protocol"))
+
+"""
+tshark fields a record can be built from, see tshark_record.
+"""
+TSHARK_RECORD_FIELDS = ("frame.time_epoch", "frame.cap_len", "ip.src", "ip.dst", "ipv6.src", "ipv6.dst", "frame.protocols")
+
+"""
+Names of the counted protocols in tshark's frame.protocols.
+"""
+TSHARK_PROTOCOLS = {protocol: protocol.lower() for protocol in PROTOCOLS}
+
+PCAP_MAGIC = {
+    b"\xa1\xb2\xc3\xd4": (">", 1000),
+    b"\xd4\xc3\xb2\xa1": ("<", 1000),
+    b"\xa1\xb2\x3c\x4d": (">", 1),
+    b"\x4d\x3c\xb2\xa1": ("<", 1),
+}
+PCAPNG_MAGIC = b"\x0a\x0d\x0d\x0a"
+
+"""
+Size of the buffers of whole records a compressed capture is decompressed into.
+"""
+STREAM_BUFFER_SIZE = 1 << 20
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 101)
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_ARP = 0x0806
+ETHERTYPE_VLAN = 0x8100
+ETHERTYPE_IPV6 = 0x86dd
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+"""
+Length of the header of each transport protocol. Scapy dissects a shorter
+payload as Raw, so it is not counted as that protocol.
+"""
+TRANSPORT_HEADER_LENGTHS = {IPPROTO_ICMP: 8, IPPROTO_TCP: 20, IPPROTO_UDP: 8}
+
+"""
+Returned by the decoders when a record is not plain enough to be decoded
+by hand and scapy has to dissect it.
+"""
+FALLBACK = None
+
+
+def _reaches_counted_layer(cls, seen: set) -> bool:
+    """
+    Whether dissecting a scapy layer may lead to an IP layer or to a counted protocol
+
+    Args:
+        cls (type): The scapy layer class
+        seen (set): The classes already visited
+
+    Returns:
+        bool: True if it may, False if it never does
+    """
+    if not isinstance(cls, type):
+        return True
+    if cls in seen:
+        return False
+    seen.add(cls)
+    if cls.__name__ in ('IP', 'IPv6') + PROTOCOLS or cls._name in ('IP', 'IPv6') + PROTOCOLS:
+        return True
+    if 'guess_payload_class' in cls.__dict__:
+        return True
+    return any(_reaches_counted_layer(payload, seen) for _, payload in cls.payload_guess)
+
+
+def _tunnel_ports(cls) -> frozenset:
+    """
+    Get the ports for which scapy may find other counted layers inside a TCP or UDP payload
+
+    Args:
+        cls (type): The scapy TCP or UDP class
+
+    Returns:
+        frozenset: The ports that have to be dissected by scapy
+    """
+    ports = set()
+    for fields, payload in cls.payload_guess:
+        if _reaches_counted_layer(payload, set()):
+            ports.update(value for name, value in fields.items() if name in ('sport', 'dport'))
+    return frozenset(ports)
+
+
+_TCP_TUNNEL_PORTS = _tunnel_ports(TCP)
+_UDP_TUNNEL_PORTS = _tunnel_ports(UDP)
+
+
+def read_records(file_path: str, fields=FIELDS, shard: tuple | None = None):
+    """
+    Read the records of a capture without dissecting them with scapy
+
+    Classic pcap and pcapng files, in both byte orders, are memory-mapped and
+    only the few header fields needed by the ground truth are decoded. Records
+    whose link type or headers are not handled here are dissected by scapy, as
+    are files in any other format. Compressed captures are decompressed as a
+    stream, see store.open_capture, and cannot be read in shards.
+
+    Args:
+        file_path (str): The path of the capture to read
+        fields (Iterable[str]): The fields to decode, addresses and protocol are
+            None in every record if they are not requested
+        shard (tuple | None): The (offset, stop, state) of the part of the file to
+            read, see shard_boundaries, None to read the whole file
+
+    Yields:
+        tuple: (time, length, addresses, protocol) of each record, where time is
+        in nanoseconds, addresses is a (src, dst) tuple or None and protocol is
+        one of PROTOCOLS or None
+    """
+    decode_headers = not HEADER_FIELDS.isdisjoint(fields)
+    with open(file_path, 'rb') as f:
+        magic = f.read(4)
+        if _is_compressed(magic):
+            yield from _stream_records(file_path, decode_headers)
+            return
+        if magic not in PCAP_MAGIC and magic != PCAPNG_MAGIC:
+            logger.debug(f'File {file_path} is not a plain pcap or pcapng file, reading it with scapy')
+            yield from scapy_records(file_path)
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            walker = _pcap_headers if magic in PCAP_MAGIC else _pcapng_headers
+            headers = walker(buf) if shard is None else walker(buf, *shard)
+            for linktype, time, start, end in headers:
+                end = min(end, start + MTU)
+                if not decode_headers:
+                    yield time, end - start, None, None
+                    continue
+                decoded = _decode(linktype, buf, start, end)
+                if decoded is FALLBACK:
+                    decoded = _dissect(linktype, buf[start:end])
+                yield (time, end - start) + decoded
+
+
+def _is_compressed(magic: bytes) -> bool:
+    return any(magic.startswith(prefix) for prefix in COMPRESSED_MAGIC)
+
+
+def _stream_records(file_path: str, decode_headers: bool):
+    """
+    Read the records of a compressed capture, decompressing it as a stream
+
+    Args:
+        file_path (str): The path of the capture to read
+        decode_headers (bool): Whether to decode the addresses and protocol
+
+    Yields:
+        tuple: (time, length, addresses, protocol) of each record, like read_records
+    """
+    with open_capture(file_path) as stream:
+        headers = _stream_headers(stream)
+        if headers is None:
+            logger.debug(f'File {file_path} is not a compressed pcap or pcapng file, reading it with scapy')
+            yield from scapy_records(file_path)
+            return
+
+        for linktype, time, buf, start, end in headers:
+            end = min(end, start + MTU)
+            if not decode_headers:
+                yield time, end - start, None, None
+                continue
+            decoded = _decode(linktype, buf, start, end)
+            if decoded is FALLBACK:
+                decoded = _dissect(linktype, buf[start:end])
+            yield (time, end - start) + decoded
+
+
+def _stream_headers(stream):
+    """
+    Walk the record headers of an uncompressed pcap or pcapng stream, read in buffers of whole records
+
+    Args:
+        stream (file): The binary stream, at the start of the capture
+
+    Returns:
+        Generator | None: The (linktype, time, buf, start, end) of each record, where start and end
+        delimit its captured bytes in the buffer buf, None if the stream is not a pcap or pcapng capture
+    """
+    magic = stream.read(4)
+    if magic in PCAP_MAGIC:
+        return _stream_pcap_headers(stream, magic)
+    if magic == PCAPNG_MAGIC:
+        return _stream_pcapng_headers(stream, magic)
+    return None
+
+
+def _stream_pcap_headers(stream, magic: bytes):
+    """
+    Walk the record headers of a classic pcap stream, reusing _pcap_headers on each buffer
+    prefixed with the file header
+
+    Args:
+        stream (file): The binary stream, after the magic number
+        magic (bytes): The magic number
+
+    Yields:
+        tuple: (linktype, time, buf, start, end) of each record
+    """
+    endian, _ = PCAP_MAGIC[magic]
+    record_header = struct.Struct(endian + "IIII")
+    file_header = magic + stream.read(20)
+    if len(file_header) < 24:
+        return
+
+    end_of_stream = False
+    while not end_of_stream:
+        buf = bytearray(file_header)
+        while len(buf) < STREAM_BUFFER_SIZE:
+            header = stream.read(16)
+            buf += header
+            if len(header) < 16:
+                end_of_stream = True
+                break
+            caplen = record_header.unpack(header)[2]
+            data = stream.read(caplen)
+            buf += data
+            if len(data) < caplen:
+                end_of_stream = True
+                break
+        buf = bytes(buf)
+        for linktype, time, start, end in _pcap_headers(buf):
+            yield linktype, time, buf, start, end
+
+
+def _stream_pcapng_headers(stream, magic: bytes):
+    """
+    Walk the blocks of a pcapng stream, reusing _pcapng_headers on each buffer and
+    carrying its state from one buffer to the next
+
+    Args:
+        stream (file): The binary stream, after the magic number
+        magic (bytes): The magic number
+
+    Yields:
+        tuple: (linktype, time, buf, start, end) of each packet block
+    """
+    state = None
+    endian = "<"
+    block_start = magic
+    end_of_stream = False
+    while not end_of_stream:
+        buf = bytearray()
+        while len(buf) < STREAM_BUFFER_SIZE:
+            block = block_start + stream.read(8 - len(block_start))
+            block_start = b""
+            if len(block) < 8:
+                end_of_stream = True
+                break
+            if block[:4] == PCAPNG_MAGIC:
+                block += stream.read(4)
+                byte_order = block[8:12]
+                if byte_order == b"\x1a\x2b\x3c\x4d":
+                    endian = ">"
+                elif byte_order == b"\x4d\x3c\x2b\x1a":
+                    endian = "<"
+            block_len, = struct.unpack_from(endian + "I", block, 4)
+            rest = max(block_len - len(block), 0)
+            data = stream.read(rest)
+            buf += block + data
+            if block_len < 12 or len(data) < rest:
+                end_of_stream = True
+                break
+        buf = bytes(buf)
+        headers = _pcapng_headers(buf, 0, None, state)
+        while True:
+            try:
+                linktype, time, start, end = next(headers)
+            except StopIteration as stop:
+                _, state = stop.value
+                break
+            yield linktype, time, buf, start, end
+
+
+def count_records(file_path: str, limit: int | None = None) -> int:
+    """
+    Count the records of a capture by walking their headers only
+
+    Args:
+        file_path (str): The path of the capture to count
+        limit (int | None): Stop counting as soon as the count exceeds this number,
+            None to count every record
+
+    Returns:
+        int: The number of records, limit + 1 if there are more than limit
+    """
+    with open(file_path, 'rb') as f:
+        magic = f.read(4)
+        if _is_compressed(magic):
+            with open_capture(file_path) as stream:
+                headers = _stream_headers(stream)
+                if headers is not None:
+                    return _count(headers, limit)
+        if magic not in PCAP_MAGIC and magic != PCAPNG_MAGIC:
+            logger.debug(f'File {file_path} is not a plain pcap or pcapng file, counting it with scapy')
+            with open_capture(file_path) as stream, PcapReader(stream) as reader:
+                return _count(reader, limit)
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            walker = _pcap_headers if magic in PCAP_MAGIC else _pcapng_headers
+            return _count(walker(buf), limit)
+
+
+def capture_format(file_path: str) -> tuple:
+    """
+    Identify the format and link type of a capture from its headers
+
+    Args:
+        file_path (str): The path of the capture
+
+    Returns:
+        tuple: The format, "pcap", "pcapng" or None if it is only readable by scapy,
+        and the link type of the file or of its first record, None if unknown
+    """
+    with open_capture(file_path) as f:
+        magic = f.read(4)
+        if magic in PCAP_MAGIC:
+            header = magic + f.read(20)
+            if len(header) < 24:
+                return "pcap", None
+            endian, _ = PCAP_MAGIC[magic]
+            linktype, = struct.unpack_from(endian + "I", header, 20)
+            return "pcap", linktype
+        if magic != PCAPNG_MAGIC:
+            return None, None
+
+        first = next(_stream_pcapng_headers(f, magic), None)
+        return "pcapng", None if first is None else first[0]
+
+
+def _count(items, limit: int | None) -> int:
+    """
+    Count the items of an iterator, stopping once the count exceeds limit
+
+    Args:
+        items (Iterable): The items to count
+        limit (int | None): The limit, None to count every item
+
+    Returns:
+        int: The number of items, at most limit + 1
+    """
+    count = 0
+    for _ in items:
+        count += 1
+        if limit is not None and count > limit:
+            break
+    return count
+
+
+def shard_boundaries(file_path: str, shards: int) -> list | None:
+    """
+    Split a capture into parts of about the same size that start at a record
+
+    The record headers are walked once, without decoding the records, to find
+    where each part starts and the state needed to resume walking from there.
+
+    Args:
+        file_path (str): The path of the capture
+        shards (int): The number of parts
+
+    Returns:
+        list | None: The (offset, stop, state) of each non-empty part, to be passed
+        to read_records, None if the capture is not a plain pcap or pcapng file
+    """
+    with open(file_path, 'rb') as f:
+        magic = f.read(4)
+        if magic not in PCAP_MAGIC and magic != PCAPNG_MAGIC:
+            return None
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            walker = _pcap_headers if magic in PCAP_MAGIC else _pcapng_headers
+            size = len(buf)
+            offset, state = _walk(walker(buf, stop=0))
+            boundaries = []
+            for shard in range(1, shards + 1):
+                stop = size * shard // shards
+                end, end_state = _walk(walker(buf, offset, stop, state))
+                if end > offset:
+                    boundaries.append((offset, end, state))
+                offset, state = end, end_state
+            return boundaries
+
+
+def _walk(headers) -> tuple:
+    """
+    Walk record headers to the end, returning where the walker stopped
+
+    Args:
+        headers (Generator): A walker, _pcap_headers or _pcapng_headers
+
+    Returns:
+        tuple: The (offset, state) the walker returned
+    """
+    while True:
+        try:
+            next(headers)
+        except StopIteration as stop:
+            return stop.value
+
+
+def scapy_records(file_path: str):
+    """
+    Read the records of a capture by dissecting every packet with scapy
+
+    Args:
+        file_path (str): The path of the capture to read
+
+    Yields:
+        tuple: (time, length, addresses, protocol) of each record, like read_records
+    """
+    with open_capture(file_path) as stream, PcapReader(stream) as reader:
+        yield from packet_records(reader)
+
+
+def packet_records(packets):
+    """
+    Convert scapy packets to records
+
+    Args:
+        packets (Iterable[Packet]): The packets to convert
+
+    Yields:
+        tuple: (time, length, addresses, protocol) of each packet, like read_records
+    """
+    for packet in packets:
+        yield int(packet.time * NS_PER_SECOND), len(packet), packet_addresses(packet), packet_protocol(packet)
+
+
+def tshark_record(fields: list) -> tuple:
+    """
+    Build a record from the fields of a packet extracted with tshark
+
+    Args:
+        fields (list): The values of TSHARK_RECORD_FIELDS for the packet
+
+    Returns:
+        tuple: (time, length, addresses, protocol) of the packet, like read_records
+    """
+    time_epoch, cap_len, ip_src, ip_dst, ipv6_src, ipv6_dst, frame_protocols = fields
+    seconds, _, fraction = time_epoch.partition(".")
+    time = int(seconds) * NS_PER_SECOND + int(fraction[:9].ljust(9, "0"))
+
+    if ip_src:
+        addresses = ip_src, ip_dst
+    elif ipv6_src:
+        addresses = ipv6_src, ipv6_dst
+    else:
+        addresses = None
+
+    layers = frame_protocols.split(":")
+    protocol = next((protocol for protocol in PROTOCOLS if TSHARK_PROTOCOLS[protocol] in layers), None)
+    return time, int(cap_len), addresses, protocol
+
+
+def _pcap_headers(buf, offset: int = 24, stop: int | None = None, state=None):
+    """
+    Walk the record headers of a classic pcap file
+
+    Args:
+        buf (mmap.mmap): The mapped file
+        offset (int): The offset of the first record to walk
+        stop (int | None): Stop at the first record starting at or after this offset,
+            None to walk to the end of the file
+        state (None): Unused, classic pcap files need no state to resume walking
+
+    Yields:
+        tuple: (linktype, time, start, end) of each record, where start and end
+        delimit its captured bytes in buf
+
+    Returns:
+        tuple: The (offset, state) where the walk stopped
+    """
+    endian, ns_per_tick = PCAP_MAGIC[buf[:4]]
+    if len(buf) < 24:
+        return len(buf), None
+    linktype, = struct.unpack_from(endian + "I", buf, 20)
+    record_header = struct.Struct(endian + "IIII")
+    size = len(buf)
+    stop = size if stop is None else stop
+
+    while offset + 16 <= size and offset < stop:
+        sec, frac, caplen, _ = record_header.unpack_from(buf, offset)
+        start = offset + 16
+        yield linktype, sec * NS_PER_SECOND + frac * ns_per_tick, start, min(start + caplen, size)
+        offset = start + caplen
+    return offset, None
+
+
+def _pcapng_headers(buf, offset: int = 0, stop: int | None = None, state: tuple | None = None):
+    """
+    Walk the blocks of a pcapng file, keeping track of its sections and interfaces
+
+    Args:
+        buf (mmap.mmap): The mapped file
+        offset (int): The offset of the first block to walk
+        stop (int | None): Stop at the first block starting at or after this offset,
+            None to walk to the end of the file
+        state (tuple | None): The (endian, interfaces, time) at offset, returned by a
+            previous walk, None at the start of the file
+
+    Yields:
+        tuple: (linktype, time, start, end) of each packet block, where start and
+        end delimit its captured bytes in buf
+
+    Returns:
+        tuple: The (offset, state) where the walk stopped
+    """
+    size = len(buf)
+    stop = size if stop is None else stop
+    endian, interfaces, time = ("<", [], 0) if state is None else state
+    interfaces = list(interfaces)
+
+    while offset + 12 <= size and offset < stop:
+        if buf[offset:offset + 4] == PCAPNG_MAGIC:
+            byte_order = buf[offset + 8:offset + 12]
+            if byte_order == b"\x1a\x2b\x3c\x4d":
+                endian = ">"
+            elif byte_order == b"\x4d\x3c\x2b\x1a":
+                endian = "<"
+            else:
+                logger.warning('Bad byte-order magic in pcapng section header, stopping')
+                return size, (endian, interfaces, time)
+            interfaces = []
+
+        block_type, block_len = struct.unpack_from(endian + "II", buf, offset)
+        if block_len < 12 or offset + block_len > size:
+            return size, (endian, interfaces, time)
+        body, body_end = offset + 8, offset + block_len - 4
+
+        if block_type == 1:
+            linktype, snaplen = struct.unpack_from(endian + "HxxI", buf, body)
+            interfaces.append((linktype, snaplen, _pcapng_tsresol(buf, body + 8, body_end, endian)))
+
+        elif block_type in (2, 6):
+            if block_type == 6:
+                interface, ts_high, ts_low, caplen, _ = struct.unpack_from(endian + "5I", buf, body)
+            else:
+                interface, _, ts_high, ts_low, caplen, _ = struct.unpack_from(endian + "HH4I", buf, body)
+            if interface < len(interfaces):
+                linktype, _, tsresol = interfaces[interface]
+                time = _ticks_to_ns((ts_high << 32) + ts_low, tsresol)
+                yield linktype, time, body + 20, min(body + 20 + caplen, body_end)
+
+        elif block_type == 3 and interfaces:
+            # Simple packet blocks have no timestamp, keep the last one seen
+            linktype, snaplen, _ = interfaces[0]
+            wirelen, = struct.unpack_from(endian + "I", buf, body)
+            yield linktype, time, body + 4, min(body + 4 + min(wirelen, snaplen), body_end)
+
+        offset += block_len + (-block_len % 4)
+    return offset, (endian, interfaces, time)
+
+
+def _pcapng_tsresol(buf, offset: int, end: int, endian: str) -> int:
+    """
+    Read the timestamp resolution option of a pcapng interface description block
+
+    Args:
+        buf (mmap.mmap): The mapped file
+        offset (int): The start of the options
+        end (int): The end of the options
+        endian (str): The byte order of the section
+
+    Returns:
+        int: The number of timestamp ticks per second
+    """
+    while offset + 4 <= end:
+        code, length = struct.unpack_from(endian + "HH", buf, offset)
+        if code == 0:
+            break
+        if code == 9 and length == 1:
+            tsresol = buf[offset + 4]
+            return (2 if tsresol & 128 else 10) ** (tsresol & 127)
+        offset += 4 + length + (-length % 4)
+    return 1000000
+
+
+def _ticks_to_ns(ticks: int, tsresol: int) -> int:
+    """
+    Convert a pcapng timestamp to nanoseconds the same way as scapy's timestamps
+
+    Args:
+        ticks (int): The timestamp in ticks
+        tsresol (int): The number of ticks per second
+
+    Returns:
+        int: The timestamp in nanoseconds
+    """
+    if NS_PER_SECOND % tsresol == 0:
+        return ticks * (NS_PER_SECOND // tsresol)
+    return int(Decimal(ticks) / tsresol * NS_PER_SECOND)
+
+
+def _dissect(linktype: int, data: bytes) -> tuple:
+    """
+    Dissect a single record with scapy
+
+    Args:
+        linktype (int): The link type of the record
+        data (bytes): The captured bytes of the record
+
+    Returns:
+        tuple: (addresses, protocol) of the record
+    """
+    cls = conf.l2types.num2layer.get(linktype)
+    if cls is None:
+        return None, None
+    try:
+        packet = cls(data)
+    except Exception:
+        return None, None
+    return packet_addresses(packet), packet_protocol(packet)
+
+
+def _decode(linktype: int, buf, start: int, end: int):
+    """
+    Decode the addresses and protocol of a record by hand
+
+    Args:
+        linktype (int): The link type of the record
+        buf (mmap.mmap): The mapped file
+        start (int): The start of the record in buf
+        end (int): The end of the record in buf
+
+    Returns:
+        tuple | None: (addresses, protocol) of the record, FALLBACK if it has to be dissected by scapy
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        if end - start < 14:
+            return FALLBACK
+        ethertype, = struct.unpack_from("!H", buf, start + 12)
+        start += 14
+        if ethertype == ETHERTYPE_VLAN:
+            if end - start < 4:
+                return FALLBACK
+            ethertype, = struct.unpack_from("!H", buf, start + 2)
+            start += 4
+        return _decode_ethertype(ethertype, buf, start, end)
+
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if end - start < 16:
+            return FALLBACK
+        ethertype, = struct.unpack_from("!H", buf, start + 14)
+        return _decode_ethertype(ethertype, buf, start + 16, end)
+
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if end - start < 20:
+            return FALLBACK
+        ethertype, = struct.unpack_from("!H", buf, start)
+        return _decode_ethertype(ethertype, buf, start + 20, end)
+
+    elif linktype in LINKTYPE_RAW:
+        if end - start < 1:
+            return FALLBACK
+        return _decode_ipv6(buf, start, end) if buf[start] >> 4 == 6 else _decode_ipv4(buf, start, end)
+
+    elif linktype == LINKTYPE_IPV4:
+        return _decode_ipv4(buf, start, end)
+
+    elif linktype == LINKTYPE_IPV6:
+        return _decode_ipv6(buf, start, end)
+
+    return FALLBACK
+
+
+def _decode_ethertype(ethertype: int, buf, start: int, end: int):
+    """
+    Decode the layer 3 header identified by an ethertype
+
+    Args:
+        ethertype (int): The ethertype of the header
+        buf (mmap.mmap): The mapped file
+        start (int): The start of the header in buf
+        end (int): The end of the record in buf
+
+    Returns:
+        tuple | None: (addresses, protocol) of the record, FALLBACK if it has to be dissected by scapy
+    """
+    if ethertype == ETHERTYPE_IPV4:
+        return _decode_ipv4(buf, start, end)
+    elif ethertype == ETHERTYPE_IPV6:
+        return _decode_ipv6(buf, start, end)
+    elif ethertype == ETHERTYPE_ARP:
+        return None, None
+    return FALLBACK
+
+
+def _decode_ipv4(buf, start: int, end: int):
+    """
+    Decode an IPv4 header and its transport protocol
+
+    Args:
+        buf (mmap.mmap): The mapped file
+        start (int): The start of the header in buf
+        end (int): The end of the record in buf
+
+    Returns:
+        tuple | None: (addresses, protocol) of the record, FALLBACK if it has to be dissected by scapy
+    """
+    if end - start < 20 or buf[start] != 0x45:
+        # Not version 4 or carrying options, let scapy handle it
+        return FALLBACK
+    total_length, fragment = struct.unpack_from("!HxxH", buf, start + 2)
+    protocol = buf[start + 9]
+    addresses = socket.inet_ntoa(buf[start + 12:start + 16]), socket.inet_ntoa(buf[start + 16:start + 20])
+
+    payload_end = min(start + total_length, end) if total_length >= 20 else end
+    if payload_end - start <= 20:
+        return addresses, None
+    if protocol not in (IPPROTO_ICMP, IPPROTO_TCP, IPPROTO_UDP):
+        return FALLBACK
+    if fragment & 0x1fff:
+        # Only the first fragment has its payload dissected
+        return addresses, None
+    return _decode_transport(protocol, addresses, buf, start + 20, payload_end)
+
+
+def _decode_ipv6(buf, start: int, end: int):
+    """
+    Decode an IPv6 header and its transport protocol
+
+    Args:
+        buf (mmap.mmap): The mapped file
+        start (int): The start of the header in buf
+        end (int): The end of the record in buf
+
+    Returns:
+        tuple | None: (addresses, protocol) of the record, FALLBACK if it has to be dissected by scapy
+    """
+    if end - start < 40 or buf[start] >> 4 != 6:
+        return FALLBACK
+    payload_length, next_header = struct.unpack_from("!HB", buf, start + 4)
+    if next_header not in (IPPROTO_TCP, IPPROTO_UDP):
+        # Extension headers, ICMPv6 and tunnels are left to scapy
+        return FALLBACK
+    addresses = (
+        socket.inet_ntop(socket.AF_INET6, buf[start + 8:start + 24]),
+        socket.inet_ntop(socket.AF_INET6, buf[start + 24:start + 40]),
+    )
+    payload_end = min(start + 40 + payload_length, end)
+    if payload_end - start <= 40:
+        return addresses, None
+    return _decode_transport(next_header, addresses, buf, start + 40, payload_end)
+
+
+def _decode_transport(protocol: int, addresses: tuple, buf, start: int, end: int):
+    """
+    Decode the transport protocol of an IP payload
+
+    Args:
+        protocol (int): The IP protocol number of the payload
+        addresses (tuple): The (src, dst) of the IP header
+        buf (mmap.mmap): The mapped file
+        start (int): The start of the payload in buf
+        end (int): The end of the record in buf
+
+    Returns:
+        tuple | None: (addresses, protocol) of the record, FALLBACK if it has to be dissected by scapy
+    """
+    if end - start < TRANSPORT_HEADER_LENGTHS[protocol]:
+        return addresses, None
+    if protocol == IPPROTO_ICMP:
+        return addresses, 'ICMP'
+    sport, dport = struct.unpack_from("!HH", buf, start)
+    tunnel_ports = _TCP_TUNNEL_PORTS if protocol == IPPROTO_TCP else _UDP_TUNNEL_PORTS
+    if sport in tunnel_ports or dport in tunnel_ports:
+        return FALLBACK
+    return addresses, 'TCP' if protocol == IPPROTO_TCP else 'UDP'
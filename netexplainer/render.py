@@ -0,0 +1,212 @@
+import math
+import logging
+from pathlib import Path
+from netexplainer.logger import configure_logger
+
+configure_logger(name="render", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("render")
+
+"""
+Average number of characters per token of a rendered trace. Traces are mostly
+numbers, addresses and separators, which tokenize worse than prose, so the
+estimate is kept on the conservative side.
+"""
+CHARS_PER_TOKEN = 3
+
+"""
+Columns dropped, in order, when the trace does not fit the budget.
+"""
+DROPPABLE_COLUMNS = ("Info",)
+
+"""
+Maximum length of a field once abbreviated, and decimals kept in the times.
+"""
+ABBREVIATED_FIELD_LENGTH = 24
+ABBREVIATED_TIME_DECIMALS = 3
+
+TRUNCATION_MARKER = "[... {omitted} of {total} packets omitted to fit the context window ...]\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text
+
+    Args:
+        text (str): The text
+
+    Returns:
+        int: The estimated number of tokens
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def parse_trace(trace: str) -> tuple:
+    """
+    Split a rendered trace into its header and rows of columns
+
+    Args:
+        trace (str): The trace, as written by Dataset
+
+    Returns:
+        tuple: The list of column names and the list of rows, each a list of fields
+    """
+    lines = trace.splitlines()
+    if not lines:
+        return [], []
+    header = lines[0].split("|")
+    # The Info column is the last one and may contain the separator itself
+    rows = [line.split(" | ", len(header) - 1) for line in lines[1:] if line.strip()]
+    return header, rows
+
+
+def format_trace(header: list, rows: list) -> str:
+    """
+    Join a header and rows of columns back into a rendered trace
+
+    Args:
+        header (list): The column names
+        rows (list): The rows, each a list of fields
+
+    Returns:
+        str: The trace
+    """
+    return "|".join(header) + "\n" + "".join(" | ".join(row) + "\n" for row in rows)
+
+
+def drop_column(header: list, rows: list, column: str) -> tuple:
+    """
+    Remove a column from a trace
+
+    Args:
+        header (list): The column names
+        rows (list): The rows, each a list of fields
+        column (str): The name of the column to drop
+
+    Returns:
+        tuple: The header and rows without the column
+    """
+    if column not in header:
+        return header, rows
+    index = header.index(column)
+    return header[:index] + header[index + 1:], [row[:index] + row[index + 1:] for row in rows]
+
+
+def abbreviate(header: list, rows: list) -> tuple:
+    """
+    Shorten the times to fewer decimals and cut long fields
+
+    Args:
+        header (list): The column names
+        rows (list): The rows, each a list of fields
+
+    Returns:
+        tuple: The header and abbreviated rows
+    """
+    time_index = header.index("Time") if "Time" in header else None
+
+    def shorten(index: int, field: str) -> str:
+        if index == time_index:
+            try:
+                return f"{float(field):.{ABBREVIATED_TIME_DECIMALS}f}"
+            except ValueError:
+                return field
+        if len(field) > ABBREVIATED_FIELD_LENGTH:
+            return field[:ABBREVIATED_FIELD_LENGTH - 3] + "..."
+        return field
+
+    return header, [[shorten(i, field) for i, field in enumerate(row)] for row in rows]
+
+
+def truncate(header: list, rows: list, budget: int, estimator=estimate_tokens) -> str:
+    """
+    Keep the first rows of a trace that fit the budget, followed by a marker of the omitted ones
+
+    Args:
+        header (list): The column names
+        rows (list): The rows, each a list of fields
+        budget (int): The maximum number of tokens
+        estimator (Callable[[str], int]): The token estimator
+
+    Returns:
+        str: The truncated trace
+    """
+    marker = TRUNCATION_MARKER.format(omitted=len(rows), total=len(rows))
+    used = estimator(format_trace(header, [])) + estimator(marker)
+    kept = 0
+    for row in rows:
+        used += estimator(" | ".join(row) + "\n")
+        if used > budget:
+            break
+        kept += 1
+    return format_trace(header, rows[:kept]) + TRUNCATION_MARKER.format(omitted=len(rows) - kept, total=len(rows))
+
+
+def fit_trace(trace: str, budget: int, estimator=estimate_tokens) -> str:
+    """
+    Render the richest version of a trace that fits a token budget, degrading it in stages:
+    dropping columns, abbreviating fields and finally truncating it with an explicit marker
+
+    Args:
+        trace (str): The trace, as written by Dataset
+        budget (int): The maximum number of tokens of the trace
+        estimator (Callable[[str], int]): The token estimator
+
+    Returns:
+        str: The trace that fits the budget
+    """
+    tokens = estimator(trace)
+    if tokens <= budget:
+        logger.debug(f"Trace of {tokens} tokens fits the budget of {budget} tokens")
+        return trace
+
+    header, rows = parse_trace(trace)
+    for column in DROPPABLE_COLUMNS:
+        header, rows = drop_column(header, rows, column)
+        fitted = format_trace(header, rows)
+        if estimator(fitted) <= budget:
+            logger.debug(f"Trace of {tokens} tokens fits the budget of {budget} tokens without column {column}")
+            return fitted
+
+    header, rows = abbreviate(header, rows)
+    fitted = format_trace(header, rows)
+    if estimator(fitted) <= budget:
+        logger.debug(f"Trace of {tokens} tokens fits the budget of {budget} tokens abbreviated")
+        return fitted
+
+    fitted = truncate(header, rows, budget, estimator)
+    logger.warning(f"Trace of {tokens} tokens truncated to fit the budget of {budget} tokens")
+    return fitted
+
+
+def chunk_trace(trace: str, budget: int, estimator=estimate_tokens) -> list:
+    """
+    Split a trace into windows of consecutive rows, each with the header, that fit a token budget.
+    A row larger than the budget on its own gets a window of its own.
+
+    Args:
+        trace (str): The trace, as written by Dataset
+        budget (int): The maximum number of tokens of each window
+        estimator (Callable[[str], int]): The token estimator
+
+    Returns:
+        list: The windows of the trace, in order
+    """
+    if estimator(trace) <= budget:
+        return [trace]
+
+    header, rows = parse_trace(trace)
+    header_tokens = estimator(format_trace(header, []))
+
+    windows, window, used = [], [], header_tokens
+    for row in rows:
+        tokens = estimator(" | ".join(row) + "\n")
+        if window and used + tokens > budget:
+            windows.append(format_trace(header, window))
+            window, used = [], header_tokens
+        window.append(row)
+        used += tokens
+    if window or not windows:
+        windows.append(format_trace(header, window))
+
+    logger.debug(f"Trace of {len(rows)} packets split into {len(windows)} windows of at most {budget} tokens")
+    return windows
@@ -2,25 +2,174 @@ import os
 import subprocess
 import re
 import requests
+import json
 import shutil
 import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from scapy.all import rdpcap
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from netexplainer.cache import atomic_writer, file_hash
+from netexplainer.catalog import CAPTURE_EXTENSIONS, Catalog
+from netexplainer.store import compress_capture
 from netexplainer.logger import configure_logger
+from netexplainer.reader import count_records
 
 configure_logger(name="scraper", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
 logger = logging.getLogger("scraper")
 DATASET_PATH = os.path.join(os.getcwd(), "netexplainer/data/raw")
 CLEANED_PATH = os.path.join(os.getcwd(), "netexplainer/data/cleaned")
 
+"""
+Number of concurrent downloads, and the connect and read timeouts in seconds of each request.
+"""
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_TIMEOUT = (10, 60)
+
+"""
+Size of the chunks in which the captures are streamed to disk.
+"""
+CHUNK_SIZE = 1 << 16
+
+"""
+Manifest of the downloaded or cleaned captures, kept in their directory, and the
+suffix of the partial downloads that are resumed on the next run.
+"""
+MANIFEST_NAME = ".manifest.json"
+PARTIAL_SUFFIX = ".part"
+
+
+def _load_manifest(path: str) -> dict:
+    """
+    Load a manifest of captures.
+
+    Args:
+        path (str): The path of the manifest.
+
+    Returns:
+        dict: The entries of the manifest, empty if there is no readable manifest.
+    """
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(path: str, manifest: dict) -> None:
+    """
+    Atomically write a manifest of captures.
+
+    Args:
+        path (str): The path of the manifest.
+        manifest (dict): The entries of the manifest.
+    """
+    with atomic_writer(Path(path), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def _examine(file_path: str, max_packets: int) -> dict:
+    """
+    Hash a raw capture and count its packets up to max_packets + 1.
+
+    Args:
+        file_path (str): The path of the capture.
+        max_packets (int): The maximum number of packets allowed in a capture file.
+
+    Returns:
+        dict: The manifest entry of the capture.
+    """
+    stat = os.stat(file_path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": file_hash(file_path),
+        "packets": count_records(file_path, max_packets),
+        "limit": max_packets,
+    }
+
+
+def _reuse(entry: dict | None, file_path: str, max_packets: int) -> dict | None:
+    """
+    Reuse the manifest entry of a raw capture if the capture did not change
+    and its recorded packet count decides against max_packets.
+
+    Args:
+        entry (dict | None): The manifest entry of the previous run.
+        file_path (str): The path of the capture.
+        max_packets (int): The maximum number of packets allowed in a capture file.
+
+    Returns:
+        dict | None: The up to date entry, None if the capture has to be examined again.
+    """
+    if entry is None:
+        return None
+    stat = os.stat(file_path)
+    if (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+        if entry["size"] != stat.st_size or file_hash(file_path) != entry["sha256"]:
+            return None
+        entry = {**entry, "mtime_ns": stat.st_mtime_ns}
+    # Counts stop past the limit they were checked against, so they are exact only up to it
+    if entry["packets"] <= entry["limit"] or max_packets <= entry["limit"]:
+        return entry
+    return None
+
+
+def _link(source: str, destination: str) -> None:
+    """
+    Hard-link a file to a destination, replacing it, or copy it if it cannot be linked.
+
+    Args:
+        source (str): The path of the file.
+        destination (str): The path of the link.
+    """
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+    tmp_path = destination + PARTIAL_SUFFIX
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, destination)
+
 
 class Scraper:
-    def __init__(self):
+    def __init__(self, workers: int = DOWNLOAD_WORKERS, timeout: tuple = DOWNLOAD_TIMEOUT, compression: str | None = None):
         """
         Initialize the Scraper object and fetch download URLs.
+
+        Args:
+            workers (int): The number of concurrent downloads.
+            timeout (tuple): The connect and read timeouts in seconds of each request.
+            compression (str | None): The codec the downloaded captures are stored with, one of
+                store.CODECS, None to store them uncompressed.
         """
+        self.workers = workers
+        self.timeout = timeout
+        self.compression = compression
+        self.session = self.__create_session()
         self.download_urls = self.__get_download_urls()
 
+    def __create_session(self) -> requests.Session:
+        """
+        Create an HTTP session whose keep-alive connections are pooled across the downloads.
+
+        Returns:
+            requests.Session: The session, retrying transient server errors.
+        """
+        adapter = HTTPAdapter(
+            pool_connections=self.workers,
+            pool_maxsize=self.workers,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
     def __get_download_urls(self) -> list:
         """
         Fetch download URLs from the Wireshark Sample Captures page.
@@ -29,7 +178,7 @@ class Scraper:
             list: A list of unique download URLs for sample captures.
         """
         logger.debug("Fetching download URLs from Wireshark Sample Captures page")
-        response = requests.get("https://wiki.wireshark.org/SampleCaptures")
+        response = self.session.get("https://wiki.wireshark.org/SampleCaptures", timeout=self.timeout)
 
         pattern = r'href\s*=\s*["\']([^"\']*?\.(?:cap|pcap|pcapng))["\']'
         matches = re.findall(pattern, response.text, re.IGNORECASE)
@@ -50,34 +199,162 @@ class Scraper:
     def download_captures(self) -> None:
         """
         Download sample captures from the URLs fetched by __get_download_urls.
+        The downloads run concurrently, and each .cap file is converted, and each capture compressed
+        if a codec was given, as soon as it is downloaded.
+        Captures recorded in the manifest are only downloaded again if they changed on the server,
+        and interrupted downloads are resumed.
         """
-        logger.debug("Starting download of sample captures")
+        logger.debug(f"Starting download of sample captures with {self.workers} workers")
         download_dir = DATASET_PATH
         os.makedirs(download_dir, exist_ok=True)
+        self.__manifest_path = os.path.join(download_dir, MANIFEST_NAME)
+        self.__manifest = _load_manifest(self.__manifest_path)
+        self.__manifest_lock = threading.Lock()
 
-        for url in self.download_urls:
-            try:
-                response = requests.get(url)
-                filename = url.split("/")[-1]
-                filepath = os.path.join(download_dir, filename)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            downloads = {executor.submit(self.__download, url, download_dir): url for url in self.download_urls}
+            conversions = []
+            for future in as_completed(downloads):
+                url = downloads[future]
+                try:
+                    filepath = future.result()
+                except Exception as e:
+                    logger.error(f"Error downloading {url}: {str(e)}")
+                    continue
+
+                if filepath is not None and (filepath.endswith('.cap') or self.compression):
+                    conversions.append(executor.submit(self.__store, url, filepath))
+
+            for future in conversions:
+                future.result()
+
+        with Catalog() as catalog:
+            catalog.sync(download_dir, "raw")
+
+    def __record(self, url: str, **entry) -> None:
+        """
+        Update the manifest entry of a URL and write the manifest to disk.
+
+        Args:
+            url (str): The URL of the capture.
+            entry: The fields of the entry to update.
+        """
+        with self.__manifest_lock:
+            self.__manifest.setdefault(url, {}).update(entry)
+            _write_manifest(self.__manifest_path, self.__manifest)
+
+    def __is_stored(self, entry: dict, download_dir: str) -> bool:
+        """
+        Check whether the stored file of a manifest entry is complete and unmodified.
 
+        Args:
+            entry (dict): The manifest entry.
+            download_dir (str): The download directory.
+
+        Returns:
+            bool: True if the file matches the size and hash in the entry.
+        """
+        if entry.get("sha256") is None:
+            return False
+        stored_path = os.path.join(download_dir, entry["file"])
+        return (os.path.exists(stored_path)
+                and os.path.getsize(stored_path) == entry["size"]
+                and file_hash(stored_path) == entry["sha256"])
+
+    def __download(self, url: str, download_dir: str):
+        """
+        Stream a capture to disk in chunks, through a partial file renamed once complete and verified.
+        A capture already stored is requested conditionally, and a partial one is resumed with a range request.
+
+        Args:
+            url (str): The URL of the capture.
+            download_dir (str): The directory to download the capture to.
+
+        Returns:
+            str | None: The path of the downloaded capture, None if it did not change since the last download.
+        """
+        filename = url.split("/")[-1]
+        filepath = os.path.join(download_dir, filename)
+        partial_path = filepath + PARTIAL_SUFFIX
+        entry = self.__manifest.get(url, {})
+        # Ranges can only be resumed against a strong validator
+        etag = entry.get("etag")
+        validator = etag if etag and not etag.startswith("W/") else entry.get("last_modified")
+
+        # The sizes and hashes are those of the file as served, not of a compressed transfer
+        headers = {"Accept-Encoding": "identity"}
+        offset = 0
+        if self.__is_stored(entry, download_dir):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        elif os.path.exists(partial_path) and validator:
+            offset = os.path.getsize(partial_path)
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+
+        with self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as response:
+            if response.status_code == 304:
+                logger.info(f"Skipping {filename}, unchanged since the last download")
+                return None
+            if response.status_code == 416:
+                logger.warning(f"Cannot resume {filename}, downloading it again")
+                os.remove(partial_path)
+                return self.__download(url, download_dir)
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                logger.info(f"Resuming {filename} from {url} at byte {offset}")
+                mode = "ab"
+                expected_size = response.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+            else:
                 logger.info(f"Downloading {filename} from {url}")
-                with open(filepath, "wb") as f:
-                    f.write(response.content)
+                mode = "wb"
+                expected_size = response.headers.get("Content-Length", "")
+                self.__record(url, file=filename, etag=response.headers.get("ETag"),
+                              last_modified=response.headers.get("Last-Modified"), size=None, sha256=None)
 
-                if filename.endswith('.cap'):
-                    self.__convert_cap_to_pcap(filepath)
+            with open(partial_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
 
-            except Exception as e:
-                logger.error(f"Error downloading {url}: {str(e)}")
+        size = os.path.getsize(partial_path)
+        if expected_size.isdigit() and size != int(expected_size):
+            os.remove(partial_path)
+            raise IOError(f"Downloaded {size} bytes of {filename}, expected {expected_size}")
 
+        os.replace(partial_path, filepath)
+        self.__record(url, file=filename, size=size, sha256=file_hash(filepath))
+        return filepath
 
-    def __convert_cap_to_pcap(self, file_path: str) -> None:
+    def __store(self, url: str, file_path: str) -> None:
+        """
+        Convert a downloaded .cap file, compress the capture if a codec was given,
+        and record the stored file in the manifest.
+
+        Args:
+            url (str): The URL of the capture.
+            file_path (str): The path to the downloaded capture.
+        """
+        if file_path.endswith('.cap'):
+            file_path = self.__convert_cap_to_pcap(file_path)
+            if file_path is None:
+                return
+        if self.compression:
+            file_path = compress_capture(file_path, self.compression)
+        self.__record(url, file=os.path.basename(file_path),
+                      size=os.path.getsize(file_path), sha256=file_hash(file_path))
+
+    def __convert_cap_to_pcap(self, file_path: str):
         """
         Convert a .cap file to .pcap format using editcap.
 
         Args:
             file_path (str): The path to the .cap file.
+
+        Returns:
+            str | None: The path to the .pcap file, None if the conversion failed.
         """
         logger.debug(f"Converting {file_path} to .pcap format")
         try:
@@ -92,53 +369,93 @@ class Scraper:
 
             os.remove(file_path)
             logger.info(f"Converted {file_path} to {pcap_file_path} and removed the original .cap file")
+            return pcap_file_path
 
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logger.error(f"Error converting {file_path} to .pcap: {str(e)}")
+            return None
 
-    def clean_raw_data(self, max_packets: int, data_path: str = DATASET_PATH) -> None:
+    def clean_raw_data(self, max_packets: int, data_path: str = DATASET_PATH, workers: int | None = None) -> None:
         """
         Clean the raw data by filtering out files that are not in the correct format.
+        The accepted captures are hard-linked into the cleaned directory, whose manifest records
+        the hash and packet count of each raw capture, so later runs only examine the new or
+        changed captures and prune the ones that are gone or no longer qualify. Captures with
+        the same content as an accepted one are skipped, and the cleaned captures are catalogued.
+        The packets are counted concurrently, by walking the record headers of the captures
+        and stopping as soon as a capture has more than max_packets.
 
         Args:
             max_packets (int): The maximum number of packets allowed in a capture file.
             data_path (str): The path to the raw data directory.
+            workers (int | None): The number of processes examining the captures, the number of CPUs if None.
         """
         logger.debug("Cleaning raw data")
         cleaned_path = CLEANED_PATH
         try:
-            if os.path.exists(cleaned_path) and os.listdir(cleaned_path):
-                logger.info(f"Directory {cleaned_path} already exists and is not empty. Skipping creation.")
-                return
-
-            shutil.rmtree(cleaned_path, ignore_errors=True)
-            os.mkdir(cleaned_path)
-
+            os.makedirs(cleaned_path, exist_ok=True)
         except Exception as e:
             logger.error(f"Error creating cleaned data directory: {str(e)}")
             return
 
-        for file in os.listdir(data_path):
-            file_path = os.path.join(data_path, file)
-            if file.lower().endswith((".cap", ".pcap", ".pcapng")):
-                try:
-                    packets = rdpcap(file_path)
-                    cap_len = len(packets)
-
-                    if cap_len < 1:
-                        logger.warning(f"File {file} has less than 1 packet. Skipping...")
-                        continue
-                    if cap_len > max_packets:
-                        logger.warning(f"File {file} has more than {max_packets} packets. Skipping...")
-                        continue
-
-                    shutil.copy(
-                        file_path,
-                        os.path.join(cleaned_path, file)
-                    )
-                    logger.info(f"File {file} successfully copied ({cap_len} packets)")
-
-                except Exception as e:
-                    logger.error(f"Error processing file {file}: {str(e)}")
-            else:
+        manifest_path = os.path.join(cleaned_path, MANIFEST_NAME)
+        previous = _load_manifest(manifest_path)
+        manifest = {}
+        to_examine = []
+        for file in sorted(os.listdir(data_path)):
+            if file.startswith("."):
+                continue
+            if not file.lower().endswith(CAPTURE_EXTENSIONS):
                 logger.warning(f"File {file} is not a capture file (.cap/.pcap/.pcapng). Skipping...")
+                continue
+            try:
+                entry = _reuse(previous.get(file), os.path.join(data_path, file), max_packets)
+            except Exception as e:
+                logger.error(f"Error processing file {file}: {str(e)}")
+                continue
+            if entry is None:
+                to_examine.append(file)
+            else:
+                manifest[file] = entry
+
+        logger.debug(f"Examining {len(to_examine)} new or changed files, {len(manifest)} unchanged")
+        if to_examine:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_examine, os.path.join(data_path, file), max_packets): file for file in to_examine}
+                for future in as_completed(futures):
+                    file = futures[future]
+                    try:
+                        manifest[file] = future.result()
+                    except Exception as e:
+                        logger.error(f"Error processing file {file}: {str(e)}")
+
+        accepted = {}
+        for file in sorted(manifest):
+            cap_len = manifest[file]["packets"]
+            if cap_len < 1:
+                logger.warning(f"File {file} has less than 1 packet. Skipping...")
+                continue
+            if cap_len > max_packets:
+                logger.warning(f"File {file} has more than {max_packets} packets. Skipping...")
+                continue
+            duplicate = accepted.get(manifest[file]["sha256"])
+            if duplicate is not None:
+                logger.warning(f"File {file} is a duplicate of {duplicate}. Skipping...")
+                continue
+
+            try:
+                _link(os.path.join(data_path, file), os.path.join(cleaned_path, file))
+                accepted[manifest[file]["sha256"]] = file
+                logger.info(f"File {file} successfully linked ({cap_len} packets)")
+            except Exception as e:
+                logger.error(f"Error processing file {file}: {str(e)}")
+
+        kept = set(accepted.values())
+        for file in os.listdir(cleaned_path):
+            if not file.startswith(".") and file.lower().endswith(CAPTURE_EXTENSIONS) and file not in kept:
+                os.remove(os.path.join(cleaned_path, file))
+                logger.info(f"File {file} removed from the cleaned data")
+
+        _write_manifest(manifest_path, manifest)
+        with Catalog() as catalog:
+            catalog.sync(cleaned_path, "cleaned")
@@ -0,0 +1,64 @@
+import os
+import logging
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from netexplainer.logger import configure_logger
+from netexplainer.reader import FIELDS, read_records, shard_boundaries
+from netexplainer.sketch import TraceSketch
+from netexplainer.stats import TraceStats
+from netexplainer.table import PacketTable
+
+configure_logger(name="shard", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("shard")
+
+"""
+Minimum size in bytes of each part of a capture, smaller captures are split
+in fewer parts so the processes are not started for too little work.
+"""
+MIN_SHARD_SIZE = 32 * 1024 * 1024
+
+
+def _records_stats(records, approximate: dict | None) -> TraceStats:
+    if approximate is not None:
+        return TraceSketch.from_records(records, **approximate)
+    return PacketTable.from_records(records).stats()
+
+
+def _shard_stats(file_path: str, shard: tuple, fields, approximate: dict | None) -> TraceStats:
+    return _records_stats(read_records(file_path, fields, shard), approximate)
+
+
+def sharded_stats(file_path: str, workers: int | None = None, fields=FIELDS, min_shard_size: int = MIN_SHARD_SIZE,
+                  approximate: dict | None = None) -> TraceStats:
+    """
+    Compute the statistics of a capture on several cores, splitting it into parts
+    that start at a record and merging the statistics of the parts in order
+
+    The statistics are the same as the ones of a single pass over the capture.
+
+    Args:
+        file_path (str): The path of the capture
+        workers (int | None): The number of processes, the number of CPUs if None
+        fields (Iterable[str]): The fields to decode, see reader.FIELDS
+        min_shard_size (int): The minimum size in bytes of each part
+        approximate (dict | None): The error bounds of the sketches of each part, see sketch.TraceSketch,
+            None for exact statistics
+
+    Returns:
+        TraceStats: The statistics of the capture, a sketch.TraceSketch if approximate
+    """
+    workers = workers or os.cpu_count()
+    shards = max(min(workers, os.path.getsize(file_path) // min_shard_size), 1)
+    boundaries = shard_boundaries(file_path, shards) if shards > 1 else None
+    if not boundaries or len(boundaries) == 1:
+        logger.debug(f'Computing statistics for file {file_path} in a single pass')
+        return _records_stats(read_records(file_path, fields), approximate)
+
+    logger.debug(f'Computing statistics for file {file_path} in {len(boundaries)} parts with {workers} processes')
+    stats = TraceSketch(**approximate) if approximate is not None else TraceStats()
+    with ProcessPoolExecutor(max_workers=min(workers, len(boundaries))) as executor:
+        for part in executor.map(_shard_stats, [file_path] * len(boundaries), boundaries, [fields] * len(boundaries),
+                                 [approximate] * len(boundaries)):
+            stats.merge(part)
+    logger.debug(f'Statistics computed for file {file_path}: {stats.packets} packets')
+    return stats
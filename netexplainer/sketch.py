@@ -0,0 +1,237 @@
+import math
+import heapq
+import hashlib
+import logging
+from decimal import Decimal
+from pathlib import Path
+from netexplainer.logger import configure_logger
+from netexplainer.reader import NS_PER_SECOND
+from netexplainer.stats import TraceStats
+
+configure_logger(name="sketch", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("sketch")
+
+"""
+Default error bounds of the sketches: the relative standard error of the
+distinct count and the fraction of all address occurrences by which the
+count of a top talker may be overestimated.
+"""
+DISTINCT_ERROR = 0.01
+TOP_ERROR = 0.001
+
+
+def _hash64(item: str) -> int:
+    return int.from_bytes(hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """
+    HyperLogLog estimator of the number of distinct items of a stream, in constant memory
+    """
+    def __init__(self, error: float = DISTINCT_ERROR):
+        """
+        Initialize an empty estimator
+
+        Args:
+            error (float): The maximum relative standard error of the estimate
+        """
+        self.precision = min(max(math.ceil(math.log2((1.04 / error) ** 2)), 4), 18)
+        self.registers = bytearray(1 << self.precision)
+
+    @property
+    def error(self) -> float:
+        """
+        Relative standard error of the estimate
+        """
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, item: str) -> None:
+        """
+        Add an item to the estimator
+
+        Args:
+            item (str): The item
+        """
+        h = _hash64(item)
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """
+        Add the items of another estimator with the same precision
+
+        Args:
+            other (HyperLogLog): The other estimator
+        """
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        """
+        Estimate the number of distinct items added
+
+        Returns:
+            int: The estimated number of distinct items
+        """
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class SpaceSaving:
+    """
+    Space-Saving summary of the most frequent items of a stream, in constant memory.
+    The count of a monitored item is never underestimated, and is overestimated by
+    at most its error, which is at most error times the total count.
+    """
+    def __init__(self, error: float = TOP_ERROR):
+        """
+        Initialize an empty summary
+
+        Args:
+            error (float): The maximum overestimation of a count, as a fraction of the total count
+        """
+        self.capacity = math.ceil(1 / error)
+        self.counters = {}
+        self.total = 0
+        self.__heap = []
+
+    def add(self, item: str, count: int = 1) -> None:
+        """
+        Add occurrences of an item to the summary
+
+        Args:
+            item (str): The item
+            count (int): The number of occurrences
+        """
+        self.total += count
+        if item in self.counters:
+            self.counters[item][0] += count
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+            heapq.heappush(self.__heap, (count, item))
+            return
+
+        # The heap is updated lazily: counts only grow, so stale entries are pushed back
+        while True:
+            minimum, evicted = heapq.heappop(self.__heap)
+            current = self.counters[evicted][0]
+            if current == minimum:
+                break
+            heapq.heappush(self.__heap, (current, evicted))
+        del self.counters[evicted]
+        self.counters[item] = [minimum + count, minimum]
+        heapq.heappush(self.__heap, (minimum + count, item))
+
+    def merge(self, other: "SpaceSaving") -> None:
+        """
+        Add the counts of another summary
+
+        Args:
+            other (SpaceSaving): The other summary
+        """
+        for item, (count, error) in other.counters.items():
+            self.add(item, count)
+            self.counters[item][1] += error
+
+    def top(self) -> list:
+        """
+        Get the monitored items with the highest estimated count
+
+        Returns:
+            list: The (item, count, error) of the items tied at the highest count, in order of first appearance
+        """
+        if not self.counters:
+            return []
+        highest = max(count for count, _ in self.counters.values())
+        return [(item, count, error) for item, (count, error) in self.counters.items() if count == highest]
+
+
+class TraceSketch(TraceStats):
+    """
+    Statistics of a network trace in bounded memory: the addresses are only
+    kept in sketches, so their distinct count and top talkers are approximate
+    """
+    def __init__(self, distinct_error: float = DISTINCT_ERROR, top_error: float = TOP_ERROR):
+        """
+        Initialize empty statistics
+
+        Args:
+            distinct_error (float): The maximum relative standard error of the distinct address count
+            top_error (float): The maximum overestimation of the count of a top talker,
+                as a fraction of all address occurrences
+        """
+        super().__init__()
+        self.ip_count = None
+        self.distinct_addresses = HyperLogLog(distinct_error)
+        self.top_addresses = SpaceSaving(top_error)
+
+    @classmethod
+    def from_records(cls, records, **errors) -> "TraceSketch":
+        """
+        Stream records into a sketch
+
+        Args:
+            records (Iterable[tuple]): The (time, length, addresses, protocol) records, see reader.read_records
+            errors: The error bounds of the sketches
+
+        Returns:
+            TraceSketch: The statistics of the records
+        """
+        sketch = cls(**errors)
+        for record in records:
+            sketch.update_record(record)
+        logger.debug(f'Sketched {sketch.packets} packets, about {sketch.distinct_addresses.count()} addresses')
+        return sketch
+
+    def update_record(self, record: tuple) -> None:
+        """
+        Add a record to the statistics
+
+        Args:
+            record (tuple): The (time, length, addresses, protocol) record
+        """
+        time, length, addresses, protocol = record
+        self.packets += 1
+        self.total_size += length
+
+        if self.start_time is None:
+            self.start_time = Decimal(time) / NS_PER_SECOND
+        self.end_time = Decimal(time) / NS_PER_SECOND
+
+        if addresses is not None:
+            for address in addresses:
+                self.distinct_addresses.add(address)
+                self.top_addresses.add(address)
+
+        if protocol is not None:
+            self.protocol_count[protocol] += 1
+
+    def merge(self, other: "TraceSketch") -> None:
+        """
+        Add the statistics of the packets that follow the ones already counted
+
+        Args:
+            other (TraceSketch): The statistics of the following part of the trace, with the same error bounds
+        """
+        if other.packets == 0:
+            return
+        self.packets += other.packets
+        self.total_size += other.total_size
+
+        if self.start_time is None:
+            self.start_time = other.start_time
+        self.end_time = other.end_time
+
+        self.distinct_addresses.merge(other.distinct_addresses)
+        self.top_addresses.merge(other.top_addresses)
+        for protocol, count in other.protocol_count.items():
+            self.protocol_count[protocol] += count
@@ -0,0 +1,138 @@
+from scapy.all import PcapReader
+import logging
+from pathlib import Path
+from netexplainer.logger import configure_logger
+from netexplainer.store import open_capture
+
+configure_logger(name="stats", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("stats")
+
+"""
+Protocols counted by the ground truth, in the order they are checked.
+A packet is only counted for the first protocol it contains.
+"""
+PROTOCOLS = ('ICMP', 'ICMPv6', 'TCP', 'UDP')
+
+
+def packet_addresses(packet) -> tuple | None:
+    """
+    Get the source and destination addresses of a packet
+
+    Args:
+        packet (Packet): The scapy packet to inspect
+
+    Returns:
+        tuple | None: The (src, dst) of the first IP layer, or of the first IPv6 layer
+        if there is no IP one, None if the packet has neither
+    """
+    if packet.haslayer('IP'):
+        layer = packet['IP']
+    elif packet.haslayer('IPv6'):
+        layer = packet['IPv6']
+    else:
+        return None
+    return layer.src, layer.dst
+
+
+def packet_protocol(packet) -> str | None:
+    """
+    Get the protocol a packet is counted for
+
+    Args:
+        packet (Packet): The scapy packet to inspect
+
+    Returns:
+        str | None: The first protocol of PROTOCOLS the packet contains, None if it has none
+    """
+    for protocol in PROTOCOLS:
+        if packet.haslayer(protocol):
+            return protocol
+    return None
+
+
+class TraceStats:
+    """
+    Aggregated statistics of a network trace, computed in a single pass
+    """
+    def __init__(self):
+        """
+        Initialize empty statistics
+        """
+        self.packets = 0
+        self.total_size = 0
+        self.start_time = None
+        self.end_time = None
+        self.ip_count = {}
+        self.protocol_count = {protocol: 0 for protocol in PROTOCOLS}
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "TraceStats":
+        """
+        Stream the capture packet by packet and aggregate its statistics
+
+        Args:
+            file_path (str): The path of the capture to read
+
+        Returns:
+            TraceStats: The statistics of the capture
+        """
+        logger.debug(f'Computing statistics for file {file_path}')
+        stats = cls()
+        with open_capture(file_path) as stream, PcapReader(stream) as reader:
+            for packet in reader:
+                stats.update(packet)
+        logger.debug(f'Statistics computed for file {file_path}: {stats.packets} packets')
+        return stats
+
+    def update(self, packet) -> None:
+        """
+        Add a packet to the statistics
+
+        Args:
+            packet (Packet): The scapy packet to add
+        """
+        self.packets += 1
+        self.total_size += len(packet)
+
+        if self.start_time is None:
+            self.start_time = packet.time
+        self.end_time = packet.time
+
+        addresses = packet_addresses(packet)
+        if addresses is not None:
+            for address in addresses:
+                self.ip_count[address] = self.ip_count.get(address, 0) + 1
+
+        protocol = packet_protocol(packet)
+        if protocol is not None:
+            self.protocol_count[protocol] += 1
+
+    def merge(self, other: "TraceStats") -> None:
+        """
+        Add the statistics of the packets that follow the ones already counted
+
+        Args:
+            other (TraceStats): The statistics of the following part of the trace
+        """
+        if other.packets == 0:
+            return
+        self.packets += other.packets
+        self.total_size += other.total_size
+
+        if self.start_time is None:
+            self.start_time = other.start_time
+        self.end_time = other.end_time
+
+        for address, count in other.ip_count.items():
+            self.ip_count[address] = self.ip_count.get(address, 0) + count
+        for protocol, count in other.protocol_count.items():
+            self.protocol_count[protocol] += count
+
+    @property
+    def duration(self):
+        """
+        Time elapsed between the first and the last packet, 0 if it cannot be computed
+        """
+        if self.packets == 0 or self.end_time <= self.start_time:
+            return 0
+        return self.end_time - self.start_time
@@ -0,0 +1,163 @@
+import os
+import gzip
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from netexplainer.cache import atomic_writer
+from netexplainer.logger import configure_logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+configure_logger(name="store", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("store")
+
+"""
+Magic numbers of the compressed captures, and the suffix appended to the name
+of a capture compressed with each codec.
+"""
+MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+CODECS = tuple(SUFFIXES)
+
+"""
+Compression levels of each codec: captures are written once and read many times,
+so the levels favour the ratio while keeping the decompression fast.
+"""
+LEVELS = {"gzip": 6, "zstd": 10}
+
+"""
+Size of the chunks in which captures are compressed and decompressed.
+"""
+CHUNK_SIZE = 1 << 20
+
+
+def _require_zstandard() -> None:
+    if zstandard is None:
+        raise ImportError("zstd compressed captures need the zstandard package")
+
+
+def compression(file_path: str) -> str | None:
+    """
+    Identify the codec of a compressed capture from its magic number
+
+    Args:
+        file_path (str): The path of the capture
+
+    Returns:
+        str | None: The codec, one of CODECS, None if the capture is not compressed
+    """
+    with open(file_path, 'rb') as f:
+        magic = f.read(4)
+    return next((codec for prefix, codec in MAGIC.items() if magic.startswith(prefix)), None)
+
+
+def open_capture(file_path: str):
+    """
+    Open a capture for reading, decompressing it on the fly if it is compressed
+
+    Args:
+        file_path (str): The path of the capture
+
+    Returns:
+        file: The binary stream of the uncompressed capture
+    """
+    codec = compression(file_path)
+    if codec == "gzip":
+        return gzip.open(file_path, 'rb')
+    if codec == "zstd":
+        _require_zstandard()
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), read_across_frames=True, closefd=True)
+    return open(file_path, 'rb')
+
+
+def strip_compression(file_path: str) -> str:
+    """
+    Remove the compression suffix from the name of a capture
+
+    Args:
+        file_path (str): The path of the capture
+
+    Returns:
+        str: The path without the suffix of any codec
+    """
+    for suffix in SUFFIXES.values():
+        if file_path.endswith(suffix):
+            return file_path[:-len(suffix)]
+    return file_path
+
+
+def compress_capture(file_path: str, codec: str = "zstd") -> str:
+    """
+    Compress a capture in place, streaming it through the codec, and remove the uncompressed file
+
+    Args:
+        file_path (str): The path of the uncompressed capture
+        codec (str): The codec, one of CODECS
+
+    Returns:
+        str: The path of the compressed capture
+    """
+    if compression(file_path) is not None:
+        return file_path
+    compressed_path = file_path + SUFFIXES[codec]
+
+    with open(file_path, 'rb') as source, atomic_writer(Path(compressed_path), 'wb') as f:
+        if codec == "gzip":
+            with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=LEVELS[codec]) as compressed:
+                shutil.copyfileobj(source, compressed, CHUNK_SIZE)
+        else:
+            _require_zstandard()
+            compressor = zstandard.ZstdCompressor(level=LEVELS[codec])
+            compressor.copy_stream(source, f, size=os.path.getsize(file_path), read_size=CHUNK_SIZE, write_size=CHUNK_SIZE)
+
+    os.remove(file_path)
+    logger.debug(f"Compressed {file_path} with {codec} to {compressed_path}")
+    return compressed_path
+
+
+@contextmanager
+def capture_source(file_path: str):
+    """
+    Prepare a capture to be read by an external tool such as tshark. Compressed captures,
+    named with the suffix of their codec, are decompressed by a thread into a pipe that
+    the tool reads as its standard input.
+
+    Args:
+        file_path (str): The path of the capture
+
+    Yields:
+        tuple: The file argument and the standard input of the tool: the path and None
+        for uncompressed captures, "-" and the read end of the pipe for compressed ones
+    """
+    if strip_compression(file_path) == file_path:
+        yield file_path, None
+        return
+
+    read_fd, write_fd = os.pipe()
+
+    def feed():
+        try:
+            with os.fdopen(write_fd, 'wb') as pipe, open_capture(file_path) as stream:
+                shutil.copyfileobj(stream, pipe, CHUNK_SIZE)
+        except BrokenPipeError:
+            # The tool stopped reading before the end of the capture
+            pass
+        except Exception as e:
+            logger.error(f"Error decompressing file {file_path}: {e}")
+
+    thread = threading.Thread(target=feed, daemon=True)
+    thread.start()
+    stdin = os.fdopen(read_fd, 'rb')
+    try:
+        yield "-", stdin
+    finally:
+        stdin.close()
+        thread.join()
@@ -0,0 +1,164 @@
+import math
+import logging
+from pathlib import Path
+from scapy.all import PcapReader
+from netexplainer.logger import configure_logger
+from netexplainer.store import open_capture
+from netexplainer.stats import packet_addresses, packet_protocol
+
+configure_logger(name="summary", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("summary")
+
+"""
+Layers left out of the protocol hierarchy, they are payloads rather than protocols.
+"""
+IGNORED_LAYERS = ("Raw", "Padding")
+
+"""
+Number of intervals of the I/O time series.
+"""
+IO_BINS = 10
+
+
+class TraceSummary:
+    """
+    Compact summaries of a network trace, computed in a single pass: the conversations,
+    the protocol hierarchy, the endpoints and a coarse I/O time series
+    """
+    def __init__(self):
+        """
+        Initialize empty summaries
+        """
+        self.packets = 0
+        self.total_size = 0
+        self.start_time = None
+        self.end_time = None
+        self.conversations = {}
+        self.hierarchy = {}
+        self.endpoints = {}
+        self.io_series = {}
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "TraceSummary":
+        """
+        Stream the capture packet by packet and summarize it
+
+        Args:
+            file_path (str): The path of the capture to read
+
+        Returns:
+            TraceSummary: The summaries of the capture
+        """
+        logger.debug(f'Computing summaries for file {file_path}')
+        summary = cls()
+        with open_capture(file_path) as stream, PcapReader(stream) as reader:
+            for packet in reader:
+                summary.update(packet)
+        logger.debug(f'Summaries computed for file {file_path}: {len(summary.conversations)} conversations, {len(summary.endpoints)} endpoints')
+        return summary
+
+    def update(self, packet) -> None:
+        """
+        Add a packet to the summaries
+
+        Args:
+            packet (Packet): The scapy packet to add
+        """
+        length = len(packet)
+        self.packets += 1
+        self.total_size += length
+
+        if self.start_time is None:
+            self.start_time = packet.time
+        self.end_time = packet.time
+
+        second = max(int(packet.time - self.start_time), 0)
+        counts = self.io_series.setdefault(second, [0, 0])
+        counts[0] += 1
+        counts[1] += length
+
+        layers = tuple(layer.__name__ for layer in packet.layers() if layer.__name__ not in IGNORED_LAYERS)
+        for depth in range(1, len(layers) + 1):
+            counts = self.hierarchy.setdefault(layers[:depth], [0, 0])
+            counts[0] += 1
+            counts[1] += length
+
+        addresses = packet_addresses(packet)
+        if addresses is None:
+            return
+        src, dst = addresses
+
+        for address, direction in ((src, 0), (dst, 2)):
+            counts = self.endpoints.setdefault(address, [0, 0, 0, 0])
+            counts[direction] += 1
+            counts[direction + 1] += length
+
+        protocol = packet_protocol(packet)
+        sport = dport = None
+        if protocol in ("TCP", "UDP"):
+            sport, dport = packet[protocol].sport, packet[protocol].dport
+        # Conversations are bidirectional, keyed by their endpoints in a fixed order
+        a, b = sorted([(src, sport), (dst, dport)], key=str)
+        counts = self.conversations.setdefault((protocol or "Other", *a, *b), [0, 0])
+        counts[0] += 1
+        counts[1] += length
+
+    @property
+    def duration(self):
+        """
+        Time elapsed between the first and the last packet, 0 if it cannot be computed
+        """
+        if self.packets == 0 or self.end_time <= self.start_time:
+            return 0
+        return self.end_time - self.start_time
+
+    def to_text(self, top: int = 10) -> str:
+        """
+        Render the summaries as text for a prompt
+
+        Args:
+            top (int): Maximum number of conversations and endpoints listed, the busiest ones
+
+        Returns:
+            str: The summaries
+        """
+        lines = [f"Packets: {self.packets}, Bytes: {self.total_size}, Duration: {float(self.duration):.6f} s", ""]
+
+        lines.append(f"Conversations ({len(self.conversations)}):")
+        lines.append("Protocol|Address A|Port A|Address B|Port B|Packets|Bytes")
+        conversations = sorted(self.conversations.items(), key=lambda item: item[1][1], reverse=True)
+        for (protocol, a, port_a, b, port_b), (packets, size) in conversations[:top]:
+            lines.append(" | ".join(str(field) for field in (protocol, a, "-" if port_a is None else port_a, b, "-" if port_b is None else port_b, packets, size)))
+        if len(conversations) > top:
+            lines.append(f"... {len(conversations) - top} more conversations")
+        lines.append("")
+
+        lines.append("Protocol hierarchy:")
+        lines.append("Protocol|Packets|Bytes")
+        for layers, (packets, size) in sorted(self.hierarchy.items()):
+            lines.append(f"{'  ' * (len(layers) - 1)}{layers[-1]} | {packets} | {size}")
+        lines.append("")
+
+        lines.append(f"Endpoints ({len(self.endpoints)}):")
+        lines.append("Address|Packets sent|Bytes sent|Packets received|Bytes received")
+        endpoints = sorted(self.endpoints.items(), key=lambda item: item[1][1] + item[1][3], reverse=True)
+        for address, counts in endpoints[:top]:
+            lines.append(" | ".join(str(field) for field in (address, *counts)))
+        if len(endpoints) > top:
+            lines.append(f"... {len(endpoints) - top} more endpoints")
+        lines.append("")
+
+        lines.append("I/O over time:")
+        lines.append("Interval (s)|Packets|Bytes")
+        if self.io_series:
+            width = math.ceil((max(self.io_series) + 1) / IO_BINS)
+            bins = {}
+            for second, (packets, size) in self.io_series.items():
+                counts = bins.setdefault(second // width, [0, 0])
+                counts[0] += packets
+                counts[1] += size
+            for index in range(max(bins) + 1):
+                packets, size = bins.get(index, (0, 0))
+                lines.append(f"{index * width}-{(index + 1) * width} | {packets} | {size}")
+
+        return "\n".join(lines) + "\n"
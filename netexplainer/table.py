@@ -0,0 +1,132 @@
+from array import array
+from decimal import Decimal
+import logging
+from pathlib import Path
+import numpy as np
+from netexplainer.logger import configure_logger
+from netexplainer.reader import FIELDS, NS_PER_SECOND, read_records, packet_records
+from netexplainer.stats import TraceStats, PROTOCOLS
+
+configure_logger(name="table", filepath=Path(__file__).parent / "data/evaluation/netexplainer.log")
+logger = logging.getLogger("table")
+
+"""
+Address id used for packets without an IP or IPv6 layer.
+"""
+NO_ADDRESS = -1
+
+
+class PacketTable:
+    """
+    Columnar representation of a capture: one NumPy array per packet field
+    """
+    def __init__(self, time: np.ndarray, length: np.ndarray, src: np.ndarray, dst: np.ndarray, protocol: np.ndarray, addresses: list):
+        """
+        Initialize the table with the columns provided
+
+        Args:
+            time (np.ndarray): Timestamps of the packets in nanoseconds (int64)
+            length (np.ndarray): Frame lengths in bytes (int64)
+            src (np.ndarray): Interned source address ids, NO_ADDRESS if there is none (int32)
+            dst (np.ndarray): Interned destination address ids, NO_ADDRESS if there is none (int32)
+            protocol (np.ndarray): Protocol codes, 0 for none or 1 + index in PROTOCOLS (int8)
+            addresses (list): Addresses indexed by their id, in order of first appearance
+        """
+        self.time = time
+        self.length = length
+        self.src = src
+        self.dst = dst
+        self.protocol = protocol
+        self.addresses = addresses
+
+    def __len__(self) -> int:
+        return len(self.length)
+
+    @classmethod
+    def from_file(cls, file_path: str, fields=FIELDS) -> "PacketTable":
+        """
+        Decode the capture once into a packet table
+
+        Args:
+            file_path (str): The path of the capture to read
+            fields (Iterable[str]): The fields to decode, see reader.FIELDS
+
+        Returns:
+            PacketTable: The table with one row per packet
+        """
+        logger.debug(f'Building packet table for file {file_path}')
+        table = cls.from_records(read_records(file_path, fields))
+        logger.debug(f'Packet table built for file {file_path}: {len(table)} packets, {len(table.addresses)} addresses')
+        return table
+
+    @classmethod
+    def from_packets(cls, packets) -> "PacketTable":
+        """
+        Build a packet table from an iterable of scapy packets
+
+        Args:
+            packets (Iterable[Packet]): The packets to decode
+
+        Returns:
+            PacketTable: The table with one row per packet
+        """
+        return cls.from_records(packet_records(packets))
+
+    @classmethod
+    def from_records(cls, records) -> "PacketTable":
+        """
+        Build a packet table from an iterable of records
+
+        Args:
+            records (Iterable[tuple]): The (time, length, addresses, protocol) records, see reader.read_records
+
+        Returns:
+            PacketTable: The table with one row per record
+        """
+        time, length = array('q'), array('q')
+        src, dst = array('i'), array('i')
+        protocol = array('b')
+        address_ids = {}
+
+        for record_time, record_length, addresses, record_protocol in records:
+            time.append(record_time)
+            length.append(record_length)
+            if addresses is None:
+                src.append(NO_ADDRESS)
+                dst.append(NO_ADDRESS)
+            else:
+                src.append(address_ids.setdefault(addresses[0], len(address_ids)))
+                dst.append(address_ids.setdefault(addresses[1], len(address_ids)))
+            protocol.append(0 if record_protocol is None else PROTOCOLS.index(record_protocol) + 1)
+
+        return cls(
+            np.frombuffer(time, dtype=np.int64),
+            np.frombuffer(length, dtype=np.int64),
+            np.frombuffer(src, dtype=np.int32),
+            np.frombuffer(dst, dtype=np.int32),
+            np.frombuffer(protocol, dtype=np.int8),
+            list(address_ids),
+        )
+
+    def stats(self) -> TraceStats:
+        """
+        Aggregate the table into trace statistics using vectorized reductions
+
+        Returns:
+            TraceStats: The statistics of the capture
+        """
+        stats = TraceStats()
+        stats.packets = len(self)
+        stats.total_size = int(self.length.sum())
+
+        if stats.packets > 0:
+            stats.start_time = Decimal(int(self.time[0])) / NS_PER_SECOND
+            stats.end_time = Decimal(int(self.time[-1])) / NS_PER_SECOND
+
+        ids = np.concatenate((self.src, self.dst))
+        counts = np.bincount(ids[ids != NO_ADDRESS], minlength=len(self.addresses))
+        stats.ip_count = dict(zip(self.addresses, counts.tolist()))
+
+        protocol_counts = np.bincount(self.protocol, minlength=len(PROTOCOLS) + 1).tolist()
+        stats.protocol_count = dict(zip(PROTOCOLS, protocol_counts[1:]))
+        return stats
@@ -24,3 +24,32 @@ def configure_logger():
         logger.propagate = False
 
         yield
+
+
+@pytest.fixture
+def sample_packets():
+    from scapy.all import Ether, IP, IPv6, TCP, UDP, ICMP, ARP, ICMPv6EchoRequest
+
+    # Explicit MAC addresses so scapy does not try to resolve them on the network
+    ether = Ether(src="00:00:00:00:00:01", dst="00:00:00:00:00:02")
+    packets = [
+        ether / IP(src="10.0.0.1", dst="10.0.0.2") / TCP(),
+        ether / IP(src="10.0.0.2", dst="10.0.0.1") / TCP() / b"payload",
+        ether / IP(src="10.0.0.1", dst="10.0.0.3") / UDP(),
+        ether / IP(src="10.0.0.3", dst="10.0.0.1") / ICMP(),
+        ether / IPv6(src="fe80::1", dst="fe80::2") / UDP(),
+        ether / IPv6(src="fe80::2", dst="fe80::1") / ICMPv6EchoRequest(),
+        ether / ARP(),
+    ]
+    for i, packet in enumerate(packets):
+        packet.time = 1700000000 + i * 0.25
+    return packets
+
+
+@pytest.fixture
+def sample_pcap(tmp_path, sample_packets):
+    from scapy.all import wrpcap
+
+    path = tmp_path / "sample.pcap"
+    wrpcap(str(path), sample_packets)
+    return str(path)
@@ -0,0 +1,49 @@
+from decimal import Decimal
+from unittest.mock import patch
+import pytest
+from netexplainer.analytics import ANALYTICS, analytic, answer_questions, required_fields
+
+TIMING_AND_SIZE = [
+    "What is the total size of transmitted bytes?",
+    "How long in seconds does the communication last?",
+    "What is the average bytes/s sent in the communication?",
+]
+
+
+def test_answer_questions(sample_pcap, sample_packets):
+    """Test every registered question over a capture"""
+    answers = answer_questions(sample_pcap, list(ANALYTICS) + ["Unknown question"])
+    total_size = sum(len(packet) for packet in sample_packets)
+
+    assert answers == {
+        "What is the total number of packets in the trace?": 7,
+        "How many unique communicators are present in the trace?": 5,
+        "What is the IP that participates the most in communications in the trace?": "10.0.0.1",
+        "What is the total size of transmitted bytes?": total_size,
+        "What is the average size of packets in bytes?": total_size / 7,
+        "What predominates in the capture: ICMP, TCP, or UDP?": "TCP",
+        "How long in seconds does the communication last?": Decimal("1.5"),
+        "What is the average number of packets sent per second?": 7 / Decimal("1.5"),
+        "What is the average bytes/s sent in the communication?": total_size / Decimal("1.5"),
+    }
+
+
+def test_required_fields():
+    """Test the fields of a set of questions are merged"""
+    assert required_fields(TIMING_AND_SIZE) == {"time", "length"}
+    assert required_fields(["What is the total number of packets in the trace?"]) == set()
+
+
+def test_timing_questions_skip_headers(sample_pcap):
+    """Test timing and size questions never decode the IP layer"""
+    with patch("netexplainer.reader._decode", side_effect=AssertionError("headers decoded")), \
+         patch("netexplainer.reader._dissect", side_effect=AssertionError("headers dissected")):
+        answers = answer_questions(sample_pcap, TIMING_AND_SIZE)
+
+    assert answers["How long in seconds does the communication last?"] == Decimal("1.5")
+
+
+def test_unknown_field():
+    """Test analytics cannot declare fields the reader does not provide"""
+    with pytest.raises(ValueError):
+        analytic("Question", fields=("ttl",))
@@ -0,0 +1,122 @@
+import os
+import stat
+from decimal import Decimal
+import pytest
+from unittest.mock import patch
+from netexplainer.cache import AnswerCache, RenderCache, ResponseCache, atomic_writer, file_hash
+
+QUESTIONS = ["What is the total number of packets in the trace?", "How long in seconds does the communication last?"]
+ANSWERS = {QUESTIONS[0]: 7, QUESTIONS[1]: Decimal("1.500000")}
+
+
+def test_put_get(tmp_path):
+    """Test answers are loaded back with the same values and types"""
+    cache = AnswerCache(tmp_path)
+    cache.put("abc", QUESTIONS, ANSWERS)
+
+    answers = cache.get("abc", QUESTIONS)
+    assert answers == ANSWERS
+    assert str(answers[QUESTIONS[1]]) == "1.500000"
+    assert cache.get("other", QUESTIONS) is None
+
+
+def test_stale_questions(tmp_path):
+    """Test entries are invalidated when the questions change"""
+    cache = AnswerCache(tmp_path)
+    cache.put("abc", QUESTIONS, ANSWERS)
+
+    assert cache.get("abc", QUESTIONS[:1]) is None
+
+
+def test_stale_code(tmp_path):
+    """Test entries are invalidated when the analysis code changes"""
+    cache = AnswerCache(tmp_path)
+    cache.put("abc", QUESTIONS, ANSWERS)
+
+    with patch("netexplainer.cache.analysis_version", return_value="new"):
+        assert cache.get("abc", QUESTIONS) is None
+
+
+def test_corrupted_entry(tmp_path):
+    """Test unreadable entries are ignored"""
+    (tmp_path / "abc.json").write_text("{not json")
+
+    assert AnswerCache(tmp_path).get("abc", QUESTIONS) is None
+
+
+def test_file_hash(tmp_path):
+    """Test captures are keyed by their content"""
+    (tmp_path / "a.pcap").write_bytes(b"same")
+    (tmp_path / "b.pcap").write_bytes(b"same")
+    (tmp_path / "c.pcap").write_bytes(b"different")
+
+    assert file_hash(str(tmp_path / "a.pcap")) == file_hash(str(tmp_path / "b.pcap"))
+    assert file_hash(str(tmp_path / "a.pcap")) != file_hash(str(tmp_path / "c.pcap"))
+
+
+def test_atomic_writer_mode(tmp_path):
+    """Test files written atomically get the mode of files written with open"""
+    with open(tmp_path / "plain.txt", "w") as f:
+        f.write("content")
+    with atomic_writer(tmp_path / "atomic.txt") as f:
+        f.write("content")
+
+    assert stat.S_IMODE(os.stat(tmp_path / "atomic.txt").st_mode) == stat.S_IMODE(os.stat(tmp_path / "plain.txt").st_mode)
+    assert (tmp_path / "atomic.txt").read_text() == "content"
+
+
+@patch("netexplainer.cache.tshark_version", return_value="TShark 4.0")
+def test_render_cache(mock_version, tmp_path):
+    """Test rendered traces are published atomically and keyed by variant and tshark version"""
+    cache = RenderCache(tmp_path)
+    assert cache.get("abc", "big") is None
+
+    with pytest.raises(RuntimeError):
+        with cache.writer("abc", "big") as f:
+            f.write("partial")
+            raise RuntimeError("tshark failed")
+    assert cache.get("abc", "big") is None
+    assert list(tmp_path.iterdir()) == []
+
+    with cache.writer("abc", "big") as f:
+        f.write("rendered")
+    assert cache.get("abc", "big").read_text() == "rendered"
+    assert cache.get("abc", "small") is None
+
+    mock_version.return_value = "TShark 4.2"
+    assert cache.get("abc", "big") is None
+
+
+def test_response_cache(tmp_path):
+    """Test responses are keyed by the whole request and the least recently used are evicted"""
+    cache = ResponseCache(tmp_path / "responses.sqlite", max_size=10)
+    first = ResponseCache.key({"model": "m", "messages": ["a"]})
+    second = ResponseCache.key({"messages": ["b"], "model": "m"})
+    assert first == ResponseCache.key({"messages": ["a"], "model": "m"})
+    assert first != second
+
+    cache.put(first, "12345")
+    cache.put(second, "12345")
+    assert cache.get(first) == "12345"
+    cache.put(ResponseCache.key({}), "123")
+
+    assert cache.get(first) == "12345"
+    assert cache.get(second) is None
+    assert cache.size() == 8
+    cache.close()
+
+
+def test_response_cache_size(tmp_path):
+    """Test the running size of the responses follows replacements, evictions and reopening"""
+    path = tmp_path / "responses.sqlite"
+    cache = ResponseCache(path, max_size=30)
+    for i in range(30):
+        cache.put(ResponseCache.key({"i": i % 20}), "x" * (i % 7))
+
+    total = cache.connection.execute("SELECT SUM(size) FROM responses").fetchone()[0]
+    assert cache.size() == total <= 30
+    cache.close()
+
+    reopened = ResponseCache(path, max_size=30)
+    assert reopened.size() == total
+    reopened.close()
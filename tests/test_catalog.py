@@ -0,0 +1,66 @@
+import os
+import shutil
+import pytest
+from scapy.all import Ether, IP, TCP, UDP, wrpcap
+from netexplainer.catalog import Catalog, examine
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    with Catalog(tmp_path / "catalog.sqlite") as catalog:
+        yield catalog
+
+
+def write_capture(path, tcp: int, udp: int) -> None:
+    ether = Ether(src="00:00:00:00:00:01", dst="00:00:00:00:00:02")
+    packets = [ether / IP(src="10.0.0.1", dst="10.0.0.2") / TCP() for _ in range(tcp)]
+    packets += [ether / IP(src="10.0.0.1", dst="10.0.0.3") / UDP() for _ in range(udp)]
+    for i, packet in enumerate(packets):
+        packet.time = 1700000000 + i * 0.5
+    wrpcap(str(path), packets)
+
+
+def test_examine(sample_pcap, sample_packets):
+    """Test the facts learnt from a capture"""
+    facts = examine(sample_pcap)
+    assert facts["format"] == "pcap"
+    assert facts["linktype"] == 1
+    assert facts["packets"] == len(sample_packets)
+    assert facts["tcp"] == 2
+    assert facts["udp"] == 2
+
+
+def test_sync_and_select(tmp_path, catalog):
+    """Test selecting captures by their facts, with duplicates collapsed"""
+    directory = tmp_path / "cleaned"
+    directory.mkdir()
+    write_capture(directory / "tcp.pcap", tcp=8, udp=2)
+    write_capture(directory / "udp.pcap", tcp=1, udp=9)
+    shutil.copy(directory / "tcp.pcap", directory / "tcp-copy.pcap")
+    (directory / "tcp.txt").write_text("processed")
+
+    catalog.sync(str(directory), "cleaned")
+
+    assert catalog.select("cleaned") == [str(directory / "tcp-copy.pcap"), str(directory / "udp.pcap")]
+    assert len(catalog.select("cleaned", unique=False)) == 3
+    assert catalog.select("cleaned", "tcp > packets / 2 AND packets < ?", (500,)) == [str(directory / "tcp-copy.pcap")]
+    assert catalog.select("raw") == []
+    assert catalog.get(str(directory / "udp.pcap"))["duration"] == 4.5
+
+
+def test_sync_updates(tmp_path, catalog):
+    """Test only new or modified captures are read, and removed ones are dropped"""
+    directory = tmp_path / "raw"
+    directory.mkdir()
+    write_capture(directory / "a.pcap", tcp=1, udp=0)
+    write_capture(directory / "b.pcap", tcp=2, udp=0)
+    catalog.sync(str(directory), "raw")
+
+    os.remove(directory / "b.pcap")
+    write_capture(directory / "a.pcap", tcp=3, udp=0)
+    write_capture(directory / "c.pcap", tcp=3, udp=0)
+    os.utime(directory / "a.pcap", ns=(1, 1))
+    catalog.sync(str(directory), "raw")
+
+    assert catalog.select("raw", unique=False) == [str(directory / "a.pcap"), str(directory / "c.pcap")]
+    assert catalog.get(str(directory / "a.pcap"))["packets"] == 3
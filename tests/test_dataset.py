@@ -1,16 +1,45 @@
 import unittest
+import io
 import os
-from unittest.mock import patch, mock_open, MagicMock
-from netexplainer.dataset import Dataset
+import sys
+import shutil
+import tempfile
+from unittest.mock import patch, mock_open
+from netexplainer.dataset import Dataset, prepare_datasets
+from netexplainer.cache import RenderCache
+from netexplainer.store import CODECS, compress_capture, zstandard
+
+QUESTIONS_PATH = os.path.join(os.path.dirname(__file__), "..", "netexplainer", "data", "questions.yaml")
+
+"""
+Stand-in of tshark -T tabs for the tests, reading the capture with scapy from
+its path or, with -r -, from its standard input like tshark does.
+"""
+FAKE_TSHARK = f"""#!{sys.executable}
+import sys
+from scapy.all import IP, PcapReader
+source = sys.argv[sys.argv.index("-r") + 1]
+stream = sys.stdin.buffer if source == "-" else open(source, "rb")
+for number, packet in enumerate(PcapReader(stream), start=1):
+    print(f"{{number}}\\t{{float(packet.time):.6f}}\\t{{packet[IP].src}}\\t{{packet[IP].dst}}\\tTCP\\t{{len(packet)}}\\tinfo")
+"""
+
+def tshark_pipe(mock_popen, lines, returncode=0):
+    process = mock_popen.return_value.__enter__.return_value
+    process.stdout = iter(lines)
+    process.returncode = returncode
+    return process
 
 class TestDataset(unittest.TestCase):
-    @patch("netexplainer.dataset.check_output")
+    @patch("netexplainer.dataset.Popen")
     @patch("os.path.exists", return_value=True)
     @patch("os.path.isfile", return_value=True)
-    @patch("netexplainer.dataset.rdpcap")
-    def setUp(self, mock_rdpcap, mock_isfile, mock_exists, mock_check_output):
-        mock_check_output.return_value = b"1\t0.0\tSrc\tDst\tHTTP\t100\tMocked Data"
-        mock_rdpcap.return_value = MagicMock()
+    @patch("netexplainer.dataset.answer_questions")
+    def setUp(self, mock_answer, mock_isfile, mock_exists, mock_popen):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.capture = os.path.join(self.tmpdir, "dummy.pcap")
+        tshark_pipe(mock_popen, ["1\t0.0\tSrc\tDst\tHTTP\t100\tMocked Data\n"])
 
         self.mock_questions_content = """
         questions:
@@ -18,42 +47,220 @@ class TestDataset(unittest.TestCase):
             subquestions: ["Sub1", "Sub2"]
         """
         with patch("builtins.open", mock_open(read_data=self.mock_questions_content)):
-            self.dataset = Dataset("dummy.pcap", "dummy_questions.yaml", "big")
+            self.dataset = Dataset(self.capture, "dummy_questions.yaml", "big", use_cache=False)
 
-    @patch("netexplainer.dataset.check_output", return_value=b"Mocked Data")
+    @patch("netexplainer.dataset.Popen")
     @patch("os.path.exists", return_value=True)
     @patch("os.path.isfile", return_value=True)
-    @patch("netexplainer.dataset.rdpcap")
-    def test_init(self, mock_rdpcap, mock_isfile, mock_exists, mock_check_output):
-        mock_rdpcap.return_value = MagicMock()
+    @patch("netexplainer.dataset.answer_questions")
+    def test_init(self, mock_answer, mock_isfile, mock_exists, mock_popen):
+        tshark_pipe(mock_popen, ["Mocked Data\n"])
         with patch("builtins.open", mock_open(read_data=self.mock_questions_content)):
-            dataset = Dataset("dummy.pcap", "dummy_questions.yaml", "big")
-            self.assertEqual(dataset._Dataset__path, os.path.abspath("dummy.pcap"))
+            dataset = Dataset(self.capture, "dummy_questions.yaml", "big", use_cache=False)
+            self.assertEqual(dataset._Dataset__path, self.capture)
+
+    @patch("netexplainer.dataset.Popen")
+    def test_process_file(self, mock_popen):
+        tshark_pipe(mock_popen, ["Mocked Data\n"])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            processed_path = self.dataset._Dataset__process_file(os.path.join(tmpdir, "dummy.pcap"), "big")
+            self.assertEqual(processed_path, os.path.join(tmpdir, "dummy.big.txt"))
+            with open(processed_path) as f:
+                self.assertEqual(f.read(), "No.|Time|Source|Destination|Protocol|Length|Info\nMocked Data\n")
+
+    @patch("netexplainer.dataset.Popen")
+    def test_process_file_sizes(self, mock_popen):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            capture = os.path.join(tmpdir, "dummy.pcap")
+            tshark_pipe(mock_popen, ["1\t0.0\tSrc\tDst\tHTTP\t100\tMocked Data\n"])
+            big = self.dataset._Dataset__process_file(capture, "big")
+            tshark_pipe(mock_popen, ["1\t0.0\tSrc\tDst\tHTTP\t100\tMocked Data\n"])
+            small = self.dataset._Dataset__process_file(capture, "small")
+
+            self.assertNotEqual(big, small)
+            with open(big) as f:
+                self.assertIn("| Mocked Data", f.read())
+            with open(small) as f:
+                self.assertNotIn("Mocked Data", f.read())
+            self.assertEqual(sorted(os.listdir(tmpdir)), ["dummy.big.txt", "dummy.small.txt"])
+
+    @patch("netexplainer.dataset.Popen")
+    def test_process_file_streams_rows(self, mock_popen):
+        tshark_pipe(mock_popen, [
+            "  1   0.000000 10.0.0.1\t\u2192\t10.0.0.2\tTCP\t60\t1234 \u2192 80 [SYN]\n",
+            "\n",
+            "  2   0.500000 10.0.0.2\t\u2192\t10.0.0.1\tTCP\t60\t80 \u2192 1234 [SYN, ACK]\n",
+        ])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            processed_path = self.dataset._Dataset__process_file(os.path.join(tmpdir, "dummy.pcap"), "small")
+            with open(processed_path) as f:
+                self.assertEqual(f.read(),
+                    "No.|Time|Source|Destination|Protocol|Length\n"
+                    "1   0.000000 10.0.0.1 | 10.0.0.2 | TCP | 60\n"
+                    "2   0.500000 10.0.0.2 | 10.0.0.1 | TCP | 60\n"
+                )
 
-    @patch("netexplainer.dataset.check_output", return_value=b"Mocked Data")
+    @patch("netexplainer.dataset.Popen")
     @patch("builtins.open", new_callable=mock_open)
-    def test_process_file(self, mock_file, mock_check_output):
-        processed_path = self.dataset._Dataset__process_file("dummy.pcap", "big")
-        self.assertTrue(processed_path.endswith(".txt"))
-        mock_file.assert_called_once_with(processed_path, 'w')
-        handle = mock_file()
-        handle.write.assert_any_call("No.|Time|Source|Destination|Protocol|Length|Info\n")
-        handle.write.assert_any_call("Mocked Data\n")
-
-    def test_clean_cap_format(self):
-        mocked_data = "1\t0.0\t192.168.1.1\t192.168.1.2\tTCP\t54\t[SYN]"
-        result = self.dataset._Dataset__clean_cap_format(mocked_data, "big")
-        self.assertIn("|", result)
+    def test_process_file_tshark_error(self, mock_file, mock_popen):
+        tshark_pipe(mock_popen, [], returncode=2)
+        with self.assertRaises(Exception):
+            self.dataset._Dataset__process_file(self.capture, "big")
+
+    def test_clean_cap_line(self):
+        line = "  1   0.000000 192.168.1.1\t\u2192\t192.168.1.2\tTCP\t54\t1234 \u2192 80 [SYN] \"GET\"\n"
+        self.assertEqual(self.dataset._Dataset__clean_cap_line(line, "big"), "1   0.000000 192.168.1.1 | 192.168.1.2 | TCP | 54 | 1234 -> 80 [SYN] 'GET'\n")
+        self.assertEqual(self.dataset._Dataset__clean_cap_line(line, "small"), "1   0.000000 192.168.1.1 | 192.168.1.2 | TCP | 54\n")
+
+    def test_write_rows(self):
+        for size, header in (("big", "No.|Time|Source|Destination|Protocol|Length|Info\n"), ("small", "No.|Time|Source|Destination|Protocol|Length\n")):
+            f = io.StringIO()
+            self.dataset._Dataset__write_rows(f, size, iter(["1 | row\n", "2 | row\n"]))
+            self.assertEqual(f.getvalue(), header + "1 | row\n2 | row\n")
 
     @patch("os.path.isfile")
     @patch("os.path.exists")
-    @patch("netexplainer.dataset.rdpcap")
-    def test_missing_questions_file(self, mock_rdpcap, mock_exists, mock_isfile):
+    @patch("netexplainer.dataset.answer_questions")
+    def test_missing_questions_file(self, mock_answer, mock_exists, mock_isfile):
         mock_exists.side_effect = lambda x: True if x == "dummy.pcap" else False
         mock_isfile.side_effect = lambda x: True if x == "dummy.pcap" else False
-        mock_rdpcap.return_value = MagicMock()
         with self.assertRaises(FileNotFoundError):
-            Dataset("dummy.pcap", "missing.yaml", "big")
+            Dataset("dummy.pcap", "missing.yaml", "big", use_cache=False)
+
+    @patch("netexplainer.dataset.Popen")
+    @patch("os.path.exists", return_value=True)
+    @patch("os.path.isfile", return_value=True)
+    @patch("netexplainer.dataset.answer_questions")
+    @patch("netexplainer.dataset.file_hash", return_value="hash")
+    @patch("netexplainer.dataset.AnswerCache")
+    @patch("netexplainer.dataset.RenderCache")
+    def test_cached_answers(self, mock_render, mock_cache, mock_hash, mock_answer, mock_isfile, mock_exists, mock_popen):
+        mock_cache.return_value.get.return_value = {"Sample question": 42}
+        mock_render.return_value.get.return_value = "rendered/hash-big.txt"
+        with patch("builtins.open", mock_open(read_data=self.mock_questions_content)):
+            dataset = Dataset("dummy.pcap", "dummy_questions.yaml", "big")
+
+        self.assertEqual(dataset.questions_answers, {"Sample question": 42})
+        self.assertEqual(dataset.processed_file, "rendered/hash-big.txt")
+        mock_cache.return_value.get.assert_called_once_with("hash", ["Sample question"], None)
+        mock_render.return_value.get.assert_called_once_with("hash", "big")
+        mock_answer.assert_not_called()
+        mock_popen.assert_not_called()
+        mock_cache.return_value.put.assert_not_called()
+
+    @patch("netexplainer.dataset.Popen")
+    @patch("netexplainer.cache.tshark_version", return_value="TShark 4.0")
+    def test_rendered_trace_cache(self, mock_version, mock_popen):
+        tshark_pipe(mock_popen, ["1\t0.0\tSrc\tDst\tHTTP\t100\tMocked Data\n"])
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch("netexplainer.dataset.RenderCache", lambda: RenderCache(cache_dir)):
+            big = self.dataset._Dataset__process_file("dummy.pcap", "big", "hash")
+            small = self.dataset._Dataset__process_file("dummy.pcap", "small", "hash")
+            self.assertNotEqual(big, small)
+            self.assertEqual(self.dataset._Dataset__process_file("dummy.pcap", "big", "hash"), big)
+            self.assertEqual(mock_popen.call_count, 2)
+
+            with open(big) as f:
+                self.assertEqual(f.read(), "No.|Time|Source|Destination|Protocol|Length|Info\n1 | 0.0 | Src | Dst | HTTP | 100 | Mocked Data\n")
+
+    @patch("netexplainer.dataset.check_output")
+    def test_read_once(self, mock_check_output):
+        mock_check_output.return_value = (
+            b"1\t0.000000000\t10.0.0.1\t10.0.0.2\tTCP\t60\t1234 \xe2\x86\x92 80 [SYN]\t"
+            b"1700000000.000000000\t60\t10.0.0.1\t10.0.0.2\t\t\teth:ethertype:ip:tcp\n"
+            b"2\t0.500000000\t10.0.0.2\t10.0.0.1\tTCP\t60\t80 \xe2\x86\x92 1234 [SYN, ACK]\t"
+            b"1700000000.500000000\t60\t10.0.0.2\t10.0.0.1\t\t\teth:ethertype:ip:tcp\n"
+        )
+        self.dataset.questions_subquestions = {"What is the total number of packets in the trace?": [], "How long in seconds does the communication last?": []}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            answers, processed_path = self.dataset._Dataset__read_once(os.path.join(tmpdir, "dummy.pcap"), "small")
+
+            self.assertEqual(mock_check_output.call_count, 1)
+            self.assertEqual(answers["What is the total number of packets in the trace?"], 2)
+            self.assertEqual(float(answers["How long in seconds does the communication last?"]), 0.5)
+            with open(processed_path) as f:
+                self.assertEqual(f.read(),
+                    "No.|Time|Source|Destination|Protocol|Length\n"
+                    "1 | 0.000000000 | 10.0.0.1 | 10.0.0.2 | TCP | 60\n"
+                    "2 | 0.500000000 | 10.0.0.2 | 10.0.0.1 | TCP | 60\n"
+                )
+
+    @patch("netexplainer.dataset.Popen")
+    @patch("netexplainer.dataset.TraceSummary")
+    @patch("os.path.exists", return_value=True)
+    @patch("os.path.isfile", return_value=True)
+    @patch("netexplainer.dataset.answer_questions")
+    def test_summaries(self, mock_answer, mock_isfile, mock_exists, mock_summary, mock_popen):
+        tshark_pipe(mock_popen, ["Mocked Data\n"])
+        mock_summary.from_file.return_value.to_text.return_value = "Packets: 1\n"
+        with patch("builtins.open", mock_open(read_data=self.mock_questions_content)):
+            dataset = Dataset(self.capture, "dummy_questions.yaml", "small", use_cache=False, summaries=True)
+
+        self.assertEqual(dataset.summary_file, os.path.join(self.tmpdir, "dummy.summary.small.txt"))
+        mock_summary.from_file.return_value.to_text.assert_called_once_with(10)
+        with open(dataset.summary_file) as f:
+            self.assertEqual(f.read(), "Packets: 1\n")
+
+class TestCompressedCaptures(unittest.TestCase):
+    def test_compressed_capture(self):
+        from scapy.all import Ether, IP, TCP, wrpcap
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tshark = os.path.join(tmpdir, "bin", "tshark")
+            os.makedirs(os.path.dirname(tshark))
+            with open(tshark, "w") as f:
+                f.write(FAKE_TSHARK)
+            os.chmod(tshark, 0o755)
+
+            packets = [Ether() / IP(src=f"10.0.0.{i % 3 + 1}", dst="10.0.0.9") / TCP() / (b"x" * i) for i in range(20)]
+            for i, packet in enumerate(packets):
+                packet.time = 1700000000 + i / 10
+            captures = {}
+            for codec in ("none",) + CODECS:
+                os.makedirs(os.path.join(tmpdir, codec))
+                captures[codec] = os.path.join(tmpdir, codec, "capture.pcap")
+                wrpcap(captures[codec], packets)
+                if codec == "zstd" and zstandard is None:
+                    del captures[codec]
+                elif codec != "none":
+                    captures[codec] = compress_capture(captures[codec], codec)
+
+            with patch.dict(os.environ, {"PATH": os.path.dirname(tshark) + os.pathsep + os.environ["PATH"]}):
+                datasets = {codec: Dataset(path, QUESTIONS_PATH, "big", use_cache=False) for codec, path in captures.items()}
+
+            with open(datasets["none"].processed_file) as f:
+                rendered = f.read()
+            self.assertEqual(rendered.count("\n"), 21)
+            for codec, dataset in datasets.items():
+                with self.subTest(codec=codec), open(dataset.processed_file) as f:
+                    self.assertEqual(dataset.questions_answers, datasets["none"].questions_answers)
+                    self.assertEqual(f.read(), rendered)
+
+class TestPrepareDatasets(unittest.TestCase):
+    def test_failures_are_isolated(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            questions_path = os.path.join(tmpdir, "questions.yaml")
+            with open(questions_path, "w") as f:
+                f.write("questions:\n  - question: Sample question\n    subquestions: []\n")
+            not_a_capture = os.path.join(tmpdir, "notes.md")
+            open(not_a_capture, "w").close()
+
+            datasets = prepare_datasets([os.path.join(tmpdir, "missing.pcap"), not_a_capture], questions_path, ["big"], max_workers=2)
+        self.assertEqual(datasets, {})
+
+    @unittest.skipIf(shutil.which("tshark") is None, "tshark is not installed")
+    def test_prepare(self):
+        from scapy.all import Ether, IP, TCP, wrpcap
+        with tempfile.TemporaryDirectory() as tmpdir:
+            questions_path = os.path.join(tmpdir, "questions.yaml")
+            with open(questions_path, "w") as f:
+                f.write("questions:\n  - question: What is the total number of packets in the trace?\n    subquestions: []\n")
+            capture = os.path.join(tmpdir, "capture.pcap")
+            wrpcap(capture, [Ether() / IP() / TCP()] * 3)
+
+            datasets = prepare_datasets([capture], questions_path, ["big"], max_workers=2, use_cache=False)
+            self.assertEqual(set(datasets), {(capture, "big")})
+            self.assertEqual(datasets[(capture, "big")].questions_answers["What is the total number of packets in the trace?"], 3)
 
 if __name__ == '__main__':
     unittest.main()
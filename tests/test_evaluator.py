@@ -1,10 +1,18 @@
 import unittest
 import os
-from unittest.mock import patch, call
+import shutil
+import tempfile
+from unittest.mock import patch, call, MagicMock
 from netexplainer.evaluator import Evaluator
 
 class TestEvaluatorCharts(unittest.TestCase):
     def setUp(self):
+        # The charts and their text files are written relative to the working directory
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmpdir)
+        os.makedirs("netexplainer/data/evaluation")
         self.evaluator = Evaluator()
         self.mock_results = [
             {"model": "model1", "question": "Q1", "answer_eval": "YES"},
@@ -55,5 +63,24 @@ class TestEvaluatorCharts(unittest.TestCase):
         self.evaluator.generate_pie_charts([{"model": "gemma", "answer_eval": "YES"}], tools=True)
         mock_makedirs.assert_called_with("netexplainer/data/evaluation/gemma_tools/", exist_ok=True)
 
+class TestEvaluatorBatch(unittest.TestCase):
+    def test_answer_batch(self):
+        dataset = MagicMock(processed_file="trace.txt")
+        dataset.questions_subquestions = {"Q1": ["S1", "S2"], "Q2": []}
+        dataset.divide_in_subquestions = {"Q1": True, "Q2": False}
+        llm = MagicMock()
+        llm.get_subquestions.return_value = ["S1", "S2"]
+        llm.answer_batch.return_value = ["A1", "A2", "A3"]
+        llm.get_final_answer.return_value = "F1"
+
+        prepared = Evaluator().answer_batch(llm, dataset)
+
+        llm.answer_batch.assert_called_once_with(["S1", "S2", "Q2"])
+        llm.get_final_answer.assert_called_once_with("Q1", ["S1", "S2"], ["A1", "A2"])
+        self.assertEqual(prepared, {"Q1": (["S1", "S2"], "F1"), "Q2": (["Q2"], "A3")})
+
+        llm.answer_batch.side_effect = Exception("backend error")
+        self.assertEqual(Evaluator().answer_batch(llm, dataset), {})
+
 if __name__ == "__main__":
     unittest.main()
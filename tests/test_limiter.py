@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from netexplainer.limiter import RateLimiter, TokenBucket, get_limiter, is_rate_limit_error, MAX_RETRIES
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def test_token_bucket():
+    """Test requests are free until the bucket is empty and then paced at its rate"""
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.01)
+    assert bucket.reserve(30, fraction=0.5) == pytest.approx(62, abs=0.05)
+
+
+def test_reserve_both_quotas():
+    """Test the delay is set by the most restrictive quota"""
+    limiter = RateLimiter("test", requests_per_minute=600, tokens_per_minute=1000)
+    assert limiter.reserve(1000) == 0
+    assert limiter.reserve(500) == pytest.approx(30, abs=0.05)
+    assert RateLimiter("unlimited").reserve(10 ** 9) == 0
+
+
+def test_is_rate_limit_error():
+    """Test rate-limit errors are told apart from other errors"""
+    assert is_rate_limit_error(RateLimitError())
+    assert is_rate_limit_error(Exception("429 Resource has been exhausted (e.g. check quota)."))
+    assert not is_rate_limit_error(ValueError("invalid expression"))
+
+
+@patch("netexplainer.limiter.time.sleep")
+def test_call_backs_off(mock_sleep):
+    """Test rejected calls are retried after a pause at a reduced rate"""
+    limiter = RateLimiter("test", requests_per_minute=60)
+    responses = iter([RateLimitError(), RateLimitError(), "answer"])
+
+    def function():
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert limiter.call(function) == "answer"
+    pauses = [call.args[0] for call in mock_sleep.call_args_list]
+    assert len(pauses) == 2 and pauses[1] > pauses[0] > 0
+    assert limiter.fraction == pytest.approx(0.25 + 0.05)
+
+
+@patch("netexplainer.limiter.time.sleep")
+def test_call_gives_up(mock_sleep):
+    """Test other errors are raised at once and rate-limit errors after the retries"""
+    limiter = RateLimiter("test")
+    calls = []
+
+    def failing(error):
+        calls.append(error)
+        raise error
+
+    with pytest.raises(ValueError):
+        limiter.call(lambda: failing(ValueError()))
+    assert len(calls) == 1
+
+    with pytest.raises(RateLimitError):
+        limiter.call(lambda: failing(RateLimitError()))
+    assert len(calls) == 2 + MAX_RETRIES
+
+
+def test_acall():
+    """Test coroutines are retried like functions"""
+    limiter = RateLimiter("test")
+    attempts = []
+
+    async def function():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RateLimitError()
+        return "answer"
+
+    with patch("netexplainer.limiter.asyncio.sleep") as mock_sleep:
+        assert asyncio.run(limiter.acall(function)) == "answer"
+    assert len(attempts) == 2
+    mock_sleep.assert_awaited_once()
+
+
+def test_get_limiter():
+    """Test every model of a provider shares its limiter"""
+    assert get_limiter("test-shared", requests_per_minute=10) is get_limiter("test-shared")
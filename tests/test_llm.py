@@ -1,7 +1,16 @@
 import unittest
 import os
+import asyncio
+import tempfile
 from unittest.mock import patch, mock_open, MagicMock
-from netexplainer.llm import LLM, models, calculator
+from langchain_core.language_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from netexplainer.cache import ResponseCache
+from netexplainer.llm import LLM, models, calculator, run_async, parse_batch_answers, BATCH_SCHEMA, KEEP_ALIVE, RESPONSE_TOKENS
+from netexplainer.render import estimate_tokens
+
+class FakeChatModel(FakeMessagesListChatModel):
+    temperature: float | None = 0
 
 class TestLLM(unittest.TestCase):
     @patch("netexplainer.llm.TextLoader")
@@ -36,6 +45,185 @@ class TestLLM(unittest.TestCase):
         with self.assertRaises(FileExistsError):
             LLM("directory")
 
+    def test_answer_subquestion_fits_context(self):
+        self.llm.file = [MagicMock(page_content="No.|Time|Source|Destination|Protocol|Length\n" + "1 | 0.0 | 10.0.0.1 | 10.0.0.2 | TCP | 60\n" * 1000)]
+        self.llm.context_size = RESPONSE_TOKENS + 200
+        self.llm.call_llm = MagicMock(return_value="answer")
+
+        self.assertEqual(self.llm.answer_subquestion("How many packets?"), "answer")
+        prompt = "".join(message.content for message in self.llm.call_llm.call_args.args[0])
+        self.assertLessEqual(estimate_tokens(prompt), self.llm.context_size - RESPONSE_TOKENS)
+        self.assertIn("packets omitted to fit the context window", prompt)
+
+    def test_session_prefix(self):
+        self.llm.file = [MagicMock(page_content="No.|Time|Source|Destination|Protocol|Length\n" + "1 | 0.0 | 10.0.0.1 | 10.0.0.2 | TCP | 60\n" * 1000)]
+        self.llm.context_size = RESPONSE_TOKENS + 2000
+        self.llm.call_llm = MagicMock(return_value="answer")
+
+        self.llm.answer_subquestion("How many packets?")
+        self.llm.answer_subquestion("Which is the longest of all the questions asked about this trace?")
+        first, second = (call.args[0] for call in self.llm.call_llm.call_args_list)
+        # Only the last message, the question, changes between the calls
+        self.assertEqual(first[:-1], second[:-1])
+        self.assertEqual(first[0].type, "system")
+        self.assertIn("10.0.0.1", first[0].content)
+        self.assertEqual(second[-1].content, 'Question: "Which is the longest of all the questions asked about this trace?"')
+
+    def test_answer_batch(self):
+        self.llm.call_llm = MagicMock(return_value='Sure:\n```json\n{"answers": [{"id": 1, "answer": "7"}, {"id": 3, "answer": ""}]}\n```')
+        self.llm.answer_subquestion = MagicMock(side_effect=lambda question: f"fallback {question}")
+
+        answers = self.llm.answer_batch(["Q1", "Q2", "Q3"])
+
+        self.assertEqual(answers, ["7", "fallback Q2", "fallback Q3"])
+        messages = self.llm.call_llm.call_args.args[0]
+        self.assertEqual(messages[:-1], self.llm.session_prefix())
+        self.assertIn('3. "Q3"', messages[-1].content)
+        self.assertEqual(self.llm.call_llm.call_args.kwargs["schema"], BATCH_SCHEMA)
+
+    def test_answer_subquestion_chunked(self):
+        self.llm.file = [MagicMock(page_content="No.|Time|Source|Destination|Protocol|Length\n" + "1 | 0.0 | 10.0.0.1 | 10.0.0.2 | TCP | 60\n" * 1000)]
+        self.llm.context_size = RESPONSE_TOKENS + 1000
+        self.llm.chunked = True
+        self.llm.call_llm = MagicMock(return_value="partial")
+
+        self.llm.answer_subquestion("How many packets?")
+        prompts = ["".join(message.content for message in call.args[0]) for call in self.llm.call_llm.call_args_list]
+        self.assertGreater(len(prompts), 2)
+        for prompt in prompts:
+            self.assertLessEqual(estimate_tokens(prompt), self.llm.context_size - RESPONSE_TOKENS)
+            self.assertNotIn("omitted", prompt)
+        self.assertEqual(sum(prompt.count("10.0.0.1 |") for prompt in prompts[:-1]), 1000)
+        self.assertIn(f"Part {len(prompts) - 1}: partial", prompts[-1])
+
+    def test_combine_answers_hierarchically(self):
+        self.llm.context_size = RESPONSE_TOKENS + 600
+        self.llm.call_llm = MagicMock(return_value="There are 100 packets in these parts. " * 5)
+
+        self.llm.combine_answers("How many packets?", ["There are 100 packets in this part. " * 5] * 40)
+        prompts = ["".join(message.content for message in call.args[0]) for call in self.llm.call_llm.call_args_list]
+        self.assertGreater(len(prompts), 2)
+        for prompt in prompts:
+            self.assertLessEqual(estimate_tokens(prompt), self.llm.context_size - RESPONSE_TOKENS)
+        self.assertTrue(any("Part 40:" in prompt for prompt in prompts[:-1]))
+        self.assertIn("Parts 1 to ", prompts[-1])
+        self.assertIn("the whole trace", prompts[-1])
+
+    def test_combine_answers_longer_than_budget(self):
+        self.llm.context_size = 2048
+        self.llm.call_llm = MagicMock(return_value="answer " * 300)
+
+        self.llm.combine_answers("How many packets?", ["x" * 2000] * 2)
+        self.assertEqual(self.llm.call_llm.call_count, 1)
+
+        self.llm.call_llm.reset_mock()
+        self.llm.combine_answers("How many packets?", ["x" * 2000] * 9)
+        prompts = ["".join(message.content for message in call.args[0]) for call in self.llm.call_llm.call_args_list]
+        self.assertLessEqual(len(prompts), 8)
+        for prompt in prompts:
+            self.assertLessEqual(estimate_tokens(prompt), self.llm.context_size - RESPONSE_TOKENS)
+            self.assertIn("[...]", prompt)
+
+    def test_answer_subquestion_summary(self):
+        self.llm.summary = "Packets: 1000, Bytes: 60000"
+        self.llm.call_llm = MagicMock(return_value="answer")
+
+        self.llm.prompt_mode = "summary"
+        self.llm.answer_subquestion("How many packets?")
+        prompt = "".join(message.content for message in self.llm.call_llm.call_args.args[0])
+        self.assertIn("Packets: 1000, Bytes: 60000", prompt)
+        self.assertNotIn(self.mock_file_content, prompt)
+
+        self.llm.prompt_mode = "summary+rows"
+        self.llm.answer_subquestion("How many packets?")
+        prompt = "".join(message.content for message in self.llm.call_llm.call_args.args[0])
+        self.assertLess(prompt.index("Packets: 1000, Bytes: 60000"), prompt.index(self.mock_file_content))
+
+    def test_call_llm_cached(self):
+        responses = [
+            AIMessage(content="", tool_calls=[{"name": "calculator", "args": {"expression": "2 * 3"}, "id": "call"}]),
+            AIMessage(content="6"),
+        ]
+        self.llm.model = "fake"
+        self.llm.llm = FakeChatModel(responses=[])
+        self.llm.llm_with_tools = FakeChatModel(responses=responses)
+        with tempfile.TemporaryDirectory() as tmpdir, \
+             patch("netexplainer.llm.response_cache", return_value=ResponseCache(os.path.join(tmpdir, "responses.sqlite"))):
+            self.assertEqual(self.llm.call_llm([HumanMessage(content="2 times 3?")], tools=True), "6")
+
+            # Every turn, including the one after the tool call, is answered from the cache
+            self.llm.llm_with_tools = MagicMock()
+            self.assertEqual(self.llm.call_llm([HumanMessage(content="2 times 3?")], tools=True), "6")
+            self.llm.llm_with_tools.invoke.assert_not_called()
+
+            self.llm.llm_with_tools.invoke.return_value = AIMessage(content="7")
+            self.assertEqual(self.llm.call_llm([HumanMessage(content="3 plus 4?")], tools=True), "7")
+
+            # A refreshed response replaces the cached one
+            self.llm.refresh = True
+            self.llm.llm_with_tools.invoke.return_value = AIMessage(content="8")
+            self.assertEqual(self.llm.call_llm([HumanMessage(content="3 plus 4?")], tools=True), "8")
+            self.llm.refresh = False
+            self.llm.llm_with_tools.invoke.return_value = AIMessage(content="9")
+            self.assertEqual(self.llm.call_llm([HumanMessage(content="3 plus 4?")], tools=True), "8")
+
+            self.llm.cache = False
+            self.llm.llm_with_tools.invoke.return_value = AIMessage(content="uncached")
+            self.assertEqual(self.llm.call_llm([HumanMessage(content="2 times 3?")], tools=True), "uncached")
+
+    def test_call_llm_sampled_not_cached(self):
+        self.llm.llm = FakeChatModel(responses=[AIMessage(content="first"), AIMessage(content="second")], temperature=0.8)
+        with tempfile.TemporaryDirectory() as tmpdir, \
+             patch("netexplainer.llm.response_cache", return_value=ResponseCache(os.path.join(tmpdir, "responses.sqlite"))):
+            self.assertEqual(self.llm.call_llm([HumanMessage(content="question")]), "first")
+            self.assertEqual(self.llm.call_llm([HumanMessage(content="question")]), "second")
+
+    def test_call_llm_tool_error(self):
+        responses = [
+            AIMessage(content="", tool_calls=[
+                {"name": "calculator", "args": {"expression": "2 +* 3"}, "id": "bad"},
+                {"name": "search", "args": {}, "id": "unknown"},
+            ]),
+            AIMessage(content="5"),
+        ]
+        self.llm.cache = False
+        self.llm.llm_with_tools = FakeChatModel(responses=responses)
+        messages = [HumanMessage(content="2 plus 3?")]
+
+        self.assertEqual(self.llm.call_llm(messages, tools=True), "5")
+        self.assertEqual([message.status for message in messages[2:]], ["error", "error"])
+        self.assertTrue(messages[2].content.startswith("Error:"))
+        self.assertIn("Unknown tool search", messages[3].content)
+
+    def test_aanswer_subquestions(self):
+        in_flight = []
+        peak = []
+
+        async def acall_llm(messages, tools=False):
+            in_flight.append(messages)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(messages)
+            content = messages[-1].content
+            return content.split('Question: "')[1].split('"')[0].upper() if 'Question: "' in content else "final"
+
+        self.llm.acall_llm = acall_llm
+        questions = [f"question {i}" for i in range(5)]
+
+        answers = run_async(self.llm.aanswer_subquestions(questions, max_concurrency=2))
+        self.assertEqual(answers, [question.upper() for question in questions])
+        self.assertEqual(max(peak), 2)
+
+        final_answer = run_async(self.llm.aget_final_answer("question", questions, answers))
+        self.assertEqual(final_answer, "final")
+
+    def test_prompt_mode_without_summary(self):
+        with patch("os.path.exists", return_value=True), \
+             patch("os.path.isfile", return_value=True), \
+             patch("netexplainer.llm.TextLoader"):
+            with self.assertRaises(ValueError):
+                LLM("valid.txt", prompt_mode="summary")
+
 class TestLLMSubclasses(unittest.TestCase):
     @patch("netexplainer.llm.ChatGoogleGenerativeAI")
     @patch("os.path.exists", return_value=True)
@@ -54,6 +242,8 @@ class TestLLMSubclasses(unittest.TestCase):
                 timeout=None,
             )
             mock_model.return_value.bind_tools.assert_called_once_with(tools=[calculator])
+            self.assertIs(llm.llm_with_tools, mock_model.return_value.bind_tools.return_value)
+            self.assertEqual(llm.provider, "google")
 
     @patch("netexplainer.llm.ChatOllama")
     @patch("os.path.exists", return_value=True)
@@ -67,8 +257,22 @@ class TestLLMSubclasses(unittest.TestCase):
             mock_model.assert_called_once_with(
                 model="mistral",
                 num_ctx=32768,
+                keep_alive=KEEP_ALIVE,
             )
             mock_model.return_value.bind_tools.assert_called_once_with(tools=[calculator])
+            self.assertIs(llm.llm_with_tools, mock_model.return_value.bind_tools.return_value)
+            self.assertEqual(llm.provider, "ollama")
+
+class TestParseBatchAnswers(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(parse_batch_answers('{"answers": [{"id": 2, "answer": "b"}, {"id": 1, "answer": 5}]}', 2), {1: "5", 2: "b"})
+        self.assertEqual(parse_batch_answers('The answers are {"1": "a", "2": ["x", "y"]}', 2), {1: "a", 2: '["x", "y"]'})
+        self.assertEqual(parse_batch_answers('["a", "b", "c"]', 2), {1: "a", 2: "b"})
+
+    def test_invalid(self):
+        self.assertEqual(parse_batch_answers("There are {7} packets", 1), {})
+        self.assertEqual(parse_batch_answers('{"answers": [{"id": 1, "answer": "a"', 1), {})
+        self.assertEqual(parse_batch_answers('{"answers": [{"id": "x", "answer": "a"}]}', 1), {})
 
 class TestCalculatorTool(unittest.TestCase):
     def test_calculator_valid(self):
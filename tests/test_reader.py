@@ -0,0 +1,122 @@
+import struct
+import pytest
+from scapy.all import (Ether, Dot1Q, IP, IPv6, TCP, UDP, ICMP, GRE, ARP, VXLAN,
+                       ICMPv6EchoRequest, IPOption_RR, PcapWriter, PcapNgWriter, raw)
+from netexplainer.reader import read_records, scapy_records, tshark_record, count_records
+
+
+def tricky_packets() -> list:
+    packets = [
+        Ether() / Dot1Q(vlan=10) / IP(src="10.0.1.1", dst="10.0.1.2") / TCP(),
+        Ether() / IP(src="10.0.2.1", dst="10.0.2.2", frag=10) / UDP(),
+        Ether() / IP(src="10.0.3.1", dst="10.0.3.2", flags="MF") / TCP(),
+        Ether() / IP(src="10.0.4.1", dst="10.0.4.2") / UDP(dport=4789) / VXLAN() / Ether() / IP() / ICMP(),
+        Ether() / IP(src="10.0.5.1", dst="10.0.5.2", options=[IPOption_RR()]) / UDP(),
+        Ether() / IP(src="10.0.6.1", dst="10.0.6.2") / IP(src="192.168.0.1", dst="192.168.0.2") / ICMP(),
+        Ether() / IP(src="10.0.7.1", dst="10.0.7.2") / GRE() / IP() / TCP(),
+        Ether() / IP(src="10.0.8.1", dst="10.0.8.2", proto=6),
+        Ether() / IPv6(src="2001:db8::1", dst="2001:db8::2") / TCP(sport=1234, dport=80),
+        Ether() / IPv6(src="2001:db8::2", dst="2001:db8::1") / ICMPv6EchoRequest(),
+        Ether() / ARP(),
+        Ether(type=0x1234) / b"unknown",
+        # Snaplen-truncated and short transport headers are Raw for scapy
+        Ether(raw(Ether() / IP(src="10.0.9.1", dst="10.0.9.2") / TCP() / b"payload")[:44]),
+        Ether(raw(Ether() / IP(src="10.0.10.1", dst="10.0.10.2") / UDP() / b"payload")[:38]),
+        Ether() / IP(src="10.0.11.1", dst="10.0.11.2", proto=6) / b"\x04\xd2\x00\x50",
+        Ether() / IP(src="10.0.12.1", dst="10.0.12.2", proto=17) / b"\x04\xd2\x00\x35",
+        Ether() / IP(src="10.0.13.1", dst="10.0.13.2", proto=1) / b"\x08\x00",
+        Ether() / IPv6(src="2001:db8::3", dst="2001:db8::4", nh=6) / b"\x04\xd2\x00\x50",
+    ]
+    for i, packet in enumerate(packets):
+        packet.time = 1700000000 + i * 0.000001
+    return packets
+
+
+def pcapng_block(endian: str, block_type: int, body: bytes) -> bytes:
+    body += b"\x00" * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack(endian + "II", block_type, length) + body + struct.pack(endian + "I", length)
+
+
+def write_pcapng(path, endian: str, packets: list) -> None:
+    """Write a pcapng file by hand with an Ethernet interface in microseconds
+    and a raw IP interface in nanoseconds"""
+    blocks = [
+        pcapng_block(endian, 0x0A0D0D0A, struct.pack(endian + "IHHq", 0x1A2B3C4D, 1, 0, -1)),
+        pcapng_block(endian, 1, struct.pack(endian + "HxxI", 1, 65535)),
+        pcapng_block(endian, 1, struct.pack(endian + "HxxI", 101, 65535)
+                     + struct.pack(endian + "HH", 9, 1) + b"\x09\x00\x00\x00"
+                     + struct.pack(endian + "HH", 0, 0)),
+    ]
+    for i, packet in enumerate(packets):
+        interface, data = (1, raw(packet[IP])) if i % 2 and packet.haslayer(IP) else (0, raw(packet))
+        ticks = 1700000000 * (10 ** 9 if interface else 10 ** 6) + i * 1234
+        blocks.append(pcapng_block(endian, 6, struct.pack(
+            endian + "5I", interface, ticks >> 32, ticks & 0xffffffff, len(data), len(data)) + data))
+    with open(path, "wb") as f:
+        f.write(b"".join(blocks))
+
+
+@pytest.mark.parametrize("endianness, nano", [("<", False), (">", False), ("<", True)])
+def test_pcap_matches_scapy(tmp_path, sample_packets, endianness, nano):
+    """Test the fast path against scapy on classic pcap files"""
+    path = str(tmp_path / "sample.pcap")
+    with PcapWriter(path, endianness=endianness, nano=nano) as writer:
+        writer.write(sample_packets + tricky_packets())
+
+    assert list(read_records(path)) == list(scapy_records(path))
+
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+def test_pcapng_matches_scapy(tmp_path, sample_packets, endian):
+    """Test the fast path against scapy on pcapng files with several interfaces"""
+    path = str(tmp_path / "sample.pcapng")
+    write_pcapng(path, endian, sample_packets + tricky_packets())
+
+    records = list(read_records(path))
+    assert len(records) == len(sample_packets) + len(tricky_packets())
+    assert records == list(scapy_records(path))
+
+
+def test_scapy_pcapng_writer(tmp_path, sample_packets):
+    """Test the fast path on pcapng files written by scapy"""
+    path = str(tmp_path / "sample.pcapng")
+    with PcapNgWriter(path) as writer:
+        writer.write(sample_packets)
+
+    assert list(read_records(path)) == list(scapy_records(path))
+
+
+def test_truncated_file(tmp_path, sample_pcap):
+    """Test a capture whose last record was cut short"""
+    path = str(tmp_path / "truncated.pcap")
+    with open(sample_pcap, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:-10])
+
+    assert list(read_records(path)) == list(scapy_records(path))
+
+
+def test_count_records(tmp_path, sample_packets):
+    """Test counting records, stopping past the limit"""
+    pcap = str(tmp_path / "sample.pcap")
+    with PcapWriter(pcap) as writer:
+        writer.write(sample_packets)
+    pcapng = str(tmp_path / "sample.pcapng")
+    write_pcapng(pcapng, "<", sample_packets)
+
+    for path in (pcap, pcapng):
+        assert count_records(path) == len(sample_packets)
+        assert count_records(path, limit=len(sample_packets)) == len(sample_packets)
+        assert count_records(path, limit=2) == 3
+
+
+def test_tshark_record():
+    """Test records built from tshark fields"""
+    assert tshark_record(["1700000000.250000000", "60", "10.0.0.1", "10.0.0.2", "", "", "eth:ethertype:ip:tcp"]) == \
+        (1700000000250000000, 60, ("10.0.0.1", "10.0.0.2"), "TCP")
+    assert tshark_record(["1700000000.5", "86", "", "", "fe80::1", "fe80::2", "eth:ethertype:ipv6:icmpv6"]) == \
+        (1700000000500000000, 86, ("fe80::1", "fe80::2"), "ICMPv6")
+    assert tshark_record(["1700000000.000000000", "42", "", "", "", "", "eth:ethertype:arp"]) == \
+        (1700000000000000000, 42, None, None)
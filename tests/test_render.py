@@ -0,0 +1,52 @@
+from netexplainer.render import estimate_tokens, fit_trace, parse_trace, chunk_trace
+
+TRACE = (
+    "No.|Time|Source|Destination|Protocol|Length|Info\n"
+    + "".join(
+        f"{i} | {i * 0.123456789:.9f} | 2001:db8:aaaa:bbbb:cccc:dddd:eeee:{i:04x} | 10.0.0.2 | TCP | 60 | "
+        f"1234 -> 80 [SYN] Seq=0 Win=64240 Len=0 MSS=1460 | flags\n"
+        for i in range(1, 101)
+    )
+)
+
+
+def test_fits():
+    """Test traces within the budget are left untouched"""
+    assert fit_trace(TRACE, estimate_tokens(TRACE)) == TRACE
+
+
+def test_drop_columns():
+    """Test the Info column is dropped first, keeping the separators inside it intact"""
+    header, rows = parse_trace(TRACE)
+    assert rows[0][-1] == "1234 -> 80 [SYN] Seq=0 Win=64240 Len=0 MSS=1460 | flags"
+
+    fitted = fit_trace(TRACE, estimate_tokens(TRACE) - 1)
+    assert fitted.splitlines()[0] == "No.|Time|Source|Destination|Protocol|Length"
+    assert fitted.splitlines()[1] == "1 | 0.123456789 | 2001:db8:aaaa:bbbb:cccc:dddd:eeee:0001 | 10.0.0.2 | TCP | 60"
+
+
+def test_abbreviate():
+    """Test times and long fields are shortened when dropping columns is not enough"""
+    without_info = fit_trace(TRACE, estimate_tokens(TRACE) - 1)
+    fitted = fit_trace(TRACE, estimate_tokens(without_info) - 1)
+    assert fitted.splitlines()[1] == "1 | 0.123 | 2001:db8:aaaa:bbbb:cc... | 10.0.0.2 | TCP | 60"
+    assert len(fitted.splitlines()) == 101
+
+
+def test_truncate():
+    """Test the trace is truncated with a marker of the omitted packets as a last resort"""
+    fitted = fit_trace(TRACE, 300)
+    lines = fitted.splitlines()
+    assert estimate_tokens(fitted) <= 300
+    assert lines[0] == "No.|Time|Source|Destination|Protocol|Length"
+    assert lines[-1] == f"[... {102 - len(lines)} of 100 packets omitted to fit the context window ...]"
+
+
+def test_chunk_trace():
+    """Test windows keep every row once, in order, each with the header and within the budget"""
+    windows = chunk_trace(TRACE, 500)
+    assert len(windows) > 1
+    assert all(estimate_tokens(window) <= 500 for window in windows)
+    assert all(window.startswith("No.|Time|Source|Destination|Protocol|Length|Info\n") for window in windows)
+    assert [row for window in windows for row in window.splitlines()[1:]] == TRACE.splitlines()[1:]
+    assert chunk_trace(TRACE, estimate_tokens(TRACE)) == [TRACE]
@@ -1,7 +1,85 @@
+import io
 import os
-from unittest.mock import patch, MagicMock, Mock
-from scapy.error import Scapy_Exception
+import json
+import shutil
+import hashlib
+import threading
+import pytest
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from unittest.mock import patch, Mock
+from scapy.all import wrpcap
+from concurrent.futures import ThreadPoolExecutor
+from netexplainer.reader import count_records
+from netexplainer.catalog import Catalog
 from netexplainer.scraper import Scraper
+from netexplainer.store import open_capture
+
+
+@pytest.fixture(autouse=True)
+def catalog(tmp_path_factory):
+    """Keep the catalog of the tests out of the data directory"""
+    path = tmp_path_factory.mktemp("catalog") / "catalog.sqlite"
+    with patch('netexplainer.scraper.Catalog', lambda: Catalog(path)):
+        yield path
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    statuses = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def log_request(self, code='-', size='-'):
+        self.statuses.append((self.path, int(code)))
+
+    def send_head(self):
+        """Serve files with an ETag, conditional requests and single byte ranges"""
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return None
+        with open(path, 'rb') as f:
+            content = f.read()
+        etag = '"' + hashlib.sha256(content).hexdigest() + '"'
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return None
+
+        start = 0
+        requested = self.headers.get('Range')
+        if requested and self.headers.get('If-Range', etag) == etag:
+            start = int(requested.split('=')[1].split('-')[0])
+            if start >= len(content):
+                self.send_error(416)
+                return None
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(content) - 1}/{len(content)}")
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        return io.BytesIO(content[start:])
+
+
+@pytest.fixture
+def capture_server(tmp_path_factory):
+    """Serve fixture captures from a local HTTP server"""
+    served = tmp_path_factory.mktemp("served")
+    (served / "small.pcap").write_bytes(b"small capture")
+    (served / "large.pcapng").write_bytes(os.urandom(300000))
+    (served / "old.cap").write_bytes(b"old capture")
+
+    QuietHandler.statuses = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(served)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", served
+    server.shutdown()
+    server.server_close()
 
 def test_get_download_urls():
     """Test URL parsing logic"""
@@ -18,92 +96,196 @@ def test_get_download_urls():
         'https://external.com/test3.pcapng'
     }
 
-    with patch('requests.get', return_value=mock_response):
+    with patch('requests.Session.get', return_value=mock_response):
         scraper = Scraper()
         assert set(scraper.download_urls) == expected_urls
 
-def test_download_captures(tmpdir):
-    """Test file downloading functionality"""
-    test_urls = ['http://example.com/file.pcap']
+def test_download_captures(tmpdir, capture_server):
+    """Test concurrent streaming downloads from a local server"""
+    base_url, served = capture_server
+    names = ['small.pcap', 'large.pcapng', 'missing.pcap']
+    test_urls = [f"{base_url}/{name}" for name in names]
+
+    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=test_urls), \
+         patch('netexplainer.scraper.DATASET_PATH', str(tmpdir)), \
+         patch('netexplainer.scraper.CHUNK_SIZE', 4096):
+
+        scraper = Scraper(workers=2, timeout=5)
+        scraper.download_captures()
+
+        assert sorted(os.listdir(str(tmpdir))) == ['.manifest.json', 'large.pcapng', 'small.pcap']
+        for name in ['small.pcap', 'large.pcapng']:
+            with open(os.path.join(str(tmpdir), name), 'rb') as f:
+                assert f.read() == (served / name).read_bytes()
+
+def test_download_captures_converts_cap(tmpdir, capture_server):
+    """Test .cap files are converted once downloaded"""
+    base_url, _ = capture_server
+
+    def editcap(args, **kwargs):
+        shutil.copy(args[-2], args[-1])
+
+    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=[f"{base_url}/old.cap"]), \
+         patch('netexplainer.scraper.DATASET_PATH', str(tmpdir)), \
+         patch('netexplainer.scraper.subprocess.run', side_effect=editcap) as mock_run:
+
+        Scraper(timeout=5).download_captures()
+
+        mock_run.assert_called_once()
+        assert sorted(os.listdir(str(tmpdir))) == ['.manifest.json', 'old.pcap']
+
+def test_download_captures_compressed(tmpdir, capture_server):
+    """Test captures are stored compressed and still skipped when unchanged"""
+    base_url, served = capture_server
+
+    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=[f"{base_url}/small.pcap"]), \
+         patch('netexplainer.scraper.DATASET_PATH', str(tmpdir)):
+
+        scraper = Scraper(timeout=5, compression="gzip")
+        scraper.download_captures()
+        scraper.download_captures()
+
+        assert sorted(os.listdir(str(tmpdir))) == ['.manifest.json', 'small.pcap.gz']
+        assert QuietHandler.statuses == [('/small.pcap', 200), ('/small.pcap', 304)]
+        with open_capture(os.path.join(str(tmpdir), 'small.pcap.gz')) as f:
+            assert f.read() == (served / "small.pcap").read_bytes()
 
-    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=test_urls):
-        mock_response = Mock()
-        mock_response.content = b'file content'
+def test_download_captures_conditional(tmpdir, capture_server):
+    """Test unchanged captures are not downloaded again"""
+    base_url, served = capture_server
+    test_urls = [f"{base_url}/small.pcap", f"{base_url}/large.pcapng"]
 
-        with patch('requests.get', return_value=mock_response), \
-             patch('netexplainer.scraper.DATASET_PATH', str(tmpdir)):
+    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=test_urls), \
+         patch('netexplainer.scraper.DATASET_PATH', str(tmpdir)):
 
-            scraper = Scraper()
-            scraper.download_captures()
+        scraper = Scraper(timeout=5)
+        scraper.download_captures()
+        (served / "small.pcap").write_bytes(b"small capture, updated")
+        QuietHandler.statuses.clear()
+        scraper.download_captures()
 
-            assert os.listdir(str(tmpdir)) == ['file.pcap']
-            with open(os.path.join(str(tmpdir), 'file.pcap'), 'rb') as f:
-                assert f.read() == b'file content'
+        assert sorted(QuietHandler.statuses) == [('/large.pcapng', 304), ('/small.pcap', 200)]
+        with open(os.path.join(str(tmpdir), 'small.pcap'), 'rb') as f:
+            assert f.read() == b"small capture, updated"
 
-def test_clean_raw_data_basic(tmpdir):
+        with open(os.path.join(str(tmpdir), '.manifest.json')) as f:
+            manifest = json.load(f)
+        entry = manifest[f"{base_url}/small.pcap"]
+        assert entry['size'] == len(b"small capture, updated")
+        assert entry['sha256'] == hashlib.sha256(b"small capture, updated").hexdigest()
+
+def test_download_captures_resume(tmpdir, capture_server):
+    """Test interrupted downloads are resumed with a range request"""
+    base_url, served = capture_server
+    url = f"{base_url}/large.pcapng"
+    content = (served / "large.pcapng").read_bytes()
+    etag = '"' + hashlib.sha256(content).hexdigest() + '"'
+
+    (tmpdir / "large.pcapng.part").write_binary(content[:100000])
+    (tmpdir / ".manifest.json").write(json.dumps({url: {"file": "large.pcapng", "etag": etag}}))
+
+    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=[url]), \
+         patch('netexplainer.scraper.DATASET_PATH', str(tmpdir)):
+
+        Scraper(timeout=5).download_captures()
+
+        assert QuietHandler.statuses == [('/large.pcapng', 206)]
+        assert sorted(os.listdir(str(tmpdir))) == ['.manifest.json', 'large.pcapng']
+        with open(os.path.join(str(tmpdir), 'large.pcapng'), 'rb') as f:
+            assert f.read() == content
+
+def test_clean_raw_data_basic(tmpdir, sample_packets):
     """Test basic file filtering"""
     raw_path = tmpdir.mkdir("raw")
     cleaned_path = tmpdir.mkdir("cleaned")
 
-    (raw_path / "valid.pcap").write("")
+    wrpcap(str(raw_path / "valid.pcap"), sample_packets)
     (raw_path / "invalid.txt").write("")
 
-    mock_packets = MagicMock()
-    mock_packets.__len__.return_value = 5
-
-    with patch('netexplainer.scraper.rdpcap', return_value=mock_packets) as mock_rdpcap, \
+    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=[]), \
          patch('netexplainer.scraper.DATASET_PATH', str(raw_path)), \
          patch('netexplainer.scraper.CLEANED_PATH', str(cleaned_path)):
 
         scraper = Scraper()
         scraper.clean_raw_data(max_packets=10, data_path=str(raw_path))
 
-        mock_rdpcap.assert_called_once_with(os.path.join(str(raw_path), "valid.pcap"))
-        assert os.listdir(str(cleaned_path)) == ['valid.pcap']
+        assert sorted(os.listdir(str(cleaned_path))) == ['.manifest.json', 'valid.pcap']
 
-def test_clean_raw_data_packet_count(tmpdir):
+def test_clean_raw_data_packet_count(tmpdir, sample_packets):
     """Test packet count filtering"""
     raw_path = tmpdir.mkdir("raw")
     cleaned_path = tmpdir.mkdir("cleaned")
-    (raw_path / "small.pcap").write("")
-    (raw_path / "large.pcap").write("")
-
-    def mock_rdpcap(path):
-        mock = MagicMock()
-        if "small" in path:
-            mock.__len__.return_value = 5
-        else:
-            mock.__len__.return_value = 15
-        return mock
+    wrpcap(str(raw_path / "small.pcap"), sample_packets[:5])
+    wrpcap(str(raw_path / "large.pcap"), sample_packets * 3)
+    wrpcap(str(raw_path / "empty.pcap"), [])
+    shutil.copy(str(raw_path / "small.pcap"), str(raw_path / "small2.pcap"))
 
-    with patch('netexplainer.scraper.rdpcap', side_effect=mock_rdpcap), \
+    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=[]), \
          patch('netexplainer.scraper.DATASET_PATH', str(raw_path)), \
          patch('netexplainer.scraper.CLEANED_PATH', str(cleaned_path)):
 
         scraper = Scraper()
         scraper.clean_raw_data(max_packets=10, data_path=str(raw_path))
 
-        assert os.listdir(str(cleaned_path)) == ['small.pcap']
+        assert sorted(os.listdir(str(cleaned_path))) == ['.manifest.json', 'small.pcap']
 
-def test_clean_raw_data_existing_dir(tmpdir):
-    """Test existing directory handling"""
-    from netexplainer.scraper import Scraper
+def test_clean_raw_data_existing_dir(tmpdir, sample_packets):
+    """Test existing cleaned files are linked to the raw captures or pruned"""
+    raw_path = tmpdir.mkdir("raw")
+    cleaned_path = tmpdir.mkdir("cleaned")
+    wrpcap(str(raw_path / "valid.pcap"), sample_packets)
+    (cleaned_path / "valid.pcap").write("stale copy")
+    (cleaned_path / "removed.pcap").write("")
 
+    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=[]), \
+         patch('netexplainer.scraper.DATASET_PATH', str(raw_path)), \
+         patch('netexplainer.scraper.CLEANED_PATH', str(cleaned_path)):
+
+        scraper = Scraper()
+        scraper.clean_raw_data(max_packets=10, data_path=str(raw_path))
+
+        assert sorted(os.listdir(str(cleaned_path))) == ['.manifest.json', 'valid.pcap']
+        assert os.path.samefile(str(raw_path / "valid.pcap"), str(cleaned_path / "valid.pcap"))
+
+def test_clean_raw_data_incremental(tmpdir, sample_packets, catalog):
+    """Test only new or changed captures are examined again"""
     raw_path = tmpdir.mkdir("raw")
     cleaned_path = tmpdir.mkdir("cleaned")
-    (cleaned_path / "existing.txt").write("")
+    wrpcap(str(raw_path / "small.pcap"), sample_packets[:5])
+    wrpcap(str(raw_path / "large.pcap"), sample_packets * 3)
 
-    with patch('netexplainer.scraper.DATASET_PATH', str(raw_path)), \
+    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=[]), \
+         patch('netexplainer.scraper.DATASET_PATH', str(raw_path)), \
          patch('netexplainer.scraper.CLEANED_PATH', str(cleaned_path)), \
-         patch('netexplainer.scraper.logger') as mock_logger:
+         patch('netexplainer.scraper.ProcessPoolExecutor', ThreadPoolExecutor), \
+         patch('netexplainer.scraper.count_records', wraps=count_records) as mock_count:
 
         scraper = Scraper()
         scraper.clean_raw_data(max_packets=10, data_path=str(raw_path))
+        assert mock_count.call_count == 2
+        assert sorted(os.listdir(str(cleaned_path))) == ['.manifest.json', 'small.pcap']
+
+        mock_count.reset_mock()
+        wrpcap(str(raw_path / "new.pcap"), sample_packets[:2])
+        scraper.clean_raw_data(max_packets=8, data_path=str(raw_path))
+        mock_count.assert_called_once_with(os.path.join(str(raw_path), "new.pcap"), 8)
+        assert sorted(os.listdir(str(cleaned_path))) == ['.manifest.json', 'new.pcap', 'small.pcap']
+
+        mock_count.reset_mock()
+        wrpcap(str(raw_path / "small.pcap"), sample_packets * 2)
+        os.remove(str(raw_path / "new.pcap"))
+        scraper.clean_raw_data(max_packets=100, data_path=str(raw_path))
+        assert sorted(call.args[0] for call in mock_count.call_args_list) == \
+            [os.path.join(str(raw_path), name) for name in ("large.pcap", "small.pcap")]
+        assert sorted(os.listdir(str(cleaned_path))) == ['.manifest.json', 'large.pcap', 'small.pcap']
+
+        with Catalog(catalog) as opened:
+            assert opened.select("cleaned") == [os.path.join(str(cleaned_path), name) for name in ("large.pcap", "small.pcap")]
 
-        mock_logger.info.assert_called_with(
-            f"Directory {cleaned_path} already exists and is not empty. Skipping creation."
-        )
-        assert len(os.listdir(str(cleaned_path))) == 1
+        with open(str(cleaned_path / ".manifest.json")) as f:
+            manifest = json.load(f)
+        assert manifest['small.pcap']['packets'] == len(sample_packets) * 2
+        assert manifest['small.pcap']['limit'] == 100
 
 def test_clean_raw_data_error_handling(tmpdir):
     """Test error handling during processing"""
@@ -113,7 +295,7 @@ def test_clean_raw_data_error_handling(tmpdir):
     cleaned_path = tmpdir.mkdir("cleaned")
     (raw_path / "corrupted.pcap").write(b"invalid data")
 
-    with patch('netexplainer.scraper.rdpcap', side_effect=Scapy_Exception("Invalid file")), \
+    with patch.object(Scraper, '_Scraper__get_download_urls', return_value=[]), \
          patch('netexplainer.scraper.DATASET_PATH', str(raw_path)), \
          patch('netexplainer.scraper.CLEANED_PATH', str(cleaned_path)), \
          patch('netexplainer.scraper.logger') as mock_logger:
@@ -121,7 +303,6 @@ def test_clean_raw_data_error_handling(tmpdir):
         scraper = Scraper()
         scraper.clean_raw_data(max_packets=10, data_path=str(raw_path))
 
-        mock_logger.error.assert_called_with(
-            "Error processing file corrupted.pcap: Invalid file"
-        )
-        assert len(os.listdir(str(cleaned_path))) == 0
+        mock_logger.error.assert_called_once()
+        assert mock_logger.error.call_args[0][0].startswith("Error processing file corrupted.pcap: ")
+        assert os.listdir(str(cleaned_path)) == ['.manifest.json']
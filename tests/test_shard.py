@@ -0,0 +1,60 @@
+import pytest
+from scapy.all import PcapWriter, PcapNgWriter
+from netexplainer.reader import read_records, shard_boundaries
+from netexplainer.shard import sharded_stats
+from netexplainer.sketch import TraceSketch
+from netexplainer.table import PacketTable
+
+
+@pytest.fixture(params=[PcapWriter, PcapNgWriter])
+def large_capture(request, tmp_path, sample_packets):
+    packets = []
+    for i in range(40):
+        for packet in sample_packets:
+            packet = packet.copy()
+            packet.time += i
+            packets.append(packet)
+    path = str(tmp_path / "large.pcap")
+    with request.param(path) as writer:
+        writer.write(packets)
+    return path
+
+
+@pytest.mark.parametrize("shards", [1, 3, 8, 1000])
+def test_shards_cover_every_record(large_capture, shards):
+    """Test the parts of a capture hold every record once and in order"""
+    boundaries = shard_boundaries(large_capture, shards)
+
+    assert 1 <= len(boundaries) <= shards
+    records = [record for shard in boundaries for record in read_records(large_capture, shard=shard)]
+    assert records == list(read_records(large_capture))
+
+
+def test_sharded_stats(large_capture):
+    """Test the statistics merged from the parts are the ones of a single pass"""
+    serial = PacketTable.from_file(large_capture).stats()
+    sharded = sharded_stats(large_capture, workers=3, min_shard_size=1)
+
+    assert vars(sharded) == vars(serial)
+    assert list(sharded.ip_count) == list(serial.ip_count)
+
+
+def test_sharded_sketch(large_capture):
+    """Test the sketches merged from the parts match the sketch of a single pass"""
+    serial = TraceSketch.from_records(read_records(large_capture), top_error=0.01)
+    sharded = sharded_stats(large_capture, workers=3, min_shard_size=1, approximate={"top_error": 0.01})
+
+    assert isinstance(sharded, TraceSketch)
+    assert (sharded.packets, sharded.total_size, sharded.start_time, sharded.end_time) == \
+        (serial.packets, serial.total_size, serial.start_time, serial.end_time)
+    assert sharded.protocol_count == serial.protocol_count
+    assert sharded.distinct_addresses.registers == serial.distinct_addresses.registers
+    assert sharded.top_addresses.top() == serial.top_addresses.top()
+
+
+def test_not_a_capture(tmp_path):
+    """Test files that are not plain pcap or pcapng are not split"""
+    path = tmp_path / "capture.txt"
+    path.write_text("not a capture")
+
+    assert shard_boundaries(str(path), 4) is None
@@ -0,0 +1,72 @@
+import random
+from netexplainer.analytics import answer_questions, ANALYTICS
+from netexplainer.sketch import HyperLogLog, SpaceSaving
+
+
+def test_hyperloglog():
+    """Test the distinct count is within the error bound"""
+    hll = HyperLogLog(error=0.02)
+    for i in range(100000):
+        hll.add(f"10.{i >> 16}.{(i >> 8) & 255}.{i & 255}")
+        hll.add(f"10.{i >> 16}.{(i >> 8) & 255}.{i & 255}")
+
+    assert hll.error <= 0.02
+    assert abs(hll.count() - 100000) <= 3 * hll.error * 100000
+
+
+def test_hyperloglog_small_and_merge():
+    """Test small counts and merging"""
+    a, b = HyperLogLog(), HyperLogLog()
+    for i in range(50):
+        a.add(f"a{i}")
+        b.add(f"b{i}")
+    assert a.count() == 50
+
+    a.merge(b)
+    assert a.count() == 100
+
+
+def test_space_saving():
+    """Test the top talker is found with a count within its error"""
+    random.seed(0)
+    stream = ["heavy"] * 5000 + [f"item{random.randrange(20000)}" for _ in range(45000)]
+    random.shuffle(stream)
+
+    summary = SpaceSaving(error=0.01)
+    for item in stream:
+        summary.add(item)
+
+    assert len(summary.counters) == summary.capacity == 100
+    [(item, count, error)] = summary.top()
+    assert item == "heavy"
+    assert count - error <= 5000 <= count
+    assert error <= summary.total / summary.capacity
+
+
+def test_approximate_answers(sample_pcap):
+    """Test approximate mode only changes the answers about addresses, and reports their error"""
+    exact = answer_questions(sample_pcap, ANALYTICS)
+    approximate = answer_questions(sample_pcap, ANALYTICS, approximate={"distinct_error": 0.05, "top_error": 0.1})
+
+    communicators = "How many unique communicators are present in the trace?"
+    most_common = "What is the IP that participates the most in communications in the trace?"
+    assert approximate[communicators].startswith(f"{exact[communicators]} (approximate, relative standard error ")
+    assert approximate[most_common] == f"{exact[most_common]} (approximate, appears 4 times, overestimated by at most 0)"
+    assert {q: a for q, a in approximate.items() if q not in (communicators, most_common)} == \
+        {q: a for q, a in exact.items() if q not in (communicators, most_common)}
+
+
+def test_space_saving_merge():
+    """Test merged summaries keep the top talker and bound its error by the total count"""
+    random.seed(1)
+    a, b = SpaceSaving(error=0.01), SpaceSaving(error=0.01)
+    for summary in (a, b):
+        for item in ["heavy"] * 2000 + [f"item{random.randrange(20000)}" for _ in range(8000)]:
+            summary.add(item)
+
+    a.merge(b)
+    [(item, count, error)] = a.top()
+    assert item == "heavy"
+    assert a.total == 20000
+    assert count - error <= 4000 <= count
+    assert error <= a.total / a.capacity
@@ -0,0 +1,21 @@
+from netexplainer.stats import TraceStats
+
+
+def test_from_file(sample_pcap, sample_packets):
+    """Test the statistics aggregated while streaming the capture"""
+    stats = TraceStats.from_file(sample_pcap)
+
+    assert stats.packets == len(sample_packets)
+    assert stats.total_size == sum(len(packet) for packet in sample_packets)
+    assert stats.ip_count["10.0.0.1"] == 4
+    assert len(stats.ip_count) == 5
+    assert stats.protocol_count == {'ICMP': 1, 'ICMPv6': 0, 'TCP': 2, 'UDP': 2}
+    assert float(stats.duration) == 1.5
+
+
+def test_empty():
+    """Test the statistics of a trace without packets"""
+    stats = TraceStats()
+
+    assert stats.packets == 0
+    assert stats.duration == 0
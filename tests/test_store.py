@@ -0,0 +1,55 @@
+import subprocess
+import pytest
+from scapy.all import PcapNgWriter, wrpcap
+from netexplainer.reader import capture_format, count_records, read_records
+from netexplainer.store import CODECS, capture_source, compress_capture, compression, open_capture, strip_compression
+
+
+@pytest.fixture(params=["pcap", "pcapng"])
+def capture(request, tmp_path, sample_packets):
+    path = str(tmp_path / f"sample.{request.param}")
+    if request.param == "pcap":
+        wrpcap(path, sample_packets * 50)
+    else:
+        with PcapNgWriter(path) as writer:
+            writer.write(sample_packets * 50)
+    return path
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_compressed_records(capture, codec, sample_packets, monkeypatch):
+    """Test compressed captures are read as a stream like uncompressed ones"""
+    expected = list(read_records(capture))
+    expected_format = capture_format(capture)
+    with open(capture, "rb") as f:
+        content = f.read()
+
+    compressed = compress_capture(capture, codec)
+    assert compressed == capture + {"gzip": ".gz", "zstd": ".zst"}[codec]
+    assert compression(compressed) == codec
+    assert strip_compression(compressed) == capture
+    with open_capture(compressed) as stream:
+        assert stream.read() == content
+
+    # Small buffers so the records are split across several of them
+    monkeypatch.setattr("netexplainer.reader.STREAM_BUFFER_SIZE", 512)
+    assert list(read_records(compressed)) == expected
+    assert count_records(compressed) == len(sample_packets) * 50
+    assert count_records(compressed, limit=10) == 11
+    assert capture_format(compressed) == expected_format
+
+
+def test_capture_source(tmp_path):
+    """Test tools read compressed captures from a pipe"""
+    path = str(tmp_path / "sample.pcap")
+    content = b"capture" * 100000
+    with open(path, "wb") as f:
+        f.write(content)
+
+    with capture_source(path) as (source, stdin):
+        assert (source, stdin) == (path, None)
+
+    compressed = compress_capture(path, "gzip")
+    with capture_source(compressed) as (source, stdin):
+        assert source == "-"
+        assert subprocess.check_output(["cat", source], stdin=stdin) == content
@@ -0,0 +1,40 @@
+from scapy.all import Ether, IP, TCP, wrpcap
+from netexplainer.summary import TraceSummary
+
+
+def test_summaries(sample_pcap):
+    """Test the summaries computed in one pass over the capture"""
+    summary = TraceSummary.from_file(sample_pcap)
+
+    assert summary.packets == 7
+    assert summary.hierarchy[("Ether",)] == [7, summary.total_size]
+    assert summary.hierarchy[("Ether", "IP", "TCP")][0] == 2
+    assert summary.hierarchy[("Ether", "ARP")][0] == 1
+    assert summary.endpoints["10.0.0.1"][0] == 2 and summary.endpoints["10.0.0.1"][2] == 2
+    assert sum(counts[0] for counts in summary.conversations.values()) == 6
+    assert sum(packets for packets, _ in summary.io_series.values()) == 7
+
+
+def test_bidirectional_conversations(tmp_path):
+    """Test both directions of a conversation are counted together"""
+    packets = [
+        Ether() / IP(src="10.0.0.1", dst="10.0.0.2") / TCP(sport=1234, dport=80),
+        Ether() / IP(src="10.0.0.2", dst="10.0.0.1") / TCP(sport=80, dport=1234),
+        Ether() / IP(src="10.0.0.1", dst="10.0.0.2") / TCP(sport=1235, dport=80),
+    ]
+    path = str(tmp_path / "conversations.pcap")
+    wrpcap(path, packets)
+
+    summary = TraceSummary.from_file(path)
+    assert summary.conversations[("TCP", "10.0.0.1", 1234, "10.0.0.2", 80)] == [2, 108]
+    assert summary.conversations[("TCP", "10.0.0.1", 1235, "10.0.0.2", 80)] == [1, 54]
+
+
+def test_to_text_top(sample_pcap):
+    """Test only the busiest conversations and endpoints are listed"""
+    text = TraceSummary.from_file(sample_pcap).to_text(top=2)
+
+    assert text.startswith("Packets: 7, ")
+    assert "... 4 more conversations" in text
+    assert "... 3 more endpoints" in text
+    assert "Protocol hierarchy:" in text and "I/O over time:" in text
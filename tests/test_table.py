@@ -0,0 +1,33 @@
+from netexplainer.stats import TraceStats
+from netexplainer.table import PacketTable, NO_ADDRESS
+
+
+def test_from_file(sample_pcap, sample_packets):
+    """Test the columns decoded from the capture"""
+    table = PacketTable.from_file(sample_pcap)
+
+    assert len(table) == len(sample_packets)
+    assert table.length.tolist() == [len(packet) for packet in sample_packets]
+    assert table.addresses[:3] == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    assert table.src[-1] == NO_ADDRESS and table.dst[-1] == NO_ADDRESS
+
+
+def test_stats_match_streaming(sample_pcap):
+    """Test the vectorized statistics against the streaming ones"""
+    table_stats = PacketTable.from_file(sample_pcap).stats()
+    stream_stats = TraceStats.from_file(sample_pcap)
+
+    assert table_stats.packets == stream_stats.packets
+    assert table_stats.total_size == stream_stats.total_size
+    assert list(table_stats.ip_count.items()) == list(stream_stats.ip_count.items())
+    assert table_stats.protocol_count == stream_stats.protocol_count
+    assert table_stats.duration == stream_stats.duration
+
+
+def test_empty_table():
+    """Test the statistics of a table without packets"""
+    stats = PacketTable.from_packets([]).stats()
+
+    assert stats.packets == 0
+    assert stats.ip_count == {}
+    assert stats.duration == 0